@@ -0,0 +1,10 @@
+"""
+Puts the repository folder on sys.path, so the tests import the modules through the
+particlepals package, whichever folder pytest is run from.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
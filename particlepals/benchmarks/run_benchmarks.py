@@ -0,0 +1,328 @@
+"""
+Benchmarks for the detection -> tracking -> velocity pipeline.
+Every benchmark is run at several problem sizes on synthetic data, and the timings are
+written to a JSON file together with the git commit and library versions, so results
+from two versions of the code can be compared to detect performance regressions.
+Components:
+    * benchmark - decorator that registers a benchmark and the sizes to run it at.
+    * run_benchmarks - times the registered benchmarks and returns the results.
+    * compare_results - compares two sets of results and lists the regressions.
+Examples:
+    # Run every benchmark and save the results
+    python run_benchmarks.py --output results/before.json
+    # Run a quick subset and compare it with earlier results
+    python run_benchmarks.py --quick --filter find_ --compare results/before.json
+    # Time the NumPy code even if numba is installed
+    python run_benchmarks.py --backend numpy
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+if __name__ == '__main__':
+    # Run as a script: make the particlepals package importable. Imported as a module
+    # (e.g. by the tests), it relies on the package being importable already.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(HERE)))
+
+from particlepals.particle_tracking import ParticleFinder as pf
+from particlepals.particle_tracking import PredictiveTracker as pt
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking import tracking_kernels as tk
+from particlepals.particle_tracking.detection_sweep import sweep_detection
+from particlepals.vector_analysis import read_and_reshape_csv as rrc
+from particlepals.vector_analysis import vector_operations as vo
+from particlepals.vector_analysis.generate_turbulent_velocity_field import generate_spectral_velocity_field
+
+# Registered benchmarks: name -> (setup function, sizes, quick sizes)
+BENCHMARKS = {}
+
+_scratch = {}
+
+
+def benchmark(name, sizes, quick_sizes=None):
+    """
+    Registers a benchmark. The decorated function takes a problem size, does all
+    the setup work, and returns a function without arguments that runs the code
+    being timed.
+
+    Parameters:
+        name (str): Name of the benchmark.
+        sizes (tuple): Problem sizes to run the benchmark at.
+        quick_sizes (tuple): Smaller sizes used with --quick. Defaults to the first size.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, tuple(sizes), tuple(quick_sizes or sizes[:1]))
+        return setup
+    return register
+
+
+def _scratch_dir():
+    """
+    Returns a temporary folder for benchmark files, removed when the run ends.
+    """
+    if 'dir' not in _scratch:
+        _scratch['dir'] = tempfile.TemporaryDirectory(prefix='particlepals_bench_')
+    return _scratch['dir'].name
+
+
+def _particle_image(side, particle_size, seed=0):
+    """
+    Renders a square uint8 image of randomly placed Gaussian particles.
+    """
+    rng = np.random.default_rng(seed)
+    n_particles = int(0.005 * side * side)
+    positions = rng.uniform(0, side - 1, size=(n_particles, 2))
+    return sm.render_particles(positions, (side, side), particle_size=particle_size,
+                               brightness=200, background=10, noise=2.0, rng=rng)
+
+
+def _velocity_grids(side, seed=0):
+    """
+    Returns x, y, u and v grids of a smooth random velocity field.
+    """
+    rng = np.random.default_rng(seed)
+    coordinates = np.arange(side, dtype=float)
+    x_grid, y_grid = np.meshgrid(coordinates, coordinates)
+    u_grid = np.sin(x_grid / 7.0) * np.cos(y_grid / 5.0) + 0.1 * rng.normal(size=x_grid.shape)
+    v_grid = -np.cos(x_grid / 7.0) * np.sin(y_grid / 5.0) + 0.1 * rng.normal(size=x_grid.shape)
+    return x_grid, y_grid, u_grid, v_grid
+
+
+def _grid_with_nans(side, fraction=0.1, seed=0):
+    """
+    Returns a square random grid with a fraction of its points set to NaN.
+    """
+    rng = np.random.default_rng(seed)
+    grid = rng.normal(size=(side, side))
+    grid[rng.random(grid.shape) < fraction] = np.nan
+    return grid
+
+
+@benchmark('find_particles', sizes=(256, 1024, 2048), quick_sizes=(256,))
+def bench_find_particles(side):
+    image = _particle_image(side, particle_size=1.0)
+    logs = np.insert(np.log(np.arange(1, 2**8 + 1)), 0, np.log(0.0001))
+    return lambda: pf.FindParticles(image, 40, logs)
+
+
+@benchmark('find_regions', sizes=(256, 1024, 2048), quick_sizes=(256,))
+def bench_find_regions(side):
+    image = _particle_image(side, particle_size=2.0)
+    return lambda: pf.FindRegions(image, 60, [4, 400])
+
+
+@benchmark('find_regions_tiled', sizes=(1024, 2048, 4096), quick_sizes=(512,))
+def bench_find_regions_tiled(side):
+    image = _particle_image(side, particle_size=2.0)
+    return lambda: pf.FindTiled(image, 60, [4, 400], tile_size=512, workers=os.cpu_count())
+
+
+@benchmark('detection_sweep', sizes=(256, 1024), quick_sizes=(256,))
+def bench_detection_sweep(side):
+    # Ten thresholds and three area limits on a sample of five frames
+    movie = np.stack([_particle_image(side, particle_size=1.5, seed=seed) for seed in range(5)])
+    return lambda: sweep_detection(movie, range(20, 120, 10), [1, [4, 100], [8, 100]], bground_name=[], invert=0)
+
+
+@benchmark('link_particles', sizes=(1000, 10000, 50000), quick_sizes=(1000,))
+def bench_link_particles(n_particles):
+    # About one particle per 100 square pixels, predicted to within half a pixel
+    rng = np.random.default_rng(0)
+    side = np.sqrt(100.0 * n_particles)
+    positions = rng.uniform(0, side, size=(n_particles, 2))
+    estimate = positions + rng.normal(0, 0.5, size=positions.shape)
+    positions = positions[rng.permutation(n_particles)]
+    return lambda: pt.LinkParticles(estimate, positions, 3)
+
+
+@benchmark('predictive_tracker', sizes=(128, 256, 512), quick_sizes=(128,))
+def bench_predictive_tracker(side):
+    frames = generate_spectral_velocity_field(16, 20, rms_velocity=1.0, seed=0)
+    movie, _ = sm.generate_synthetic_movie(frames, (side, side), seeding_density=0.002, noise=2.0)
+    return lambda: pt.Predictive_tracker(movie, 40, 3, None, 1, 0, 0, None, None, None, None, 1)
+
+
+@benchmark('differentiate_tracks', sizes=(100, 1000, 10000), quick_sizes=(100,))
+def bench_differentiate_tracks(n_tracks):
+    rng = np.random.default_rng(0)
+    tracks = []
+    for _ in range(n_tracks):
+        steps = rng.normal(size=(50, 2)).cumsum(axis=0)
+        tracks.append({'len': 50, 'X': list(steps[:, 0]), 'Y': list(steps[:, 1]), 'T': list(range(50))})
+    return lambda: pt.DifferentiateTracks(tracks, 3, 1)
+
+
+@benchmark('read_csv_file', sizes=(64, 256, 512), quick_sizes=(64,))
+def bench_read_csv_file(side):
+    file_path = os.path.join(_scratch_dir(), f'frame_{side}.csv')
+    rrc.convert_grid_to_csv(*_velocity_grids(side), file_path)
+    return lambda: rrc.read_csv_file(file_path)
+
+
+@benchmark('reshape_csv_file', sizes=(32, 64, 128), quick_sizes=(32,))
+def bench_reshape_csv_file(side):
+    columns = [grid.ravel() for grid in _velocity_grids(side)]
+    return lambda: rrc.reshape_csv_file(*columns)
+
+
+@benchmark('fill_nan_mean', sizes=(256, 1024, 2048), quick_sizes=(256,))
+def bench_fill_nan_mean(side):
+    grid = _grid_with_nans(side)
+    return lambda: vo.fill_in_nan_values_using_filter(grid, 'mean')
+
+
+@benchmark('fill_nan_median', sizes=(256, 1024, 2048), quick_sizes=(256,))
+def bench_fill_nan_median(side):
+    grid = _grid_with_nans(side)
+    return lambda: vo.fill_in_nan_values_using_filter(grid, 'median')
+
+
+@benchmark('flow_quantities', sizes=(256, 1024, 2048), quick_sizes=(256,))
+def bench_flow_quantities(side):
+    x_grid, y_grid, u_grid, v_grid = _velocity_grids(side)
+    return lambda: vo.calculate_flow_quantities(u_grid, v_grid, x_grid, y_grid)
+
+
+def _metadata():
+    """
+    Describes the code version and machine the benchmarks were run on.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'backend': 'numba' if tk.use_numba() else 'numpy',
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor_count': os.cpu_count()}
+
+
+def run_benchmarks(names=None, quick=False, repeat=5, verbose=True):
+    """
+    Times the registered benchmarks. Each one is run once to warm up and then
+    "repeat" more times; the minimum, median and mean times are recorded.
+
+    Parameters:
+        names (list): Names of the benchmarks to run. Defaults to all of them.
+        quick (bool): Run only the small sizes of each benchmark.
+        repeat (int): Number of timed runs of each benchmark and size.
+        verbose (bool): Print each result as it is measured.
+
+    Returns:
+        dict: 'metadata' about the run and 'results', which maps "name[size]" to the
+        name, size and timings in seconds.
+    """
+    results = {}
+    try:
+        for name, (setup, sizes, quick_sizes) in BENCHMARKS.items():
+            if names is not None and name not in names:
+                continue
+            for size in (quick_sizes if quick else sizes):
+                function = setup(size)
+                function()
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    function()
+                    times.append(time.perf_counter() - start)
+                key = f'{name}[{size}]'
+                results[key] = {'name': name, 'size': size, 'repeat': repeat,
+                                'min': min(times), 'median': float(np.median(times)),
+                                'mean': float(np.mean(times))}
+                if verbose:
+                    print(f'{key:32s} min {min(times) * 1e3:10.3f} ms   median {np.median(times) * 1e3:10.3f} ms')
+    finally:
+        if 'dir' in _scratch:
+            _scratch.pop('dir').cleanup()
+    return {'metadata': _metadata(), 'results': results}
+
+
+def compare_results(baseline, current, tolerance=0.2, statistic='min'):
+    """
+    Compares the timings of two benchmark runs.
+
+    Parameters:
+        baseline (dict): Results of the reference run, as returned by run_benchmarks.
+        current (dict): Results of the new run.
+        tolerance (float): Relative slowdown allowed before a result counts as a regression.
+        statistic (str): Timing to compare: 'min', 'median' or 'mean'.
+
+    Returns:
+        rows (list): (key, baseline time, current time, ratio) for every benchmark in both runs.
+        regressions (list): Keys of the benchmarks that slowed down by more than the tolerance.
+    """
+    rows = []
+    regressions = []
+    for key, result in current['results'].items():
+        if key not in baseline['results']:
+            continue
+        before = baseline['results'][key][statistic]
+        after = result[statistic]
+        ratio = after / before if before > 0 else np.inf
+        rows.append((key, before, after, ratio))
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+    return rows, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--output', help='JSON file for the results (default: results/<commit>.json)')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this text')
+    parser.add_argument('--quick', action='store_true', help='only run the smallest sizes')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark (default: 5)')
+    parser.add_argument('--compare', help='JSON file of earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative slowdown reported as a regression (default: 0.2)')
+    parser.add_argument('--backend', choices=tk.BACKENDS, help='kernel backend (default: the environment setting)')
+    parser.add_argument('--list', action='store_true', help='list the benchmarks and exit')
+    args = parser.parse_args(argv)
+    if args.backend:
+        tk.set_backend(args.backend)
+
+    if args.list:
+        for name, (_, sizes, quick_sizes) in BENCHMARKS.items():
+            print(f'{name:24s} sizes {sizes}  quick {quick_sizes}')
+        return 0
+
+    names = [name for name in BENCHMARKS if args.filter in name]
+    current = run_benchmarks(names, quick=args.quick, repeat=args.repeat)
+
+    output = args.output
+    if output is None:
+        label = (current['metadata']['commit'] or 'unversioned')[:12]
+        output = os.path.join(HERE, 'results', f'{label}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(current, file, indent=2)
+    print(f'Results saved to {output}')
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        rows, regressions = compare_results(baseline, current, args.tolerance)
+        for key, before, after, ratio in rows:
+            flag = '  REGRESSION' if key in regressions else ''
+            print(f'{key:32s} {before * 1e3:10.3f} ms -> {after * 1e3:10.3f} ms  x{ratio:5.2f}{flag}')
+        if regressions:
+            print(f'{len(regressions)} benchmark(s) slowed down by more than {args.tolerance:.0%}.')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Test the benchmark harness in the run_benchmarks module.
+"""
+import unittest
+import json
+import os
+
+from particlepals.benchmarks import run_benchmarks as rb
+
+class TestRunBenchmarks(unittest.TestCase):
+    """
+    Class for testing the benchmark runner and the comparison of results.
+    """
+
+    def test_run_quick_benchmark(self):
+        """
+        Test that a quick run records timings for the selected benchmark only.
+        """
+        current = rb.run_benchmarks(['fill_nan_mean'], quick=True, repeat=1, verbose=False)
+        self.assertEqual(list(current['results']), ['fill_nan_mean[256]'])
+        result = current['results']['fill_nan_mean[256]']
+        self.assertGreater(result['min'], 0)
+        self.assertLessEqual(result['min'], result['median'])
+        self.assertIn('numpy', current['metadata'])
+        # The results can be stored as JSON
+        json.dumps(current)
+
+    def test_compare_results(self):
+        """
+        Test that only slowdowns beyond the tolerance are reported as regressions.
+        """
+        baseline = {'results': {'a[1]': {'min': 1.0}, 'b[1]': {'min': 1.0}, 'c[1]': {'min': 1.0}}}
+        current = {'results': {'a[1]': {'min': 1.1}, 'b[1]': {'min': 1.5}, 'd[1]': {'min': 1.0}}}
+        rows, regressions = rb.compare_results(baseline, current, tolerance=0.2)
+        self.assertEqual([row[0] for row in rows], ['a[1]', 'b[1]'])
+        self.assertEqual(regressions, ['b[1]'])
+
+    def test_main_writes_json(self):
+        """
+        Test that the command line writes the results to the requested file.
+        """
+        output = 'test_benchmark_results.json'
+        try:
+            status = rb.main(['--quick', '--repeat', '1', '--filter', 'fill_nan_mean', '--output', output])
+            self.assertEqual(status, 0)
+            with open(output) as file:
+                self.assertIn('fill_nan_mean[256]', json.load(file)['results'])
+        finally:
+            if os.path.exists(output):
+                os.remove(output)
+
+if __name__ == '__main__':
+    unittest.main()
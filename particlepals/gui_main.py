@@ -2,15 +2,31 @@
 streamlit test file
 """
 import os
+import sys
+import threading
+import time
+from collections import OrderedDict
 
 import numpy as np
 import matplotlib.pyplot as plt
 import streamlit as st
 
 # add package parent directory to sys path
-
-from vector_analysis.read_and_reshape_csv import process_csv_folder, read_csv_file, reshape_csv_file
-from particle_tracking.PredictiveTracker import Predictive_tracker
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from particlepals.vector_analysis.read_and_reshape_csv import process_csv_folder
+from particlepals.vector_analysis.frame_viewer import FrameViewer, open_frame_stack
+from particlepals.particle_tracking.PredictiveTracker import Predictive_tracker
+from particlepals.job_manager import JobManager, CANCELLED, FAILED
+
+# Number of memory-mapped frame stacks and of tracking results
+# kept in the caches; the least recently used entries are evicted beyond these
+CACHE_MAX_STACKS = 16
+CACHE_MAX_RESULTS = 8
+# Number of background jobs run at the same time, for all sessions,
+# and seconds between two checks of a running job
+JOB_WORKERS = 2
+JOB_POLL_INTERVAL = 0.5
 
 def main():
     """
@@ -33,11 +49,20 @@ def main():
     )
     build_footer()
 
-    if 'button' not in st.session_state:
-        st.session_state.button = False
+    # ids of this session's background jobs, by name
+    if 'jobs' not in st.session_state:
+        st.session_state.jobs = {}
+
+    # button callbacks run once per click, before the rerun,
+    # so a job is submitted exactly once
+    def submit_job(name, function, *args):
+        job = job_manager().submit(function, *args, description=name)
+        st.session_state.jobs[name] = job.id
 
-    def click_button():
-        st.session_state.button = not st.session_state.button
+    def abort_job(name):
+        job_manager().cancel(st.session_state.jobs.get(name))
+
+    polling = False
 
     # Define sidebar data input
     data_path = st.sidebar.text_input("Data Path:", None)
@@ -128,8 +153,10 @@ def main():
                 endframe = st.sidebar.number_input("End Frame", step=1, min_value=startframe+1)
                 # framerange = st.sidebar.slider("Framerange")
                 invert = st.sidebar.radio("Invert", ("Bright", "Dark"))
-
-                framerange = np.arange(startframe, endframe)
+                threshold_block = st.sidebar.number_input(
+                    "Local Threshold Block", step=2, min_value=0,
+                    help="Compare particles with the mean of this many pixels around them, "
+                         "for uneven illumination. 0 uses one threshold for the whole frame.")
 
                 match invert:
                     case "Bright":
@@ -137,28 +164,13 @@ def main():
                     case "Dark":
                         invert = 1
 
-                submit = st.sidebar.button("Compute", on_click=click_button)
-
-                if st.session_state.button:
-                    try:
-                        Predictive_tracker(
-                            inputnames=data_file,
-                            threshold=threshold,
-                            max_disp=max_disp,
-                            minarea=min_area,
-                            invert=invert,
-                            framerange=framerange,
-                            bground_name=None,
-                            noisy=None,
-                            gifname=None,
-                            found=None,
-                            correct=None,
-                            yesvels=None
-                        )
-                    except FileNotFoundError as e:
-                        st.sidebar.text(f"Computation raised error: \n{e}" +
-                                        "\nCheck inputs."
-                                        )
+                st.sidebar.button("Compute", on_click=submit_job,
+                                  args=('Particle tracking', track_particles, data_file, threshold,
+                                        max_disp, min_area, invert, int(startframe), int(endframe),
+                                        int(threshold_block) or None))
+                st.sidebar.button("Abort", on_click=abort_job, args=('Particle tracking',))
+
+                vtracks, polling = show_job('Particle tracking', st.sidebar)
             else:
                 # for vector analysis, computation params are gathered from csv files in directory
                 # csv files should follow naming convention, but don't need to check for that here
@@ -166,17 +178,6 @@ def main():
                 data_file = f'frame_{i}.csv'
                 data_path = get_dir_path(data_path + data_file, 'frame_0.csv')
 
-                # update graphic
-                x_positions, y_positions, u_velocities, v_velocities = read_csv_file(os.path.join(data_path, data_file))
-                x_grid, y_grid, u_grid, v_grid = reshape_csv_file(x_positions, y_positions, u_velocities, v_velocities)
-                
-                fig = plt.figure(figsize=(4,4))
-                plt.quiver(x_grid, y_grid, u_grid, v_grid, scale=15, scale_units='xy', angles='xy', cmap='viridis')
-                plt.title(f'Turbulent Velocity Field')
-                plt.xlabel('X')
-                plt.ylabel('Y')
-                graphic.pyplot(fig,use_container_width=False)
-
                 operation = st.sidebar.radio("Operation",
                                             (
                                                 'add',
@@ -193,24 +194,32 @@ def main():
                 vector = (vector_x, vector_y)
 
                 # run other functions from particlepals package here,
-                # update inputs as required, and handle output
-                submit = st.sidebar.button("Compute", on_click=click_button)
-
-                if st.session_state.button:
-                    data_path_err.text(data_path)
-                    try:
-                        u_grid, v_grid, numbers = process_csv_folder(data_path, operation, vector)
-                        frame_num = st.slider('Frame', min_value=min(numbers), max_value=max(numbers))
-                        fig = plt.figure(figsize=(4,4))
-                        plt.quiver(x_grid, y_grid, u_grid, v_grid, scale=15, scale_units='xy', angles='xy', cmap='viridis')
-                        plt.title(f'Turbulent Velocity Field, Frame {frame_num}')
-                        plt.xlabel('X')
-                        plt.ylabel('Y')
-                        graphic.pyplot(fig,use_container_width=False)
-                    except FileNotFoundError as e:
-                        st.sidebar.text(f"Computation raised error: \n{e}" +
-                                        "\nCheck inputs."
-                                        )
+                # update inputs as required, and handle output;
+                # the processing is not cached, as every run writes a new folder
+                st.sidebar.button("Compute", on_click=submit_job,
+                                  args=('Vector analysis', process_csv_folder, data_path, operation, vector))
+                st.sidebar.button("Abort", on_click=abort_job, args=('Vector analysis',))
+
+                result, polling = show_job('Vector analysis', st.sidebar)
+                # browse the processed frames once the processing is done,
+                # and the input frames until then
+                browse_path = data_path
+                if result is not None:
+                    browse_path = latest_processed_folder(data_path) or data_path
+                    data_path_err.text(browse_path)
+                try:
+                    viewer = frame_viewer(browse_path)
+                except (FileNotFoundError, ValueError) as e:
+                    data_path_err.text(f"Could not read frames: \n{e}" +
+                                       "\nCheck path."
+                                       )
+                else:
+                    numbers = viewer.numbers
+                    frame_num = numbers[0]
+                    if len(numbers) > 1:
+                        frame_num = st.select_slider('Frame', options=numbers)
+                    if frame_num in numbers:
+                        graphic.pyplot(viewer.show_number(frame_num), use_container_width=False)
 
                 # # run other functions from particlepals package here,
                 # # update inputs as required, and handle output
@@ -234,6 +243,11 @@ def main():
     else:
         pass
 
+    # poll running jobs by rerunning the script until they finish
+    if polling:
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+
 # threshold: Sets the brightness threshold
 #   for particle identification.
 # max_disp: Maximum displacement allowed
@@ -248,6 +262,246 @@ def main():
 #   visualization options.
 
 
+def file_signature(path):
+    """
+    Identifies the current version of a file for the result caches,
+    so cached results are recomputed when the file changes.
+    Inputs:
+        path: path to the file.
+    Returns:
+        signature: (absolute path, modification time, size), or None
+            if the file does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def folder_signature(folder_path):
+    """
+    Identifies the current version of the csv files in a folder
+    for the result caches.
+    Inputs:
+        folder_path: path to the folder.
+    Returns:
+        signature: tuple of the file signatures of the csv files.
+    """
+    try:
+        names = sorted(name for name in os.listdir(folder_path) if name.lower().endswith('.csv'))
+    except OSError:
+        return None
+    return tuple(file_signature(os.path.join(folder_path, name)) for name in names)
+
+
+# The cached functions below take the file signature as an argument,
+# so editing or replacing a file invalidates its cached results.
+@st.cache_resource(max_entries=CACHE_MAX_STACKS, show_spinner=False)
+def load_frame_stack(folder_path, signature):
+    """
+    Opens the csv frames of a folder as a memory-mapped stack, cached.
+    The stack is built on disk the first time a folder is opened, so moving
+    the frame slider reads a single frame instead of parsing its csv file.
+    Inputs:
+        folder_path: path to the folder of csv frames.
+        signature: folder_signature(folder_path).
+    Returns:
+        x_grid, y_grid, u_stack, v_stack, numbers
+    """
+    return open_frame_stack(folder_path)
+
+
+def frame_viewer(folder_path):
+    """
+    Returns this session's FrameViewer of the frames in a folder. The viewer
+    keeps its figure and quiver between reruns, so showing another frame only
+    updates the arrows.
+    Inputs:
+        folder_path: path to the folder of csv frames.
+    Returns:
+        viewer: FrameViewer of the folder's frame stack.
+    """
+    signature = folder_signature(folder_path)
+    viewers = st.session_state.setdefault('viewers', {})
+    if signature not in viewers:
+        viewers.clear()
+        viewers[signature] = FrameViewer(*load_frame_stack(folder_path, signature))
+    return viewers[signature]
+
+
+def latest_processed_folder(folder_path):
+    """
+    Finds the newest folder written by process_csv_folder in a folder.
+    Inputs:
+        folder_path: path to the folder of csv frames.
+    Returns:
+        path: path to the newest '*_processed_*' subfolder, or None.
+    """
+    try:
+        entries = [entry for entry in os.scandir(folder_path)
+                   if entry.is_dir() and '_processed_' in entry.name]
+    except OSError:
+        return None
+    if not entries:
+        return None
+    return max(entries, key=lambda entry: entry.stat().st_mtime_ns).path
+
+
+@st.cache_resource
+def result_cache():
+    """
+    Least-recently-used store of tracking results, shared by all sessions of
+    the server. st.cache_data cannot be used for these computations because
+    they draw a progress bar while they run.
+    Returns:
+        cache: dict with the OrderedDict of 'results', the events of the
+            computations in progress ('pending') and the 'lock' of both.
+    """
+    return {'results': OrderedDict(), 'pending': {}, 'lock': threading.Lock()}
+
+
+def read_only(result):
+    """
+    Makes the arrays in a result read-only, so a result shared by several
+    sessions cannot be changed by one of them.
+    Inputs:
+        result: array, or list, tuple or dict holding arrays.
+    Returns:
+        result, with its arrays set read-only in place.
+    """
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif isinstance(result, dict):
+        for value in result.values():
+            read_only(value)
+    elif isinstance(result, (list, tuple)):
+        for value in result:
+            read_only(value)
+    return result
+
+
+def cached_result(key, compute):
+    """
+    Returns the cached result for key, or computes, stores and returns it.
+    Only pure computations, which write no files, may be cached.
+    A computation of key already running, e.g. for another session, is waited
+    for instead of being run again. The arrays of the result are read-only.
+    The least recently used results beyond CACHE_MAX_RESULTS are evicted.
+    Failed or cancelled computations are not stored.
+    Inputs:
+        key: hashable description of the computation and its inputs.
+        compute: function without arguments that computes the result.
+    Returns:
+        result of compute()
+    """
+    cache = result_cache()
+    while True:
+        with cache['lock']:
+            if key in cache['results']:
+                cache['results'].move_to_end(key)
+                return cache['results'][key]
+            pending = cache['pending'].get(key)
+            if pending is None:
+                pending = cache['pending'][key] = threading.Event()
+                break
+        # Wait for the running computation; if it fails, the next caller runs it
+        pending.wait()
+
+    try:
+        result = read_only(compute())
+        with cache['lock']:
+            cache['results'][key] = result
+            while len(cache['results']) > CACHE_MAX_RESULTS:
+                cache['results'].popitem(last=False)
+    finally:
+        with cache['lock']:
+            del cache['pending'][key]
+        pending.set()
+    return result
+
+
+def track_particles(data_file, threshold, max_disp, min_area, invert,
+                    startframe, endframe, threshold_block=None, progress=None):
+    """
+    Runs Predictive_tracker, cached by movie file and parameters.
+    Inputs:
+        data_file: path to the movie.
+        threshold, max_disp, min_area, invert: see Predictive_tracker.
+        startframe, endframe: first frame to track and the frame after the last.
+        threshold_block: block size of the local threshold, or None for a global one.
+        progress: optional ProgressReporter.
+    Returns:
+        vtracks: list of track dictionaries.
+    """
+    key = ('Predictive_tracker', file_signature(data_file), threshold, max_disp,
+           min_area, invert, startframe, endframe, threshold_block)
+    return cached_result(key, lambda: Predictive_tracker(
+        inputnames=data_file,
+        threshold=threshold,
+        max_disp=max_disp,
+        minarea=min_area,
+        invert=invert,
+        framerange=[startframe, endframe - 1],
+        bground_name=None,
+        noisy=None,
+        gifname=None,
+        found=None,
+        correct=None,
+        yesvels=None,
+        progress=progress,
+        threshold_block=threshold_block
+    ))
+
+
+@st.cache_resource
+def job_manager():
+    """
+    Job manager running the computations of all sessions of the server
+    in the background.
+    Returns:
+        manager: JobManager with JOB_WORKERS worker threads.
+    """
+    return JobManager(max_workers=JOB_WORKERS)
+
+
+def show_job(name, container):
+    """
+    Shows the state of this session's background job called name:
+    a progress bar while it runs, or a message if it failed or was cancelled.
+    Inputs:
+        name: name the job was submitted with.
+        container: streamlit container (e.g. st.sidebar) to draw in.
+    Returns:
+        result: result of the job once it is done, otherwise None.
+        running: True while the job is pending or running.
+    """
+    job = job_manager().get(st.session_state.jobs.get(name))
+    if job is None:
+        return None, False
+
+    if not job.finished_running:
+        progress = job.progress
+        if progress is None:
+            container.progress(0.0, text=f"{name}: waiting for a free worker...")
+        else:
+            text = f"{name} ({progress.stage}): {progress.completed}/{progress.total} frames"
+            if progress.rate > 0:
+                text += f", {progress.rate:.1f} frames/s"
+            if progress.eta is not None:
+                text += f", {progress.eta:.0f} s left"
+            container.progress(min(progress.fraction, 1.0), text=text)
+        return None, True
+
+    if job.status == CANCELLED:
+        container.text("Computation cancelled.")
+    elif job.status == FAILED:
+        container.text(f"Computation raised error: \n{job.error}" +
+                       "\nCheck inputs."
+                       )
+    return job.result, False
+
+
 def get_extension(path):
     '''
     Gets file extension from path.
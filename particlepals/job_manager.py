@@ -0,0 +1,187 @@
+"""
+Module for running long computations in the background for the GUI.
+A Streamlit script must finish quickly, so tracking and folder processing are
+submitted to a JobManager, which runs them on a pool of worker threads (NumPy,
+OpenCV and scikit-image release the GIL for most of the work). The script stores
+the job id in the session state and polls the job on every rerun until it is done.
+One JobManager is shared by all sessions, so several users can run jobs at once,
+up to the number of workers.
+Components:
+    * Job - state, progress and result of one submitted computation.
+    * JobManager - submits computations to the worker pool, and looks up and cancels jobs.
+Examples:
+    manager = JobManager(max_workers=2)
+    job = manager.submit(Predictive_tracker, movie, 40, 3, None, 1, 0, 0, None, None,
+                         None, None, 1, description='Tracking')
+    ...
+    job = manager.get(job.id)
+    if job.status == 'done':
+        vtracks = job.result
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .particle_tracking.progress import ProgressReporter, OperationCancelled
+
+# Job states
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    """
+    State of a computation submitted to a JobManager.
+
+    Attributes:
+        id (int): Unique number of the job.
+        description (str): Text describing the job, for display.
+        status (str): 'pending', 'running', 'done', 'failed' or 'cancelled'.
+        progress (Progress): Latest progress reported by the computation, or None.
+        result: Return value of the computation once it is done.
+        error (Exception): Exception raised by the computation if it failed.
+        submitted, started, finished (float): time.time() of each event, or None.
+    """
+
+    def __init__(self, job_id, description=''):
+        self.id = job_id
+        self.description = description
+        self.status = PENDING
+        self.progress = None
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def finished_running(self):
+        """
+        True once the job is done, failed or cancelled.
+        """
+        return self.status in FINISHED_STATES
+
+    def cancel(self):
+        """
+        Asks the job to stop. A pending job never starts; a running job stops at
+        its next progress update.
+        """
+        self.cancel_event.set()
+        if self.future is not None and self.future.cancel():
+            self.status = CANCELLED
+            self.finished = time.time()
+
+    def _set_progress(self, progress):
+        self.progress = progress
+
+
+class JobManager:
+    """
+    Runs computations on a pool of worker threads and keeps their state.
+
+    Submitted functions must accept a "progress" keyword argument; they receive a
+    ProgressReporter whose reports are stored in Job.progress and which raises
+    OperationCancelled when the job is cancelled. ParticleFinder_MHD,
+    Predictive_tracker and process_csv_folder all follow this convention.
+
+    Example:
+        >>> manager = JobManager(max_workers=2)
+        >>> job = manager.submit(process_csv_folder, folder_path, 'mean')
+        >>> manager.get(job.id).status
+        'running'
+    """
+
+    def __init__(self, max_workers=2, max_jobs=50):
+        """
+        Parameters:
+            max_workers (int): Number of jobs that can run at the same time.
+            max_jobs (int): Number of jobs kept; the oldest finished jobs, and their
+                results, are forgotten beyond this.
+        """
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='particlepals-job')
+        self._jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, description='', **kwargs):
+        """
+        Submits function(*args, progress=reporter, **kwargs) to the worker pool.
+
+        Parameters:
+            function (callable): The computation; must accept a "progress" keyword.
+            description (str): Text describing the job, for display.
+
+        Returns:
+            Job: The submitted job.
+        """
+        with self._lock:
+            job = Job(next(self._ids), description)
+            self._jobs[job.id] = job
+            self._forget_old_jobs()
+        job.future = self._executor.submit(self._run, job, function, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        """
+        Returns the job with the given id, or None if it is unknown or was forgotten.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        """
+        Returns a list of the known jobs, oldest first.
+        """
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """
+        Cancels the job with the given id, if it is known and not finished.
+        """
+        job = self.get(job_id)
+        if job is not None and not job.finished_running:
+            job.cancel()
+
+    def shutdown(self, cancel=True):
+        """
+        Stops the worker pool, cancelling the unfinished jobs unless cancel is False.
+        """
+        if cancel:
+            for job in self.jobs():
+                if not job.finished_running:
+                    job.cancel()
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job, function, args, kwargs):
+        if job.cancel_event.is_set():
+            job.status = CANCELLED
+            job.finished = time.time()
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        reporter = ProgressReporter(job._set_progress, cancel_event=job.cancel_event, min_interval=0.1)
+        try:
+            job.result = function(*args, progress=reporter, **kwargs)
+            job.status = DONE
+        except OperationCancelled:
+            job.status = CANCELLED
+        except Exception as error:
+            job.error = error
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+
+    def _forget_old_jobs(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_running]
+        for job_id in finished[:max(len(self._jobs) - self.max_jobs, 0)]:
+            del self._jobs[job_id]
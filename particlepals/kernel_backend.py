@@ -0,0 +1,71 @@
+"""
+Module for selecting the backend of the compiled kernels of particle_tracking
+(tracking_kernels) and vector_analysis (field_kernels), so one setting applies to
+both packages. The default is read once, when the module is imported, from the
+environment variable PARTICLEPALS_BACKEND, which also sets it for new processes.
+Components:
+    * BACKENDS - names of the backends: 'auto', 'numpy' and 'numba'.
+    * BACKEND_VARIABLE - environment variable holding the default backend.
+    * get_backend - returns the selected backend.
+    * set_backend - selects the backend.
+    * use_numba - tells whether the compiled kernels are used.
+Examples:
+    set_backend('numpy')
+    vtracks = Predictive_tracker(...)  # runs the NumPy code
+"""
+import os
+
+try:
+    import numba
+except ModuleNotFoundError:
+    numba = None
+
+BACKENDS = ('auto', 'numpy', 'numba')
+# Environment variable holding the default backend
+BACKEND_VARIABLE = 'PARTICLEPALS_BACKEND'
+
+
+def _default_backend():
+    """
+    Returns the backend given by the environment variable, or 'auto'.
+    """
+    backend = os.environ.get(BACKEND_VARIABLE, 'auto').lower()
+    return backend if backend in BACKENDS else 'auto'
+
+
+# Selected backend; the environment variable is only read once, for the default
+_backend = _default_backend()
+
+
+def get_backend():
+    """
+    Returns the selected backend: 'auto' (numba if it is installed), 'numpy' or 'numba'.
+    """
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Selects the backend of the compiled kernels, for particle_tracking and vector_analysis alike.
+
+    Parameters:
+        backend (str): 'auto', 'numpy' or 'numba'.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        ModuleNotFoundError: If 'numba' is selected and numba is not installed.
+    """
+    global _backend
+    backend = backend.lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'; choose from {', '.join(BACKENDS)}.")
+    if backend == 'numba' and numba is None:
+        raise ModuleNotFoundError("The 'numba' backend needs numba; install it with 'pip install numba'.")
+    _backend = backend
+
+
+def use_numba():
+    """
+    Returns True if the compiled kernels should be used.
+    """
+    return numba is not None and get_backend() != 'numpy'
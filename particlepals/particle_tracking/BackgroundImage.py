@@ -1,46 +1,47 @@
 import numpy as np
 from PIL import Image
-import glob
-import os
-import cv2
+
+from .frame_reader import FrameReader
 
 def BackgroundImage(inputnames, outputname='background.tif'):
     """
     Given a sequence of images or a video file, calculates the mean pixel values
     over time and saves the result as an image.
+    The frames are read through FrameReader, so they go into the shared frame
+    cache and ParticleFinder_MHD does not decode them again afterwards.
+
+    Inputs:
+        inputnames - movie file, image stack or glob pattern of images (see FrameReader).
+        outputname - name of the background image to write.
+    Outputs:
+        bg - the grayscale background image, in the type of the movie's frames
+            (e.g. uint16 for 12 and 16 bit movies).
+    Examples:
+        bg = BackgroundImage('movie.avi', 'background.tif')
     """
-    files = glob.glob(inputnames)
-    if not files:
-        raise ValueError(f"No files found for the pattern {inputnames}")
-    
-    # Determine the type of input (image sequence, tiff stack, or avi video)
-    if files[0].endswith('.avi'):
-        # Reading AVI file
-        cap = cv2.VideoCapture(files[0])
-        Nf = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        _, frame = cap.read()
-        bg0 = np.zeros_like(frame, dtype=np.float32)
-        for _ in range(Nf):
-            _, frame = cap.read()
-            bg0 += frame
-        cap.release()
-    elif files[0].endswith(('.tif', '.tiff', '.gif')):
-        # Reading TIFF/GIF stack
-        im = Image.open(files[0])
-        Nf = im.n_frames
-        bg0 = np.zeros((im.height, im.width, 3), dtype=np.float32)
-        for i in range(Nf):
-            im.seek(i)
-            bg0 += np.array(im)
+    with FrameReader(inputnames, gray=True) as reader:
+        dtype = reader.dtype
+        # Integer frames are summed exactly in 64 bit integers, in place
+        integer = np.issubdtype(dtype, np.integer)
+        bg0 = np.zeros((reader.height, reader.width), dtype=np.uint64 if integer else np.float64)
+        Nf = 0
+        for _, frame in reader.iter_frames():
+            np.add(bg0, frame, out=bg0, casting='unsafe')
+            Nf += 1
 
-    # Calculate the mean
-    bg = np.round(bg0 / Nf).astype(np.uint8)
+    if Nf == 0:
+        raise ValueError(f"No frames could be read from {inputnames}")
 
-    # Convert to grayscale if needed
-    if bg.shape[2] == 3:
-        bg = np.mean(bg, axis=2).astype(np.uint8)
+    # Calculate the mean, rounded half up for integer frames
+    if integer:
+        bg0 += Nf // 2
+        bg0 //= Nf
+        bg = bg0.astype(dtype)
+    else:
+        bg = np.round(bg0 / Nf).astype(dtype)
 
     # Save the result
     Image.fromarray(bg).save(outputname)
+    return bg
 
 #BackgroundImage('path/to/images/*.png')
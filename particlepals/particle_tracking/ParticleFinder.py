@@ -1,13 +1,239 @@
 import os
 import sys
+import math
 from PIL import Image
 import cv2
 import numpy as np
 import struct
 import glob
-from skimage import measure, morphology
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from scipy import ndimage
+from skimage import measure
 
-def ParticleFinder_MHD(inputnames, threshold, framerange=None, outputname=None, bground_name=None, arealim=None, invert=None, noisy=None):
+from .instrumentation import get_logger, get_timer
+from .frame_reader import FrameReader
+from . import tracking_kernels as kernels
+
+logger = get_logger('particle_finder')
+
+# Number of frames decoded ahead of the particle search
+PREFETCH_FRAMES = 4
+
+# Width in pixels of the square tiles of FindTiled
+TILE_SIZE = 1024
+
+# 4- and 8-connected neighborhoods for labelling regions
+_CROSS = ndimage.generate_binary_structure(2, 1)
+_SQUARE = ndimage.generate_binary_structure(2, 2)
+
+
+class DetectionWorkspace:
+    """
+    Scratch arrays reused by FindParticles and FindRegions from frame to frame,
+    so the per-pixel intermediate images (threshold masks, neighbor comparisons,
+    labels) are allocated once per frame size instead of once per frame.
+    A workspace must only be used by one thread at a time; get_workspace returns
+    one per thread.
+
+    Example:
+        >>> workspace = DetectionWorkspace()
+        >>> for frame in frames:
+        ...     pos = FindParticles(frame, threshold, logs, workspace)
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def buffer(self, name, shape, dtype):
+        """
+        Returns the scratch array called name, allocating it if it does not exist
+        yet or has another shape or type. Its content is undefined.
+        """
+        array = self._buffers.get(name)
+        if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+            array = np.empty(shape, dtype=dtype)
+            self._buffers[name] = array
+        return array
+
+    @property
+    def nbytes(self):
+        """
+        Total size of the scratch arrays in bytes.
+        """
+        return sum(array.nbytes for array in self._buffers.values())
+
+
+_workspaces = threading.local()
+
+
+def get_workspace():
+    """
+    Returns the DetectionWorkspace of the calling thread.
+    """
+    workspace = getattr(_workspaces, 'workspace', None)
+    if workspace is None:
+        workspace = _workspaces.workspace = DetectionWorkspace()
+    return workspace
+
+
+def image_bit_depth(image):
+    """
+    Returns the number of bits used by the pixel values of an integer image:
+    8 for uint8 images, and otherwise the smallest even number of bits, at least 8,
+    that holds the brightest pixel (e.g. 12 for a 12 bit camera saved as uint16).
+    Returns None for floating-point images.
+    """
+    if not np.issubdtype(image.dtype, np.integer):
+        return None
+    if image.dtype.itemsize == 1:
+        return 8
+    bits = max(int(image.max()).bit_length(), 8)
+    return bits + bits % 2
+
+
+def log_table(bit_depth):
+    """
+    Returns the look-up table of logarithms used by FindParticles for images of
+    the given bit depth: entry v + 1 holds log(v), and entry 0 a stand-in for log(0).
+    """
+    logs = np.log(np.arange(1, 2**bit_depth + 1))
+    return np.insert(logs, 0, np.log(0.0001))
+
+
+def _covering_log_table(im, x, y, logs):
+    """
+    Returns logs, or a larger table if the image is brighter than logs covers.
+    The neighbors of a maximum are darker than it, so the brightest maximum at
+    x, y tells whether every value looked up is covered.
+    """
+    if len(x) and int(im[x, y].max()) + 2 > len(logs):
+        return log_table(image_bit_depth(im[x, y]) or 16)
+    return logs
+
+
+def _native_threshold(threshold, dtype, inclusive):
+    """
+    Returns a threshold that selects the same pixels of an integer image as
+    "threshold" does, as a Python integer, so comparing the image with it needs
+    no conversion to floating point. Floating-point images and threshold arrays
+    (see LocalThreshold) keep the threshold.
+    """
+    if not np.issubdtype(dtype, np.integer) or np.ndim(threshold) > 0:
+        return threshold
+    if float(threshold).is_integer():
+        return int(threshold)
+    # v >= 40.5 is v >= 41, and v > 40.5 is v > 40
+    return math.ceil(threshold) if inclusive else math.floor(threshold)
+
+
+def LocalThreshold(im, threshold, block_size, k=0.0, workspace=None):
+    """
+     Returns a threshold for every pixel of "im" that follows uneven illumination:
+     the mean brightness of the block_size x block_size block around the pixel,
+     plus "threshold", plus k times the standard deviation of the block. The
+     block means are box filters, whose cost per pixel does not depend on the
+     block size. The result can be passed as the threshold of FindParticles and
+     FindRegions, so "threshold" keeps its meaning of the contrast a particle
+     must have against the background around it.
+
+    Inputs:
+        im - grayscale image
+        threshold - contrast above the local mean
+        block_size - width of the blocks in pixels (made odd)
+        k - weight of the local standard deviation
+        workspace - optional DetectionWorkspace holding the result
+    Outputs:
+        local - float32 threshold image, valid until the workspace is used again
+    Examples:
+        pos = FindParticles(frame, LocalThreshold(frame, 40, 31), logs)
+    """
+    if workspace is None:
+        workspace = get_workspace()
+    ksize = (int(block_size) | 1,) * 2
+    local = workspace.buffer('local_threshold', im.shape, np.float32)
+    cv2.boxFilter(im, cv2.CV_32F, ksize, dst=local, borderType=cv2.BORDER_REFLECT)
+    if k:
+        # Variance from the mean of the squares, in double precision for 16 bit images
+        variance = workspace.buffer('local_variance', im.shape, np.float64)
+        cv2.sqrBoxFilter(im, cv2.CV_64F, ksize, dst=variance, borderType=cv2.BORDER_REFLECT)
+        variance -= np.square(local, dtype=np.float64)
+        np.maximum(variance, 0, out=variance)
+        np.sqrt(variance, out=variance)
+        local += (k * variance).astype(np.float32)
+    local += np.float32(threshold)
+    return local
+
+
+def ReadBackground(bground_name, shape, dtype):
+    """
+     Reads the background image written by BackgroundImage, as a grayscale
+     image of the given type. Returns None if "bground_name" is empty or the
+     file does not exist.
+
+    Inputs:
+        bground_name - name of the background image
+        shape - (height, width) of the movie
+        dtype - type of the movie's frames
+    Outputs:
+        background - the background image, or None
+    Examples:
+        background = ReadBackground('background.tif', (reader.height, reader.width), reader.dtype)
+    """
+    if not bground_name or not os.path.exists(bground_name):
+        return None
+    background = np.array(Image.open(bground_name))
+    if background.ndim == 3:
+        background = cv2.cvtColor(background[..., :3], cv2.COLOR_RGB2GRAY)
+    if background.shape != tuple(shape):
+        raise ValueError(f"The background {bground_name} is {background.shape[1]}x{background.shape[0]} "
+                         f"pixels, but the movie is {shape[1]}x{shape[0]}.")
+    return background.astype(dtype, copy=False)
+
+
+def SubtractBackground(frame, background, invert, max_value=None, out=None):
+    """
+     Returns the contrast of the particles against the background, computed in
+     the type of the frame with saturating integer arithmetic (no upcasting):
+     frame - background if invert==0 (bright particles), background - frame if
+     invert==1 (dark particles), and |frame - background| if invert==-1.
+     Without a background, dark particles are found in max_value - frame, which
+     is zero for pixels brighter than max_value, and the frame is returned
+     unchanged otherwise. max_value defaults to the brightest value of the type
+     (2**16 - 1 for floating-point frames), which no frame can exceed.
+
+    Inputs:
+        frame - grayscale image
+        background - image of the same shape and type, or None
+        invert - 0, 1 or -1 (see ParticleFinder_MHD)
+        max_value - brightest possible pixel value, for invert==1 without background
+            (None: the brightest value of the frame's type)
+        out - optional array of the frame's shape and type for the result
+    Outputs:
+        contrast - the background-subtracted image
+    Examples:
+        contrast = SubtractBackground(frame, background, invert)
+    """
+    if background is None:
+        if invert != 1:
+            return frame
+        if max_value is None:
+            max_value = np.iinfo(frame.dtype).max if np.issubdtype(frame.dtype, np.integer) else 2**16 - 1
+        # Pixels brighter than a given max_value are clipped first, so the difference
+        # cannot wrap around
+        max_value = frame.dtype.type(max_value)
+        out = np.minimum(frame, max_value, out=out)
+        return np.subtract(max_value, out, out=out)
+    if invert == 0:
+        return cv2.subtract(frame, background, dst=out)
+    if invert == 1:
+        return cv2.subtract(background, frame, dst=out)
+    return cv2.absdiff(frame, background, dst=out)
+
+
+def ParticleFinder_MHD(inputnames, threshold, framerange=None, outputname=None, bground_name=None, arealim=None, invert=None, noisy=None, progress=None,
+                       threshold_block=None, threshold_k=0.0, tile_size=None, tile_workers=None, tile_halo=None):
     """
      Usage: [x,y,t,ang] = ParticleFinder(inputnames,threshold,[framerange],[outputname],[bground_name],[arealim],[invert],[noisy])
      Given a movie of particle motions, ParticleFinder identifies the
@@ -15,12 +241,16 @@ def ParticleFinder_MHD(inputnames, threshold, framerange=None, outputname=None,
      and t, respectively. The movie must be saved as a series of image files,
      an image stack in .tif or .gif format, or an uncompressed .avi file;
      specify the movie in "inputnames" (e.g., '0*.png' or 'stack.tif', or
-     'movie.avi'). To be identified as a particle, a part of the image must
+     'movie.avi'). A movie already in memory can be passed as a
+     (frames, height, width) numpy array. To be identified as a particle, a part of the image must
      have brightness that differs from the background by at least "threshold".
      If invert==0, ParticleFinder seeks particles brighter than the
      background; if invert==1, ParticleFinder seeks particles darker than the
      background; and if invert==-1, ParticleFinder seeks any sort of contrast.
-     The background is read from the file "bground_name"; see BackgroundImage.
+     The background is read from the file "bground_name", if it exists, and
+     subtracted from every frame; see BackgroundImage and SubtractBackground.
+     Frames are processed in their own type: 12 and 16 bit movies are neither
+     truncated to 8 bits nor converted to floating point.
      Frames outside the range specified by the two-element vector "framerange"
      are ignored. If arealim==1, ParticleFinder seeks single-pixel particles
      by comparing brightness to adjacent pixels (fast and good for small
@@ -28,6 +258,14 @@ def ParticleFinder_MHD(inputnames, threshold, framerange=None, outputname=None,
      by the two elements of the vector "arealim" (in square pixels; this
      method is better for tracking large particles). If "outputname" is not
      empty, particle positions are also saved as a binary file of that name.[]
+     If "progress" is given (see progress.ProgressReporter), it is updated after
+     every frame, and the search stops with OperationCancelled when cancelled.
+     If "threshold_block" is given, particles must instead differ by "threshold"
+     (plus "threshold_k" local standard deviations) from the mean of the
+     threshold_block x threshold_block pixels around them; see LocalThreshold.
+     If "tile_size" is given, large frames are searched in square tiles of that
+     width, by "tile_workers" threads at once, each with a halo of "tile_halo"
+     pixels; see FindTiled.
 
      Inputs:
         inputnames - name of the video file to be tracked
@@ -36,7 +274,16 @@ def ParticleFinder_MHD(inputnames, threshold, framerange=None, outputname=None,
         arelim - size of particle in pixels
         invert - invert the image
         noisy - plot the tracks
-        framerange - range of frames to be tracked
+        framerange - [first, last] 1-based frames to be tracked; only the first and
+            last elements are read, so range(11, 20) tracks frames 11 to 19
+        progress - optional ProgressReporter for progress and cancellation
+        threshold_block - block size in pixels of the local threshold (None: global threshold)
+        threshold_k - weight of the local standard deviation in the local threshold
+        tile_size - width of the tiles frames are searched in (None: whole frames)
+        tile_workers - number of threads searching the tiles of a frame, in one
+            pool of threads kept for the whole movie
+        tile_halo - pixels searched around each tile (None: the default of
+            FindTiled, which needs a largest area for regions)
     Outputs:
         x,y,t,ang - x,y coordinates of particle, time and angle
     Examples:
@@ -44,6 +291,7 @@ def ParticleFinder_MHD(inputnames, threshold, framerange=None, outputname=None,
     Dependencies:
         FindRegions
         FindParticles
+        FindTiled
     """
     framerange_default = [1, float('inf')]  # by default, all frames
     bground_name_default = 'background.tif'
@@ -70,107 +318,136 @@ def ParticleFinder_MHD(inputnames, threshold, framerange=None, outputname=None,
 
     writefile = outputname is not None
 
-    filepath, ext = os.path.splitext(inputnames)
-    names = glob.glob(inputnames)
-
-    if ext.lower() == '.avi':
-        movtype = 'avi'
-        v = cv2.VideoCapture(os.path.join(filepath, names[0]))
-        color_depth = 8  # Default assumption
-
-        ret, frame = v.read()
-        if frame.dtype == np.uint8:
-            color_depth = 2**8
-        ht, wd, _ = frame.shape
-        tmin = max(framerange[0], 1)
-        tmax = int(v.get(cv2.CAP_PROP_FRAME_COUNT))
-
-    elif len(names) == 1 and ext.lower() in ['.tif', '.tiff', '.gif']:
-        movtype = 'stack'
-        im = Image.open(os.path.join(filepath, names[0]))
-        color_depth = 2**im.bits
-        ht, wd = im.size
-        tmin = max(framerange[0], 1)
-        tmax = min(framerange[1], int(v.get(cv2.CAP_PROP_FRAME_COUNT)))
+    # Frames are read in order, so they are decoded in one sequential pass, and kept
+    # in the shared frame cache, so running again on the same movie skips decoding
+    reader = FrameReader(inputnames, gray=True)
+    movtype = reader.movtype
+    ht, wd = reader.height, reader.width
+
+    background = ReadBackground(bground_name, (ht, wd), reader.dtype)
+
+    tmin = max(framerange[0], 1)
+    tmax = int(min(framerange[-1], reader.n_frames))
+
+    # The look-up table of logarithms covers the bit depth of the data (and grows
+    # for brighter frames, see _covering_log_table). Dark particles without a
+    # background are found in the inverse of the frames, taken against the
+    # brightest value of their type, whatever the brightness of any one frame.
+    if background is None and invert == 1:
+        bit_depth = 8 * reader.dtype.itemsize if np.issubdtype(reader.dtype, np.integer) else 16
+    else:
+        bit_depth = image_bit_depth(reader.read(tmin - 1)) or 16
+    if background is not None:
+        bit_depth = max(bit_depth, image_bit_depth(background) or 16)
 
     Nf = tmax - tmin + 1
-    print(tmax);
-    print(tmin);
+    logger.info('Finding particles in frames %d to %d of %s.', tmin, tmax,
+                'an array' if movtype == 'array' else inputnames)
 
     if arealim == 1:
-        logs = np.log(np.arange(1, color_depth + 1))
-        logs = np.insert(logs, 0, np.log(0.0001))
+        logs = log_table(bit_depth)
     else:
         logs = []
-    
 
     N = 0
     x, y, t = [], [], []
     ang = []
-
-    memloc = 0
-    for ii in range(tmax):  # Loop over frames
-        if arealim > 1:
-            pos, ang1 = FindRegions(frame[ii], threshold, arealim)
-        else:
-            pos = FindParticles(frame[ii], threshold, logs)
-            ang1 = []
-
-        N = pos.shape[0]
-        if ii == 0:  # First frame, pre-allocate arrays for speed
-            x = np.full(N * Nf, np.nan)
-            y = np.full(N * Nf, np.nan)
-            t = np.full(N * Nf, np.nan)
-            if arealim != 1:
-                ang = np.full((N * Nf, 9), np.nan)  # Additional properties
-
-        if N > 0:
-            x[memloc:memloc + N] = pos[:, 0]
-            y[memloc:memloc + N] = pos[:, 1]
-            t[memloc:memloc + N] = ii
-            if arealim != 1:
-                ang= ang1
-            memloc += N
-
-        if ii % 25 == 0:  # Display progress every 25 frames
-            print(f'Found {N} particles in frame {ii + 1} of {Nf}.')
-
-        lastind = ii
-
-    # Trim the arrays to the actual size
-    x, y, t = x[:memloc], y[:memloc], t[:memloc]
-    if arealim != 1:
-        ang = ang[:memloc]
+    timer = get_timer()
+    # Scratch images reused for every frame of the movie
+    workspace = get_workspace()
+    if progress is not None:
+        progress.start(Nf, 'detect')
+
+    # A reader thread decodes the next frames while the particles are found
+    frames = reader.iter_frames(tmin - 1, tmax - 1, prefetch=0 if movtype == 'array' else PREFETCH_FRAMES)
+    # One pool of threads searches the tiles of every frame
+    executor = _tile_executor(tile_workers) if tile_size and tile_workers and tile_workers > 1 else None
+    try:
+        for _ in range(Nf):  # Loop over frames
+            # Wait for the next frame, converted to grayscale
+            with timer.stage('decode'):
+                ii, frame = next(frames, (None, None))
+            if frame is None:
+                break
+
+            if background is not None or invert == 1:
+                frame = SubtractBackground(frame, background, invert,
+                                           out=workspace.buffer('contrast', frame.shape, frame.dtype))
+
+            frame_threshold = threshold
+            if threshold_block:
+                with timer.stage('threshold'):
+                    frame_threshold = LocalThreshold(frame, threshold, threshold_block, threshold_k, workspace)
+
+            if tile_size:
+                pos, ang1 = FindTiled(frame, frame_threshold, arealim, logs, tile_size, tile_halo,
+                                      executor=executor)
+            elif arealim != 1:
+                pos, ang1 = FindRegions(frame, frame_threshold, arealim, workspace=workspace)
+            else:
+                pos = FindParticles(frame, frame_threshold, logs, workspace)
+                ang1 = []
+
+            N = pos.shape[0]
+            if N > 0:
+                x.append(pos[:, 0])
+                y.append(pos[:, 1])
+                t.append(np.full(N, ii))
+                if arealim != 1:
+                    ang.append(ang1)
+            timer.count('frames')
+            timer.count('particles', N)
+
+            if ii % 25 == 0:  # Report progress every 25 frames
+                logger.debug('Found %d particles in frame %d of %d.', N, ii + 1, Nf)
+            if progress is not None:
+                progress.update()
+
+            lastind = ii
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        frames.close()
+        reader.close()
+
+    # Join the particles of all frames
+    x = np.concatenate(x) if x else np.array([])
+    y = np.concatenate(y) if y else np.array([])
+    t = np.concatenate(t) if t else np.array([])
 
     # Sort by time
-    I = np.argsort(t)
+    I = np.argsort(t, kind='stable')
     x, y, t = x[I], y[I], t[I]
     if arealim != 1:
-        ang = ang
+        ang = np.concatenate(ang)[I] if ang else np.array([])
     else:
         ang = []
 
-    print(x)
-    print(y)
-    print(t)
-    print('Done.')
+    logger.info('Found %d particles in %d frames.', len(t), Nf)
     return x,y,t,ang
 
 
-def FindParticles(im, threshold, logs):
+def FindParticles(im, threshold, logs, workspace=None):
     """
      Given an image "im", FindParticles finds small particles that are
      brighter than their four nearest neighbors and also brighter than
-     "threshold". Particles are located to sub-pixel accuracy by applying a
+     "threshold", a number or an array of thresholds for every pixel (see
+     LocalThreshold). Particles are located to sub-pixel accuracy by applying a
      Gaussian fit in each spatial direction. The input "logs" depends on
-     the color depth and is re-used for speed. Particle locations are
+     the color depth and is re-used for speed (see log_table); it is extended
+     if the image is brighter than it covers. Particle locations are
      returned in the two-column array "pos" (with x-coordinates in the first
-     column and y-coordinates in the second).
+     column and y-coordinates in the second). The intermediate images are
+     written into the scratch arrays of "workspace" (by default the one of
+     the calling thread, see DetectionWorkspace). With the numba backend
+     (see tracking_kernels) and a single threshold, the search and the fits
+     are compiled loops that need no scratch arrays and give the same positions.
 
     Inputs:
         im - Image
-        threshold - threshold for finding particles
+        threshold - threshold for finding particles, or an array broadcastable to im
         logs - color depth
+        workspace - optional DetectionWorkspace
     Outputs:
         pos - position of the particle
     Examples:
@@ -178,54 +455,77 @@ def FindParticles(im, threshold, logs):
     Dependencies:
     """
     s = im.shape
-
-    # Identify the local maxima that are above the threshold
-    maxes = np.argwhere((im >= threshold) &
-                        (im > np.roll(im, 1, axis=1)) &
-                        (im > np.roll(im, -1, axis=1)) &
-                        (im > np.roll(im, 1, axis=0)) &
-                        (im > np.roll(im, -1, axis=0)))
-
-    # Throw out unreliable maxes in the outer ring
-    good = (maxes[:, 0] != 0) & (maxes[:, 1] != 0) & (maxes[:, 0] != s[0] - 1) & (maxes[:, 1] != s[1] - 1)
-    maxes = maxes[good]
-
-    # Find the horizontal and vertical positions
-    x, y = maxes[:, 0], maxes[:, 1]
-
-    # Look up the logarithms of the relevant image intensities
-    z1 = logs[im[np.clip(x-1, 0, s[0]-1), y] + 1]
-    z2 = logs[im[x, y] + 1]
-    z3 = logs[im[np.clip(x+1, 0, s[0]-1), y] + 1]
-
-    # Compute the centers
-    xcenters = -0.5 * (z1 * (-2*x - 1) + z2 * (4*x) + z3 * (-2*x + 1)) / (z1 + z3 - 2*z2)
-    z1 = logs[im[x, np.clip(y-1, 0, s[1]-1)] + 1]
-    z3 = logs[im[x, np.clip(y+1, 0, s[1]-1)] + 1]
-    ycenters = -0.5 * (z1 * (-2*y - 1) + z2 * (4*y) + z3 * (-2*y + 1)) / (z1 + z3 - 2*z2)
-
-    # Make sure we have no bad points
-    good = np.isfinite(xcenters) & np.isfinite(ycenters)
-
-    # Fix up the coordinate system (to match MATLAB's system)
-    pos = np.column_stack((ycenters[good], xcenters[good]))
+    timer = get_timer()
+    threshold = _native_threshold(threshold, im.dtype, True)
+    if np.ndim(threshold) > 0:
+        # Only the interior pixels are compared with their thresholds
+        threshold = np.broadcast_to(threshold, s)[1:-1, 1:-1]
+    elif kernels.use_numba():
+        # One compiled pass for the maxima and one over the maxima for the fits
+        with timer.stage('threshold'):
+            x, y = kernels.find_maxima(im, threshold)
+        with timer.stage('refine'):
+            return kernels.refine_maxima(im, x, y, _covering_log_table(im, x, y, logs))
+
+    if workspace is None:
+        workspace = get_workspace()
+
+    # Identify the local maxima that are above the threshold. Maxima in the outer
+    # ring are unreliable, so only the interior is compared with its neighbors.
+    with timer.stage('threshold'):
+        maxima = workspace.buffer('maxima', s, bool)
+        maxima[0, :] = maxima[-1, :] = maxima[:, 0] = maxima[:, -1] = False
+        inner = maxima[1:-1, 1:-1]
+        center = im[1:-1, 1:-1]
+        compare = workspace.buffer('compare', center.shape, bool)
+        np.greater_equal(center, threshold, out=inner)
+        for neighbor in (im[1:-1, :-2], im[1:-1, 2:], im[:-2, 1:-1], im[2:, 1:-1]):
+            np.greater(center, neighbor, out=compare)
+            inner &= compare
+        maxes = np.argwhere(maxima)
+
+    with timer.stage('refine'):
+        # Find the horizontal and vertical positions
+        x, y = maxes[:, 0], maxes[:, 1]
+        logs = _covering_log_table(im, x, y, logs)
+
+        # Look up the logarithms of the relevant image intensities
+        # (as integers, so the brightest value does not wrap around)
+        z1 = logs[im[x-1, y].astype(np.intp) + 1]
+        z2 = logs[im[x, y].astype(np.intp) + 1]
+        z3 = logs[im[x+1, y].astype(np.intp) + 1]
+
+        # Compute the centers
+        xcenters = -0.5 * (z1 * (-2*x - 1) + z2 * (4*x) + z3 * (-2*x + 1)) / (z1 + z3 - 2*z2)
+        z1 = logs[im[x, y-1].astype(np.intp) + 1]
+        z3 = logs[im[x, y+1].astype(np.intp) + 1]
+        ycenters = -0.5 * (z1 * (-2*y - 1) + z2 * (4*y) + z3 * (-2*y + 1)) / (z1 + z3 - 2*z2)
+
+        # Make sure we have no bad points
+        good = np.isfinite(xcenters) & np.isfinite(ycenters)
+
+        # Fix up the coordinate system (to match MATLAB's system)
+        pos = np.column_stack((ycenters[good], xcenters[good]))
 
     return pos
 
 
-def FindRegions(im, threshold, arealim, debug=False):
+def FindRegions(im, threshold, arealim, debug=False, workspace=None):
     """
         Given an image "im", FindRegions finds regions that are brighter than
         "thresold" and have area larger than "arealim". Region centroids are
         returned in the two-column array "pos" (with x-coordinates in the first
         column and y-coordinates in the second). Region orientations are
-        returned in radians, in the vector "ang".
+        returned in radians, in the vector "ang". The threshold mask and label
+        images are written into the scratch arrays of "workspace" (by default
+        the one of the calling thread, see DetectionWorkspace).
 
         Inputs:
             im - Image
-            threshold - threshold for finding particles
+            threshold - threshold for finding particles, or an array broadcastable to im
             arealim - size of particle in pixels
             Debug - Variable for debugging
+            workspace - optional DetectionWorkspace
         Outputs:
             pos, ang - position and angle of the particle
         Examples:
@@ -236,37 +536,170 @@ def FindRegions(im, threshold, arealim, debug=False):
         arealim = [arealim, np.inf]  # Assume single size is a minimum
 
     s = im.shape
-    inm = im > threshold
-    inm = morphology.remove_small_objects(inm, min_size=arealim[0])
-
-    props = measure.regionprops_table(inm.astype(int), intensity_image=im, 
-                                      properties=('centroid', 'area', 'mean_intensity', 
-                                                  'max_intensity', 'orientation', 
-                                                  'major_axis_length', 'minor_axis_length', 
-                                                  'weighted_centroid', 'perimeter'))
-
-    props = np.array([props[key] for key in props.keys()]).T  # Convert dict to array
-
-    # Check if weighted centroid should be used
-    weightedcentroid = True
-    if weightedcentroid:
-        pos = props[:, -2:]  # Weighted centroid
-    else:
-        pos = props[:, :2]  # Normal centroid
+    timer = get_timer()
+    if workspace is None:
+        workspace = get_workspace()
+    with timer.stage('threshold'):
+        inm = workspace.buffer('mask', s, bool)
+        labels = workspace.buffer('labels', s, np.int32)
+        np.greater(im, _native_threshold(threshold, im.dtype, False), out=inm)
+        # Remove the 4-connected pieces smaller than the minimum area,
+        # then label the 8-connected regions that remain
+        n_pieces = ndimage.label(inm, structure=_CROSS, output=labels)
+        keep = np.bincount(labels.ravel(), minlength=n_pieces + 1) >= arealim[0]
+        keep[0] = False
+        np.take(keep, labels, out=inm)
+        ndimage.label(inm, structure=_SQUARE, output=labels)
+
+    with timer.stage('refine'):
+        props = measure.regionprops_table(labels, intensity_image=im, 
+                                          properties=('centroid', 'area', 'mean_intensity', 
+                                                      'max_intensity', 'orientation', 
+                                                      'major_axis_length', 'minor_axis_length', 
+                                                      'weighted_centroid', 'perimeter'))
+
+        # Check if weighted centroid should be used
+        weightedcentroid = True
+        if weightedcentroid:
+            pos = np.column_stack((props['weighted_centroid-1'], props['weighted_centroid-0']))  # Weighted centroid
+        else:
+            pos = np.column_stack((props['centroid-1'], props['centroid-0']))  # Normal centroid
 
-    # Filtering regions based on area limits and removing regions on the edge
-    good = np.logical_and.reduce([pos[:, 0] != 1, pos[:, 1] != 1, 
-                                  pos[:, 0] != s[1], pos[:, 1] != s[0], 
-                                  props[:, 1] > arealim[0], props[:, 1] < arealim[1]])
+        # Filtering regions based on area limits and removing regions on the edge
+        good = np.logical_and.reduce([pos[:, 0] > 0, pos[:, 1] > 0, 
+                                      pos[:, 0] < s[1] - 1, pos[:, 1] < s[0] - 1, 
+                                      props['area'] >= arealim[0], props['area'] <= arealim[1]])
 
-    ang = props[good]
+        pos = pos[good]
+        ang = props['orientation'][good]
 
     # Debugging visualization (optional)
     if debug:
         import matplotlib.pyplot as plt
         plt.figure(figsize=(10, 10))
         plt.imshow(im, cmap='gray')
-        plt.scatter(pos[:, 1], pos[:, 0], c='r')
+        plt.scatter(pos[:, 0], pos[:, 1], c='r')
         plt.show()
 
-    return pos, ang
\ No newline at end of file
+    return pos, ang
+
+
+def _tile_halo(arealim):
+    """
+    Returns the default halo of FindTiled: one pixel for the neighbor comparisons
+    of single-pixel particles, and otherwise the largest area, as a region of that
+    area can be a line that many pixels long.
+
+    Raises:
+        ValueError: If the regions have no largest area.
+    """
+    if arealim == 1:
+        return 1
+    if not np.isfinite(arealim[1]):
+        raise ValueError("Regions without a largest area can be of any length; give the halo of the tiles.")
+    return int(np.ceil(arealim[1]))
+
+
+def _tile_executor(workers):
+    """
+    Returns a thread pool of "workers" threads for searching tiles.
+    """
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='particlepals-tile')
+
+
+def _find_in_tile(im, threshold, arealim, logs, core, halo):
+    """
+    Finds the particles of one tile and keeps those whose pixel lies in its core.
+    """
+    r0, r1, c0, c1 = core
+    ht, wd = im.shape
+    top, left = max(r0 - halo, 0), max(c0 - halo, 0)
+    window = (slice(top, min(r1 + halo, ht)), slice(left, min(c1 + halo, wd)))
+    if np.ndim(threshold) > 0:
+        threshold = np.broadcast_to(threshold, im.shape)[window]
+
+    if arealim == 1:
+        pos = FindParticles(im[window], threshold, logs)
+        ang = np.zeros(len(pos))
+    else:
+        pos, ang = FindRegions(im[window], threshold, arealim)
+    pos = pos + (left, top)
+
+    # Every particle belongs to the tile holding its pixel, so particles found in
+    # the halos of two tiles are kept once
+    col = np.floor(pos[:, 0] + 0.5)
+    row = np.floor(pos[:, 1] + 0.5)
+    owned = (row >= r0) & (row < r1) & (col >= c0) & (col < c1)
+    return pos[owned], ang[owned]
+
+
+def FindTiled(im, threshold, arealim=1, logs=None, tile_size=TILE_SIZE, halo=None, workers=None, executor=None):
+    """
+     Finds the particles of a large image tile by tile, so the intermediate
+     images (masks, labels, region properties) only ever cover one tile and
+     stay in the cache, and the tiles of one frame can be searched in
+     parallel. Each tile is searched together with a "halo" of the pixels
+     around it, and a particle is kept by the tile holding its pixel, so
+     particles near the tile edges are found exactly once. Single-pixel
+     particles (arealim==1, see FindParticles) are found exactly as in the
+     whole image. Regions (see FindRegions) are found as in the whole image
+     if they are no longer than the halo, which holds for every region within
+     the area limits with the default halo.
+
+    Inputs:
+        im - Image
+        threshold - threshold for finding particles, or an array broadcastable to im
+        arealim - 1 for FindParticles, otherwise the area limits of FindRegions
+        logs - table of logarithms for FindParticles (see log_table); defaults to
+            the bit depth of the image
+        tile_size - width in pixels of the square tiles
+        halo - pixels searched around each tile; defaults to 1 for single-pixel
+            particles and to the largest area for regions, and must be given for
+            regions without a largest area
+        workers - number of threads searching tiles at once (None: one)
+        executor - thread pool searching the tiles, e.g. one shared by all the
+            frames of a movie; if given, workers is ignored
+    Outputs:
+        pos, ang - positions and angles (zero for single-pixel particles), in the
+            order of the tiles
+    Raises:
+        ValueError: If the halo is not given for regions without a largest area.
+    Examples:
+        pos, ang = FindTiled(frame, threshold, [4, 400], tile_size=512, workers=4)
+    Dependencies:
+        FindParticles
+        FindRegions
+    """
+    if isinstance(arealim, (int, float)) and arealim != 1:
+        arealim = [arealim, np.inf]
+    if arealim == 1 and logs is None:
+        logs = log_table(image_bit_depth(im) or 16)
+    if halo is None:
+        halo = _tile_halo(arealim)
+
+    ht, wd = im.shape
+    cores = [(r0, min(r0 + tile_size, ht), c0, min(c0 + tile_size, wd))
+             for r0 in range(0, ht, tile_size) for c0 in range(0, wd, tile_size)]
+
+    def find(core):
+        return _find_in_tile(im, threshold, arealim, logs, core, halo)
+
+    # The tiles are searched in the context of the caller, so that their stages are
+    # timed by its timer (see instrumentation)
+    context = contextvars.copy_context()
+
+    def find_in_context(core):
+        return context.copy().run(find, core)
+
+    # Every thread searches its tiles with its own workspace (see get_workspace)
+    if executor is not None and len(cores) > 1:
+        results = list(executor.map(find_in_context, cores))
+    elif workers is not None and workers > 1 and len(cores) > 1:
+        with _tile_executor(workers) as executor:
+            results = list(executor.map(find_in_context, cores))
+    else:
+        results = [find(core) for core in cores]
+
+    pos = np.concatenate([result[0] for result in results]).reshape(-1, 2)
+    ang = np.concatenate([result[1] for result in results])
+    return pos, ang
@@ -5,10 +5,118 @@ import matplotlib.pyplot as plt
 import os
 import glob
 
-from particle_tracking.ParticleFinder import ParticleFinder_MHD
+from .ParticleFinder import ParticleFinder_MHD
+from .instrumentation import get_logger, get_timer
+from . import tracking_kernels as kernels
+
+logger = get_logger('tracker')
+
+# Number of tracks whose distances to the candidate particles are evaluated at
+# once; bounds the size of the temporary distance matrix.
+_LINK_CHUNK = 1024
+
+
+def LinkParticles(estimate, positions, max_disp):
+    """
+    LinkParticles(estimate, positions, max_disp)
+        Matches predicted track positions to the particles found in the next 
+        frame. Each track is linked to the particle nearest its predicted 
+        position provided that particle lies within "max_disp" pixels and is 
+        the unique nearest one. If several tracks claim the same particle, the 
+        track with the smallest distance keeps it (the earliest track wins a 
+        tie) and the others are left unlinked. With the numba backend (see 
+        tracking_kernels) the nearest particles are found by a compiled loop.
+
+        Inputs:
+            estimate - (n_tracks, 2) array of predicted x, y positions
+            positions - (n_particles, 2) array of x, y particle positions
+            max_disp - maximum distance between prediction and particle
+        Outputs:
+            links - index into positions for each track, or -1 for no link
+            costs - squared distance to the nearest particle for each track
+        Examples:
+            links, costs = LinkParticles(estimate, fr1, max_disp)
+    """
+    estimate = np.asarray(estimate, dtype=float).reshape(-1, 2)
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+    n_tracks = estimate.shape[0]
+    links = np.full(n_tracks, -1, dtype=np.intp)
+    costs = np.full(n_tracks, np.inf)
+    if n_tracks == 0 or positions.shape[0] == 0:
+        return links, costs
+
+    if kernels.use_numba():
+        # Compiled loop over the tracks, without the distance matrix
+        best, costs, unique = kernels.nearest_particles(estimate, positions)
+        links = np.where(unique & (costs <= max_disp**2), best, -1)
+    else:
+        for start in range(0, n_tracks, _LINK_CHUNK):
+            stop = min(start + _LINK_CHUNK, n_tracks)
+            dx = estimate[start:stop, 0, None] - positions[None, :, 0]
+            dy = estimate[start:stop, 1, None] - positions[None, :, 1]
+            dist = dx * dx + dy * dy
+            best = np.argmin(dist, axis=1)
+            cost = dist[np.arange(stop - start), best]
+            unique = np.sum(dist == cost[:, None], axis=1) == 1
+            ok = unique & (cost <= max_disp**2)
+            links[start:stop] = np.where(ok, best, -1)
+            costs[start:stop] = cost
+
+    # Resolve conflicts: the closest track keeps a contested particle
+    candidates = np.flatnonzero(links >= 0)
+    order = np.lexsort((candidates, costs[candidates], links[candidates]))
+    candidates = candidates[order]
+    claimed = links[candidates]
+    keep = np.ones(len(candidates), dtype=bool)
+    keep[1:] = claimed[1:] != claimed[:-1]
+    links[candidates[~keep]] = -1
+    return links, costs
+
+
+def DifferentiateTracks(tracks, fitwidth=3, filterwidth=1):
+    """
+    DifferentiateTracks(tracks, fitwidth, filterwidth)
+        Computes velocities along each track by convolving its positions with 
+        a Gaussian derivative kernel of width "filterwidth" spanning 
+        2*fitwidth+1 frames. Tracks shorter than the kernel are dropped, and 
+        "fitwidth" points are trimmed from both ends of the remaining tracks.
+
+        Inputs:
+            tracks - list of track dictionaries with keys len, X, Y, T 
+                (and optionally Theta)
+            fitwidth - half-width of the differentiation kernel in frames
+            filterwidth - width of the Gaussian filter in frames
+        Outputs:
+            vtracks - list of track dictionaries with keys len, X, Y, T, U, V 
+                (and Theta if present in the input)
+        Examples:
+            vtracks = DifferentiateTracks(tracks, 3, 1)
+    """
+    Av = 1.0 / (0.5 * filterwidth**2 * (np.sqrt(np.pi) * filterwidth * math.erf(fitwidth / filterwidth) - 2 * fitwidth * np.exp(-fitwidth**2 / filterwidth**2)))
+    vkernel = np.arange(-fitwidth, fitwidth + 1)
+    vkernel = Av * vkernel * np.exp(-vkernel**2 / filterwidth**2)
+
+    vtracks = []
+    for track in tracks:
+        if track['len'] < (2*fitwidth+1):
+            continue
+        X = np.asarray(track['X'], dtype=float)
+        Y = np.asarray(track['Y'], dtype=float)
+        vtrack = {'len': track['len'] - 2*fitwidth,
+                  'X': X[fitwidth:-fitwidth],
+                  'Y': Y[fitwidth:-fitwidth],
+                  'T': np.asarray(track['T'])[fitwidth:-fitwidth],
+                  'U': -np.convolve(X, vkernel, mode='valid'),
+                  'V': -np.convolve(Y, vkernel, mode='valid')}
+        if 'Theta' in track:
+            vtrack['Theta'] = np.asarray(track['Theta'])[fitwidth:-fitwidth]
+        vtracks.append(vtrack)
+    return vtracks
 
 def Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert,
-        noisy,framerange,gifname,found,correct,yesvels):
+        noisy,framerange,gifname,found,correct,yesvels,progress=None,
+        threshold_block=None,threshold_k=0.0,tile_size=None,tile_workers=None,
+        tile_halo=None):
     """
     Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert,
         noisy,framerange,gifname,found,correct,yesvels)
@@ -41,6 +149,14 @@ def Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert
         returned in "meanlength" and "rmslength", respectively. If noisy~=0, the 
         movie is repeated with overlaid velocity quivers and the tracks are 
         plotted. If noisy==2, each movie frame is also saved to disk as an image. 
+        If "progress" is given (see progress.ProgressReporter), it is updated 
+        after every frame of the 'detect' and 'link' stages, and tracking stops 
+        with OperationCancelled when it is cancelled. If "threshold_block" is 
+        given, the threshold is applied to the contrast against the mean of the 
+        surrounding block of pixels instead (see ParticleFinder.LocalThreshold), 
+        for movies with uneven illumination. If "tile_size" is given, frames are 
+        searched in tiles of that width, by "tile_workers" threads at once (see 
+        ParticleFinder.FindTiled), which bounds the memory used on large sensors. 
         Requires ParticleFinder.m; also requires read_uncompressed_avi.m for use 
         with .avi movies. This file can be downloaded from 
         http://leviathan.eng.yale.edu/software.
@@ -58,6 +174,13 @@ def Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert
             found - dictionary of found particles
             correct - dictionary of correct particles
             yesvels - calculate velocities
+            progress - optional ProgressReporter for progress and cancellation
+            threshold_block - block size of the local threshold (None: global threshold)
+            threshold_k - weight of the local standard deviation in the local threshold
+            tile_size - width of the tiles frames are searched in (None: whole frames)
+            tile_workers - number of threads searching the tiles of a frame
+            tile_halo - pixels searched around each tile; needed when minarea > 1,
+                as the regions then have no largest area (see ParticleFinder.FindTiled)
         Outputs:
             vtracks - dictionary of tracks
         Examples:
@@ -67,6 +190,7 @@ def Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert
             ParticleFinder_MHD
             """
 
+
     # Set defaults
     bground_name_default = 'background.tif'
     noisy_default = 0
@@ -90,11 +214,13 @@ def Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert
     if invert is None:
         invert = invert_default
     if noisy is None:
-        noise = noisy_default
+        noisy = noisy_default
     if framerange is None:
         framerange = framerange_default
     elif len(framerange) == 1:
-        framerange = framerange*[1, 1]
+        framerange = [framerange[0], framerange[0]]
+    elif len(framerange) > 2:
+        framerange = [framerange[0], framerange[-1]]
     if found is None:
         found = found_default
     if correct is None:
@@ -103,34 +229,16 @@ def Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert
         yesvels = 1
 
     # Find Particles in all frames
-    outputname = []
-    x = None
-    y = None
-    t = None
-    ang = None
-    
-    x,y,t,ang = ParticleFinder_MHD(inputnames,threshold,framerange,outputname,bground_name,minarea,invert,0)
-    found = {'x':x, 'y':y, 't':t, 'ang':ang}
-    tfound=t
-    print(x)
-    print(y)
-    print(t)
-
-    tt2 = np.arange(1, max(tfound)+1) 
-
-    
-    tt, beginsind = np.unique(tfound,return_index = True)
-    
-    
-    t, endsind = np.unique(tfound,return_index = True)
-    
-
-    ends = np.ones_like(tt2)
-    begins = ends.copy()
+    outputname = None
+    x,y,t,ang = ParticleFinder_MHD(inputnames,threshold,framerange,outputname,bground_name,minarea,invert,0,progress,
+                                   threshold_block,threshold_k,tile_size,tile_workers,tile_halo)
+    if len(t) == 0:
+        raise ValueError(f"Sorry, found no particles in: {inputnames}")
 
-    ends = endsind
-    begins = beginsind
-    tt = tt2
+    # Particles are sorted by frame; find where each frame begins and ends
+    tt = np.arange(t[0], t[-1] + 1)
+    begins = np.searchsorted(t, tt, side='left')
+    ends = np.searchsorted(t, tt, side='right')
 
     Nf = len(tt)
 
@@ -138,179 +246,101 @@ def Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert
         raise ValueError(f"Sorry, found too few files named: {inputnames}")
 
     # Setup array struct arrays for tracks
-    ind = range(31)
+    ind = np.arange(begins[0], ends[0])
     nparticles = len(ind)
     tracks = []
-    if minarea == 1:
-        for ii in range(nparticles):
-            tracks[ii] = {'len':1, 'X':x[ind[ii]], 'Y':y[ind[ii]], 'T':1}
-    else:
-        for ii in range(nparticles):
-            print("hello")
-            print(x[ii])
-            print(y[ii])
-            tracks.append({'len':1, 'X':[x[ii]], 'Y':[y[ii]], 'T':[1], 'Theta': 0})
-            print(tracks[ii])
-
-    # Keep track of which tracks are active
-    active = list(range(1, nparticles+1)) 
+    for ii in ind:
+        track = {'len':1, 'X':[x[ii]], 'Y':[y[ii]], 'T':[tt[0]]}
+        if minarea != 1:
+            track['Theta'] = [ang[ii]]
+        tracks.append(track)
+
+    # Keep track of which tracks are active, with their last two positions
+    active = np.arange(nparticles)
+    now = np.column_stack((x[ind], y[ind]))
+    prior = now.copy()
     n_active = len(active)
-    print(f"Processed frame 1 of {Nf}")
-    print(f"    Number of particles found: {nparticles}")
-    print(f"    Number of active tracks: {n_active}")
-    print(f"    Total number of tracks: {len(tracks)}")
-
-    if not x.shape[0] == 1:
-        x = x.T
-    if not y.shape[0] == 1:
-        y = y.T
+    timer = get_timer()
+    timer.count('tracks_started', nparticles)
+    if progress is not None:
+        progress.start(Nf, 'link')
+        progress.update()
+    logger.debug("Processed frame 1 of %d: %d particles, %d active tracks, %d tracks in total.",
+                 Nf, nparticles, n_active, len(tracks))
 
     # Loop over frames
-    for t in range(2, Nf+1): 
-
-        time = tt[t-1]
-
-    if begins[t-1] == 1 and t != 1:
-        nfr1 = 0
-        ind = []
-    else:
-       nfr1 = len(ind)
-
-    if nfr1 == 0:
-        print(f"Found no particles in frame {t}")
-        
+    for f in range(1, Nf):
+
+        time = tt[f]
+        ind = np.arange(begins[f], ends[f])
+        nfr1 = len(ind)
+
+        if nfr1 == 0:
+            logger.debug("Found no particles in frame %d", f+1)
+
+        fr1 = np.column_stack((x[ind], y[ind]))
+
+        with timer.stage('link'):
+            # Match the tracks with kinematic predictions
+            velocity = now - prior
+            estimate = now + velocity
+            links, costs = LinkParticles(estimate, fr1, max_disp)
+
+            matched = np.zeros(nfr1, dtype=bool)
+            for track_index, link in zip(active, links):
+                if link < 0:
+                    continue
+                track = tracks[track_index]
+                track['X'].append(fr1[link, 0])
+                track['Y'].append(fr1[link, 1])
+                track['T'].append(time)
+                if minarea != 1:
+                    track['Theta'].append(ang[ind[link]])
+                track['len'] += 1
+            matched[links[links >= 0]] = True
+
+            # Start new tracks from the unmatched particles
+            unmatched = np.flatnonzero(~matched)
+            for ii in unmatched:
+                track = {'len':1, 'X':[fr1[ii, 0]], 'Y':[fr1[ii, 1]], 'T':[time]}
+                if minarea != 1:
+                    track['Theta'] = [ang[ind[ii]]]
+                tracks.append(track)
+
+            linked = links >= 0
+            new_ids = np.arange(len(tracks) - len(unmatched), len(tracks))
+            active = np.concatenate((active[linked], new_ids))
+            prior = np.concatenate((now[linked], fr1[unmatched]))
+            now = np.concatenate((fr1[links[linked]], fr1[unmatched]))
+            n_active = len(active)
+
+        n_lost = len(linked) - np.count_nonzero(linked)
+        timer.count('tracks_started', len(unmatched))
+        timer.count('tracks_unmatched', n_lost)
+        logger.debug("Processed frame %d of %d: %d particles, %d active tracks, %d new tracks, "
+                     "%d tracks without a match, %d tracks in total.",
+                     f+1, Nf, nfr1, n_active, len(unmatched), n_lost, len(tracks))
+        if progress is not None:
+            progress.update()
 
-    fr1 = np.column_stack((x[ind], y[ind]))
-    if minarea != 1:
-        ang1 = []
-
-    # Match the tracks with kinematic predictions
-    now = np.zeros((n_active, 2))
-    prior = np.zeros((n_active, 2))
-
-    for ii in range(n_active):
-        print(tracks[active[ii]-1])
-        tr = tracks[active[ii]-1]
-        now[ii, 0] = tr['X'][0]
-        now[ii,1] = tr['Y'][0]
-        if tr['len'] > 1:
-            prior[ii, 1] = tr['X'][-2]
-            prior[ii, 2] = tr['Y'][-2]
-        else:
-            prior[ii, :] = now[ii, :]
-    
-    velocity = now - prior
-
-    estimate = now + velocity
-
-    costs = np.zeros(n_active)
-    links = np.zeros(n_active)
-
-   
-    if nfr1 > 0:
-        for ii in range(n_active):
-            dist_fr1 = np.sum((estimate[ii,:]-fr1)**2, axis = 1)
-            costs[ii] = np.min(dist_fr1)
-            if costs[ii] > max_disp**2:
-                continue
-            bestmatch = np.where(dist_fr1 == costs[ii])[0]
-            if len(bestmatch) != 1:
-                continue
-            ind = links == bestmatch
-            # if np.sum(ind) != 0:
-                # if costs[ind] > costs[ii]:
-                #     links[ind] = 0
-                # else:
-                #     continue
-            links[ii] = bestmatch
-
-        matched = np.zeros(nfr1)
-        for ii in range(n_active):
-            if links[ii] != 0:
-                print(links[ii])
-                tracks[active[ii] - 1]['X'].append(fr1[int(links[ii]),0])
-                tracks[active[ii] - 1]['Y'].append(fr1[int(links[ii]),1])
-                tracks[active[ii] - 1]['len'] += 1
-                tracks[active[ii] - 1]['T'].append(int(time))
-                matched[int(links[ii])] = 1
-                
-
-        unmatched = np.where(matched == 0)[0]
-        if minarea == 1:
-            for ii in range(len(unmatched)):
-                newtracks = {'len':1, 'X':fr1[unmatched[ii],0], 'Y':fr1[unmatched[ii],1], 'T':time}
-        else:
-            for ii in range(len(unmatched)):
-                newtracks = {'len':1, 'X':[fr1[unmatched[ii],0]], 'Y':[fr1[unmatched[ii],1]], 'T':[time], 'Theta':0}
-    else:
-        active = []
-        newtracks = []
-        unmatched = []
-        
-    active += list(range(len(tracks)+1, len(tracks)+len(newtracks)+1)) 
-    print(tracks)
-    print(newtracks)
-    tracks.append(newtracks)
-    n_active = len(active)
-    print(tracks)
-
-    print(f"Processed frame {t} of {Nf}")
-    print(f"    Number of particles found: {nfr1}")
-    print(f"    Number of active tracks: {n_active}")
-    print(f"    Number of new tracks started here: {len(unmatched)}")
-    print(f"    Number of tracks that found no match: {np.sum(links==0)}")
-    print(f"    Total number of tracks: {len(tracks)}")
-
-    vtracks = []
-    print(len(tracks))
-    
     if not yesvels:
-        print("hello")
-        for ii in range(len(tracks)):
-            if tracks[ii]['len'] == 1:
-                vtracks = tracks[ii]
-        ntracks = len(vtracks)
-        for ii in range(ntracks):
-            meanlength = np.mean(vtracks[ii]['len'])
-            rmslength = np.sqrt(np.mean(vtracks[ii]['len']**2))
-
-    
-    else:   
-
-        # Prune tracks that are too short
-        print("Pruning...")
-        print(len(vtracks))
-        for ii in range(len(tracks)):
-            if tracks[ii]['len'] >= (2*fitwidth+1):
-                tracks = tracks[ii]
-        ntracks = len(tracks)
-        for ii in range(ntracks):
-            meanlength = np.mean(tracks[ii]['len'])
-            rmslength = np.sqrt(np.mean(tracks[ii]['len']**2))
-
-        print('Differentiating...')
-        Av = 1.0 / (0.5 * filterwidth**2 * (np.sqrt(np.pi) * filterwidth * math.erf(fitwidth / filterwidth) - 2 * fitwidth * np.exp(-fitwidth**2 / filterwidth**2)))
-        vkernel = np.arange(-fitwidth, fitwidth)
-        vkernel = Av * vkernel * np.exp(-vkernel**2 / filterwidth**2)
-    
         vtracks = []
-        for ii in range(ntracks):
-            u = -np.convolve(tracks[ii]['X'], vkernel, mode = 'valid')
-            v = -np.convolve(tracks[ii]['Y'], vkernel, mode = 'valid')
-            if minarea == 1:
-                vtrack = {'len': tracks[ii]['len'] - 2*fitwidth,
-                        'X':tracks[ii]['X'][fitwidth:-fitwidth], 
-                        'Y':tracks[ii]['Y'][fitwidth:-fitwidth],
-                        'T':tracks[ii]['T'][fitwidth:-fitwidth],
-                        'U':u, 'V':v}
-            else:
-                print(tracks[ii]['X'])
-                vtrack = {'len': tracks[ii]['len'] - 2*fitwidth,
-                        'X':tracks[ii]['X'][0],
-                        'Y':tracks[ii]['Y'][0],
-                        'T':tracks[ii]['T'][0],
-                        'U':u, 'V':v, 'Theta':tracks[ii]['Theta']}
+        for track in tracks:
+            vtrack = {key: np.asarray(value) for key, value in track.items()}
+            vtrack['len'] = track['len']
             vtracks.append(vtrack)
+    else:
+        # Prune tracks that are too short and differentiate the rest
+        logger.debug("Pruning and differentiating %d tracks...", len(tracks))
+        with timer.stage('differentiate'):
+            vtracks = DifferentiateTracks(tracks, fitwidth, filterwidth)
+
+    ntracks = len(vtracks)
+    if ntracks > 0:
+        lengths = np.array([vtrack['len'] for vtrack in vtracks])
+        meanlength = np.mean(lengths)
+        rmslength = np.sqrt(np.mean(lengths**2))
+        logger.info("%d tracks: mean length %.1f, rms length %.1f", ntracks, meanlength, rmslength)
 
     # Plotting if needed
     
@@ -383,5 +413,4 @@ def Predictive_tracker(inputnames,threshold,max_disp,bground_name,minarea,invert
     #         video.release()
     #     plt.show()
 
-    print("Done.")
     return vtracks
@@ -0,0 +1,188 @@
+"""
+Module for choosing the detection parameters of ParticleFinder_MHD.
+Running the whole detection once per candidate threshold and particle area decodes
+and searches every frame again for every setting. A sweep decodes a sample of the
+frames once, and then evaluates all the settings on it: single-pixel particles are
+found once at the lowest threshold and counted per threshold from the brightness
+of their maxima, and regions are labelled once per threshold and minimum area and
+counted per area limit from the areas and centroids of the labels, without
+measuring their shapes.
+The counts are the ones ParticleFinder_MHD finds in the sampled frames.
+Components:
+    * sample_frames - decodes an evenly spaced sample of frames, with the background subtracted.
+    * sweep_detection - counts the particles found with every combination of thresholds and area limits.
+Examples:
+    results = sweep_detection('movie.avi', thresholds=range(20, 120, 10), arealims=[1, [4, 400]])
+    print(results[['threshold', 'arealim', 'particles_per_frame', 'spacing']])
+"""
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+
+from .frame_reader import FrameReader
+from .ParticleFinder import (FindParticles, ReadBackground, SubtractBackground,
+                             image_bit_depth, log_table)
+
+# 4- and 8-connected neighborhoods, as in FindRegions
+_CROSS = ndimage.generate_binary_structure(2, 1)
+_SQUARE = ndimage.generate_binary_structure(2, 2)
+
+# Number of frames decoded for a sweep
+SAMPLE_FRAMES = 10
+
+
+def sample_frames(inputnames, framerange=None, n_frames=SAMPLE_FRAMES, bground_name=None, invert=None):
+    """
+    Decodes an evenly spaced sample of the frames of a movie and prepares them as
+    ParticleFinder_MHD does: converted to grayscale, with the background subtracted.
+
+    Parameters:
+        inputnames (str or numpy.ndarray): Movie, as for ParticleFinder_MHD.
+        framerange (list): [first, last] 1-based frames to sample from. Defaults to all frames.
+        n_frames (int): Number of frames in the sample.
+        bground_name (str): Background image; defaults to 'background.tif' (see ReadBackground).
+        invert (int): 0, 1 or -1, as for ParticleFinder_MHD. Defaults to -1.
+
+    Returns:
+        frames (list): The prepared frames.
+        indices (numpy.ndarray): Their 0-based frame indices.
+    """
+    bground_name = 'background.tif' if bground_name is None else bground_name
+    invert = -1 if invert is None else invert
+    with FrameReader(inputnames, gray=True) as reader:
+        framerange = [1, reader.n_frames] if framerange is None else framerange
+        first = max(int(framerange[0]), 1) - 1
+        last = int(min(framerange[-1], reader.n_frames)) - 1
+        indices = np.unique(np.linspace(first, last, max(n_frames, 1)).round().astype(int))
+
+        background = ReadBackground(bground_name, (reader.height, reader.width), reader.dtype)
+        frames = []
+        for index in indices:
+            frame = reader.read(index)
+            if background is not None or invert == 1:
+                frame = SubtractBackground(frame, background, invert)
+            frames.append(frame)
+    return frames, indices
+
+
+def _normalize_arealim(arealim):
+    """
+    Returns 1 for single-pixel particles, and otherwise [minimum, maximum] area.
+    """
+    if np.ndim(arealim) == 0:
+        return 1 if arealim == 1 else [arealim, np.inf]
+    return [arealim[0], arealim[1]]
+
+
+def _count_maxima(frame, thresholds, logs):
+    """
+    Returns the number of single-pixel particles found at each threshold. The
+    maxima are found once at the lowest threshold; a maximum is found at a higher
+    threshold if its pixel, the one nearest its refined position, is bright enough.
+    """
+    pos = FindParticles(frame, min(thresholds), logs)
+    peaks = frame[np.floor(pos[:, 1] + 0.5).astype(np.intp), np.floor(pos[:, 0] + 0.5).astype(np.intp)]
+    return np.array([np.count_nonzero(peaks >= threshold) for threshold in thresholds])
+
+
+def _count_regions(frame, thresholds, arealims):
+    """
+    Returns the number of regions FindRegions finds for each threshold (rows) and
+    area limit (columns). The thresholded image is split into pieces once per
+    threshold, and the regions are labelled once per threshold and distinct
+    minimum area, as area limits with the same minimum only differ in the
+    maximum area of the regions they keep.
+    """
+    # Brightness-weighted pixel coordinates, for the weighted centroids
+    weights = frame.astype(np.float64).ravel()
+    rows, cols = np.indices(frame.shape)
+    weighted_rows = weights * rows.ravel()
+    weighted_cols = weights * cols.ravel()
+
+    # Columns of the area limits, grouped by their minimum area
+    by_min_area = {}
+    for jj, (min_area, max_area) in enumerate(arealims):
+        by_min_area.setdefault(min_area, []).append((jj, max_area))
+
+    counts = np.zeros((len(thresholds), len(arealims)), dtype=np.int64)
+    for ii, threshold in enumerate(thresholds):
+        pieces, n_pieces = ndimage.label(frame > threshold, structure=_CROSS)
+        piece_areas = np.bincount(pieces.ravel(), minlength=n_pieces + 1)
+        for min_area, columns in by_min_area.items():
+            keep = piece_areas >= min_area
+            keep[0] = False
+            labels, n_regions = ndimage.label(keep[pieces], structure=_SQUARE)
+            flat = labels.ravel()
+            areas = np.bincount(flat, minlength=n_regions + 1)[1:]
+            total = np.bincount(flat, weights=weights, minlength=n_regions + 1)[1:]
+            row = np.bincount(flat, weights=weighted_rows, minlength=n_regions + 1)[1:] / total
+            col = np.bincount(flat, weights=weighted_cols, minlength=n_regions + 1)[1:] / total
+            # The same edge and area tests as FindRegions
+            good = ((col > 0) & (row > 0) & (col < frame.shape[1] - 1) & (row < frame.shape[0] - 1)
+                    & (areas >= min_area))
+            for jj, max_area in columns:
+                counts[ii, jj] = np.count_nonzero(good & (areas <= max_area))
+    return counts
+
+
+def sweep_detection(inputnames, thresholds, arealims=(1,), framerange=None, n_frames=SAMPLE_FRAMES,
+                    bground_name=None, invert=None, progress=None):
+    """
+    Counts the particles ParticleFinder_MHD finds in a sample of frames with every
+    combination of thresholds and area limits, decoding the frames only once.
+
+    Parameters:
+        inputnames (str or numpy.ndarray): Movie, as for ParticleFinder_MHD.
+        thresholds (iterable): Thresholds to try.
+        arealims (iterable): Area limits to try: 1 for single-pixel particles, a
+            minimum area, or [minimum, maximum] area.
+        framerange (list): [first, last] 1-based frames to sample from.
+        n_frames (int): Number of frames in the sample.
+        bground_name (str), invert (int): As for ParticleFinder_MHD.
+        progress (ProgressReporter): Optional, updated after every sampled frame.
+
+    Returns:
+        pandas.DataFrame: One row per setting, with the columns threshold, arealim,
+            particles (found in the whole sample), particles_per_frame, density
+            (particles per pixel in a frame) and spacing (mean distance in pixels
+            between neighboring particles, for choosing max_disp).
+
+    Raises:
+        ValueError: If no thresholds or area limits are given.
+    """
+    thresholds = list(thresholds)
+    arealims = [_normalize_arealim(arealim) for arealim in arealims]
+    if not thresholds or not arealims:
+        raise ValueError("At least one threshold and one area limit are needed.")
+
+    frames, _ = sample_frames(inputnames, framerange, n_frames, bground_name, invert)
+    regions = [arealim for arealim in arealims if arealim != 1]
+    logs = log_table(max(image_bit_depth(frame) or 16 for frame in frames))
+    if progress is not None:
+        progress.start(len(frames), 'sweep')
+
+    # counts[threshold index, arealim index], summed over the sample
+    counts = np.zeros((len(thresholds), len(arealims)), dtype=np.int64)
+    pixel_column = [jj for jj, arealim in enumerate(arealims) if arealim == 1]
+    region_columns = [jj for jj, arealim in enumerate(arealims) if arealim != 1]
+    for frame in frames:
+        if pixel_column:
+            counts[:, pixel_column] += _count_maxima(frame, thresholds, logs)[:, None]
+        if regions:
+            counts[:, region_columns] += _count_regions(frame, thresholds, regions)
+        if progress is not None:
+            progress.update()
+
+    n_pixels = frames[0].size
+    rows = []
+    for ii, threshold in enumerate(thresholds):
+        for jj, arealim in enumerate(arealims):
+            per_frame = counts[ii, jj] / len(frames)
+            density = per_frame / n_pixels
+            rows.append({'threshold': threshold,
+                         'arealim': arealim if arealim == 1 else tuple(arealim),
+                         'particles': int(counts[ii, jj]),
+                         'particles_per_frame': per_frame,
+                         'density': density,
+                         'spacing': 1 / np.sqrt(density) if density > 0 else np.inf})
+    return pd.DataFrame(rows)
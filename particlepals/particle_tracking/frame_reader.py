@@ -0,0 +1,370 @@
+"""
+Module for reading the frames of a movie in order, with cheap random access.
+Seeking a compressed video decodes everything from the previous keyframe, so
+setting the position before every read decodes each frame many times over.
+A FrameReader decodes a range of frames in one sequential pass and only seeks when
+a frame is requested out of order. The decoded frames are kept in a process-wide
+least-recently-used cache with a byte budget, shared by every reader, so background
+estimation, detection and overlay rendering of the same clip, or detection
+repeated while tuning its parameters, decode each frame only once.
+Components:
+    * FrameCache - least-recently-used store of decoded frames, bounded in bytes.
+    * get_frame_cache - returns the cache shared by all readers.
+    * set_frame_cache_budget - changes the byte budget of the shared cache.
+    * FrameReader - reads the frames of a video, a TIFF/GIF stack, an image sequence or an array,
+      optionally decoding ahead on a background thread while the caller processes frames.
+Examples:
+    with FrameReader('movie.avi', gray=True) as reader:
+        for index, frame in reader.iter_frames(10, 99):
+            pos = FindParticles(frame, threshold, logs)
+        previous = reader.read(98)  # from the cache
+    # Decode up to 4 frames ahead while the detection runs
+    for index, frame in reader.iter_frames(prefetch=4):
+        pos = FindParticles(frame, threshold, logs)
+    # Allow 1 GB of decoded frames
+    set_frame_cache_budget(2**30)
+"""
+import glob
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# File extensions decoded with cv2.VideoCapture
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mov', '.mkv', '.wmv')
+# File extensions read with PIL, where a single file may hold a stack of frames
+STACK_EXTENSIONS = ('.tif', '.tiff', '.gif')
+# Default byte budget of the shared frame cache
+DEFAULT_CACHE_BYTES = 256 * 2**20
+
+
+class FrameCache:
+    """
+    Least-recently-used store of decoded frames, bounded by the total number of
+    bytes of the frames it holds. It is safe to use from several threads.
+
+    Example:
+        >>> cache = FrameCache(max_bytes=2**26)
+        >>> cache.put(key, frame)
+        >>> cache.get(key) is frame
+        True
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        """
+        Parameters:
+            max_bytes (int): Largest total size of the cached frames; 0 disables caching.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, key):
+        """
+        Returns the frame stored under key, or None.
+        """
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._frames.move_to_end(key)
+            return frame
+
+    def put(self, key, frame):
+        """
+        Stores a frame, evicting the least recently used frames beyond the budget.
+        Frames larger than the whole budget are not stored.
+        """
+        if frame.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._frames.pop(key, None)
+            if previous is not None:
+                self.nbytes -= previous.nbytes
+            self._frames[key] = frame
+            self.nbytes += frame.nbytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """
+        Changes the byte budget, evicting frames if it shrank.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """
+        Removes every frame.
+        """
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+    def _evict(self):
+        while self.nbytes > self.max_bytes:
+            _, frame = self._frames.popitem(last=False)
+            self.nbytes -= frame.nbytes
+
+
+_shared_cache = FrameCache()
+
+
+def get_frame_cache():
+    """
+    Returns the frame cache shared by all FrameReaders of the process.
+    """
+    return _shared_cache
+
+
+def set_frame_cache_budget(max_bytes):
+    """
+    Sets the byte budget of the shared frame cache; 0 disables it.
+    """
+    _shared_cache.resize(max_bytes)
+
+
+class FrameReader:
+    """
+    Reads the frames of a movie by 0-based index.
+
+    The movie can be a video file, a multi-page TIFF or GIF, a glob pattern of
+    image files (one frame per file, in sorted order), or a (frames, height, width)
+    array. Frames read from files are stored in a FrameCache, by default the one
+    shared by the whole process, under (source, frame index, ROI, dtype); the source
+    includes the modification time and size of the file, so an edited movie is
+    decoded again. Frames are returned read-only, since they may be shared through
+    the cache; copy a frame before drawing on it.
+
+    Example:
+        >>> reader = FrameReader('movie.avi')
+        >>> reader.n_frames, reader.height, reader.width
+        (100, 480, 640)
+        >>> frame = reader.read(5)
+    """
+
+    def __init__(self, source, gray=False, roi=None, dtype=None, cache=None):
+        """
+        Parameters:
+            source (str or numpy.ndarray): Path or glob pattern of the movie, or the movie itself.
+            gray (bool): Convert color frames to grayscale.
+            roi (tuple): (row start, row stop, column start, column stop) of the part
+                of the frames to return. Defaults to the whole frame.
+            dtype (numpy.dtype): Type the frames are converted to. Defaults to the type
+                they are stored in.
+            cache (FrameCache): Cache of decoded frames. Defaults to the shared cache;
+                False disables caching.
+        """
+        self.source = source
+        self.gray = gray
+        self.roi = None if roi is None else tuple(int(limit) for limit in roi)
+        self._convert = None if dtype is None else np.dtype(dtype)
+        self._capture = None
+        self._image = None
+        self._position = None
+        self.fps = None
+
+        if isinstance(source, np.ndarray):
+            self.movtype = 'array'
+            self.names = []
+            self.n_frames = source.shape[0]
+        else:
+            self.names = sorted(glob.glob(source))
+            if not self.names:
+                raise FileNotFoundError(f"No files found for the pattern {source}")
+            ext = os.path.splitext(self.names[0])[1].lower()
+            if ext in VIDEO_EXTENSIONS:
+                self.movtype = 'video'
+                self._capture = cv2.VideoCapture(self.names[0])
+                if not self._capture.isOpened():
+                    raise FileNotFoundError(f"Could not open the movie '{self.names[0]}'.")
+                self.n_frames = int(self._capture.get(cv2.CAP_PROP_FRAME_COUNT))
+                self.fps = self._capture.get(cv2.CAP_PROP_FPS) or None
+                self._position = 0
+            elif len(self.names) == 1 and ext in STACK_EXTENSIONS:
+                self.movtype = 'stack'
+                self._image = Image.open(self.names[0])
+                self.n_frames = getattr(self._image, 'n_frames', 1)
+            else:
+                self.movtype = 'images'
+                self.n_frames = len(self.names)
+
+        if cache is None:
+            cache = _shared_cache
+        if cache is False or self.movtype == 'array':
+            # Frames of an array are views and cost nothing to read again
+            self.cache = None
+        else:
+            self.cache = cache
+            stat = os.stat(self.names[0])
+            self._key = (os.path.abspath(self.names[0]), len(self.names), stat.st_mtime_ns, stat.st_size,
+                         gray, self.roi, None if self._convert is None else self._convert.str)
+
+        # The first frame gives the size and type of all frames (after the ROI and conversion)
+        first = self.read(0)
+        self.height, self.width = first.shape[:2]
+        self.frame_shape = first.shape
+        self.dtype = first.dtype
+        self.color_depth = 2**(8 * first.dtype.itemsize)
+
+    def __len__(self):
+        return self.n_frames
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """
+        Releases the video or image file. The cached frames stay in the cache.
+        """
+        if self._capture is not None:
+            self._capture.release()
+            self._capture = None
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+
+    def read(self, index):
+        """
+        Returns the frame at the 0-based index, from the cache if it is there.
+
+        Raises:
+            IndexError: If the frame is outside the movie or cannot be decoded.
+        """
+        if self.cache is not None:
+            frame = self.cache.get(self._key + (index,))
+            if frame is not None:
+                return frame
+        if not 0 <= index < self.n_frames:
+            raise IndexError(f"Frame {index} is outside the movie of {self.n_frames} frames.")
+
+        frame = self._decode(index)
+        if self.roi is not None:
+            frame = frame[self.roi[0]:self.roi[1], self.roi[2]:self.roi[3]]
+        if self.gray and frame.ndim == 3:
+            code = cv2.COLOR_BGR2GRAY if self.movtype == 'video' else cv2.COLOR_RGB2GRAY
+            frame = cv2.cvtColor(np.ascontiguousarray(frame[..., :3]), code)
+        if self._convert is not None:
+            frame = frame.astype(self._convert, copy=False)
+        if self.cache is not None and frame.base is not None:
+            # Do not keep the whole decoded frame alive for a small ROI
+            frame = frame.copy()
+        frame.flags.writeable = False
+
+        if self.cache is not None:
+            self.cache.put(self._key + (index,), frame)
+        return frame
+
+    def iter_frames(self, first=0, last=None, prefetch=0):
+        """
+        Yields (index, frame) for the frames first to last, inclusive, decoding
+        them in one sequential pass. Iteration stops early at the end of the movie.
+
+        With prefetch > 0, a background thread decodes up to "prefetch" frames ahead
+        into a ring of preallocated frame arrays while the caller works on the current
+        frame (OpenCV and PIL release the GIL while decoding). A yielded frame is then
+        only valid until the next one is requested, and the reader must not be used
+        otherwise until the iteration ends or is closed.
+
+        Parameters:
+            first (int): 0-based index of the first frame.
+            last (int): 0-based index of the last frame. Defaults to the last frame of the movie.
+            prefetch (int): Number of frames decoded ahead on a background thread.
+        """
+        last = self.n_frames - 1 if last is None else min(last, self.n_frames - 1)
+        indices = range(max(first, 0), last + 1)
+        if prefetch > 0 and len(indices) > 1:
+            yield from self._iter_prefetched(indices, prefetch)
+            return
+        for index in indices:
+            try:
+                frame = self.read(index)
+            except IndexError:
+                return
+            yield index, frame
+
+    def _iter_prefetched(self, indices, depth):
+        """
+        Yields (index, frame) with the frames decoded by a reader thread into a ring
+        of "depth" preallocated arrays. Slots go back to the reader thread once the
+        caller asks for the next frame.
+        """
+        # One more slot than the queue depth, for the frame the caller holds
+        ring = [np.empty(self.frame_shape, dtype=self.dtype) for _ in range(depth + 1)]
+        free = queue.Queue()
+        for slot in range(len(ring)):
+            free.put(slot)
+        filled = queue.Queue()
+        stop = threading.Event()
+
+        def decode_ahead():
+            try:
+                for index in indices:
+                    slot = None
+                    while slot is None:
+                        if stop.is_set():
+                            return
+                        try:
+                            slot = free.get(timeout=0.1)
+                        except queue.Empty:
+                            pass
+                    np.copyto(ring[slot], self.read(index))
+                    filled.put((index, slot))
+            except IndexError:
+                pass
+            except Exception as error:
+                filled.put(error)
+                return
+            filled.put(None)
+
+        thread = threading.Thread(target=decode_ahead, name='particlepals-decode', daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = filled.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                index, slot = item
+                yield index, ring[slot]
+                free.put(slot)
+        finally:
+            stop.set()
+            thread.join()
+
+    def _decode(self, index):
+        """
+        Decodes one frame, seeking only if it is not the next frame of a video.
+        """
+        if self.movtype == 'array':
+            return self.source[index]
+        if self.movtype == 'video':
+            if index != self._position:
+                self._capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, frame = self._capture.read()
+            if not ret:
+                self._position = None
+                raise IndexError(f"Could not decode frame {index} of {self.names[0]}.")
+            self._position = index + 1
+            return frame
+        if self.movtype == 'stack':
+            self._image.seek(index)
+            return np.array(self._image)
+        with Image.open(self.names[index]) as image:
+            return np.array(image)
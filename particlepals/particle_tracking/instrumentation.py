@@ -0,0 +1,201 @@
+"""
+Module for timing the stages of particle detection and tracking.
+Instrumentation is off by default: the stage timer is then a no-op object whose
+stage() returns a shared, do-nothing context manager, so the instrumented code costs
+practically nothing. Progress messages go to the "particlepals" logger instead of
+being printed.
+Components:
+    * StageTimer - accumulates the wall time, number of calls and counters of named stages.
+    * get_timer - returns the active timer (a no-op timer when instrumentation is off).
+    * instrument - context manager that turns instrumentation on for a block of code.
+    * enable_instrumentation, disable_instrumentation - turn instrumentation on and off.
+    * get_logger - returns the logger of a particlepals module.
+Examples:
+    # Time a tracking run and print where the time went
+    with instrument() as timer:
+        vtracks = Predictive_tracker(...)
+    print(timer.report())
+    # Show the per-frame progress messages
+    logging.basicConfig(level=logging.DEBUG)
+"""
+import contextlib
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+
+# Stages timed by ParticleFinder_MHD and Predictive_tracker
+STAGES = ('decode', 'threshold', 'refine', 'link', 'differentiate')
+
+_LOGGER_NAME = 'particlepals'
+
+
+def get_logger(name):
+    """
+    Returns the logger of a particlepals module, e.g. get_logger('tracker').
+
+    Parameters:
+        name (str): Short name of the module.
+
+    Returns:
+        logging.Logger: The "particlepals.<name>" logger.
+    """
+    return logging.getLogger(f'{_LOGGER_NAME}.{name}')
+
+
+class StageTimer:
+    """
+    Accumulates the wall time spent in named stages, and named counters. Stages
+    and counters can be updated from several threads at once, e.g. by the tile
+    searches of FindTiled; the time of a stage is then the sum over the threads,
+    which can exceed the wall time of the run.
+
+    Example:
+        >>> timer = StageTimer()
+        >>> with timer.stage('decode'):
+        ...     frame = read_frame()
+        >>> timer.count('frames')
+        >>> timer.summary()['stages']['decode']['calls']
+        1
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Context manager that adds the time spent in its block to the stage "name".
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.times[name] += elapsed
+                self.calls[name] += 1
+
+    def count(self, name, value=1):
+        """
+        Adds "value" to the counter "name".
+        """
+        with self._lock:
+            self.counters[name] += value
+
+    def reset(self):
+        """
+        Clears all the times and counters.
+        """
+        with self._lock:
+            self.times.clear()
+            self.calls.clear()
+            self.counters.clear()
+
+    def summary(self):
+        """
+        Returns the timings and counters as a dictionary that can be saved as JSON.
+
+        Returns:
+            dict: 'stages' maps each stage to its total 'seconds', number of 'calls'
+            and 'fraction' of the total time; 'counters' maps each counter to its value.
+        """
+        total = sum(self.times.values())
+        stages = {name: {'seconds': seconds, 'calls': self.calls[name],
+                         'fraction': seconds / total if total > 0 else 0.0}
+                  for name, seconds in self.times.items()}
+        return {'total_seconds': total, 'stages': stages, 'counters': dict(self.counters)}
+
+    def report(self):
+        """
+        Returns a text table of the time spent in each stage and the counters.
+        """
+        summary = self.summary()
+        lines = [f"{'stage':16s} {'seconds':>10s} {'calls':>8s} {'share':>7s}"]
+        for name, stage in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append(f"{name:16s} {stage['seconds']:10.4f} {stage['calls']:8d} {stage['fraction']:7.1%}")
+        lines.append(f"{'total':16s} {summary['total_seconds']:10.4f}")
+        for name, value in sorted(summary['counters'].items()):
+            lines.append(f"{name:16s} {value:10d}")
+        return '\n'.join(lines)
+
+
+class _NullTimer:
+    """
+    Stage timer used when instrumentation is off; every method does nothing.
+    """
+
+    enabled = False
+    _null_context = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._null_context
+
+    def count(self, name, value=1):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+# The active timer belongs to the current thread (or asyncio task), so runs that
+# overlap on different threads, such as two jobs of the GUI, each record into
+# their own timer; worker threads of a run are given its context (see FindTiled)
+_active_timer = contextvars.ContextVar('particlepals_active_timer', default=_NULL_TIMER)
+
+
+def get_timer():
+    """
+    Returns the active stage timer, or a no-op timer when instrumentation is off.
+    """
+    return _active_timer.get()
+
+
+def enable_instrumentation(timer=None):
+    """
+    Turns instrumentation on, in the current thread.
+
+    Parameters:
+        timer (StageTimer): Timer to record into. A new one is made by default.
+
+    Returns:
+        StageTimer: The active timer.
+    """
+    timer = StageTimer() if timer is None else timer
+    _active_timer.set(timer)
+    return timer
+
+
+def disable_instrumentation():
+    """
+    Turns instrumentation off, in the current thread.
+    """
+    _active_timer.set(_NULL_TIMER)
+
+
+@contextlib.contextmanager
+def instrument(timer=None, log_report=False):
+    """
+    Context manager that turns instrumentation on for its block and restores the
+    previous state afterwards.
+
+    Parameters:
+        timer (StageTimer): Timer to record into. A new one is made by default.
+        log_report (bool): Log the report at INFO level when the block ends.
+
+    Yields:
+        StageTimer: The timer recording the block.
+    """
+    timer = StageTimer() if timer is None else timer
+    token = _active_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _active_timer.reset(token)
+        if log_report:
+            get_logger('instrumentation').info('Stage timings:\n%s', timer.report())
@@ -1,54 +1,196 @@
+"""
+Module for drawing particle tracks over the movie they were found in.
+The movie is decoded once, front to back, and the tail of every track that is
+active in a frame is drawn onto that frame with OpenCV, so overlay movies of
+thousands of frames render at decoding speed and need no display.
+Components:
+    * iter_track_overlay - yields the frames of a movie with the active tracks drawn on them.
+    * render_tracks_video - writes the overlaid frames to an MP4 or AVI file.
+    * plot_tracks_avi - shows the overlaid frames in a matplotlib window, or writes them to a file.
+Examples:
+    vtracks = Predictive_tracker('movie.avi', 40, 8, None, 2, 0, None, [0, 99], None, None, None, None)
+    render_tracks_video('movie.avi', vtracks, 'tracks.mp4', tail_length=20)
+"""
+import os
+
 import cv2
 import matplotlib.pyplot as plt
 import numpy as np
 
-def plot_tracks_avi(inputname, vtracks, framerange=None):
-    # Read the video
-    vid = cv2.VideoCapture(inputname)
+from .instrumentation import get_logger
+from .frame_reader import FrameReader
+
+logger = get_logger('plottracks')
+
+# Track points are drawn with this many fractional bits, for sub-pixel positions
+_SHIFT = 4
+
+# Codec used for each output file extension
+_FOURCC = {'.mp4': 'mp4v', '.avi': 'MJPG'}
+
+
+def _track_colors():
+    """
+    Returns the colors of the current matplotlib color cycle as BGR tuples.
+    """
+    colors = []
+    for color in plt.rcParams['axes.prop_cycle'].by_key()['color']:
+        red, green, blue = (int(round(255 * c)) for c in plt.matplotlib.colors.to_rgb(color))
+        colors.append((blue, green, red))
+    return colors
+
+
+def _frame_limits(reader, framerange):
+    """
+    Returns the first and last frame to draw, as 0-based frame indices. Like
+    ParticleFinder_MHD, framerange holds the 1-based first and last frames.
+    """
+    if framerange is None or len(framerange) == 0:
+        return 0, reader.n_frames - 1
+    return max(int(framerange[0]), 1) - 1, int(min(framerange[-1], reader.n_frames)) - 1
+
+
+def iter_track_overlay(inputname, vtracks, framerange=None, tail_length=None, thickness=1):
+    """
+    Yields the frames of a movie with the tracks drawn on them.
+
+    The movie is decoded in one sequential pass (see FrameReader). Tracks are
+    sorted by their first frame, so the tracks starting in a frame are added to the
+    active set with one slice, and tracks are dropped from it after their last frame.
+
+    Inputs:
+        inputname - path of the movie, or a FrameReader (see FrameReader for the formats).
+        vtracks - tracks from Predictive_tracker: dictionaries with 'X', 'Y' and 'T',
+            where T holds the 0-based frame index of each point.
+        framerange - [first, last] 1-based frames to draw, as for ParticleFinder_MHD.
+            Defaults to the whole movie.
+        tail_length - number of past frames of each track to draw. None draws the
+            whole track up to the current frame.
+        thickness - line width in pixels.
+    Outputs:
+        (frame index, BGR image) for every frame in the range.
+    """
+    reader = inputname if isinstance(inputname, FrameReader) else FrameReader(inputname)
+
+    colors = _track_colors()
+    # Sub-pixel points of every track, in fixed point for cv2.polylines
+    times = [np.asarray(track['T'], dtype=int) for track in vtracks]
+    points = [np.round(np.column_stack((track['X'], track['Y'])) * 2**_SHIFT).astype(np.int32)
+              for track in vtracks]
+    starts = np.array([t[0] for t in times], dtype=int)
+    ends = np.array([t[-1] for t in times], dtype=int)
+    order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[order]
+
+    first, last = _frame_limits(reader, framerange)
+    # Tracks that started before the first frame and are still running
+    active = [jj for jj in order[:np.searchsorted(sorted_starts, first)] if ends[jj] >= first]
+    added = np.searchsorted(sorted_starts, first)
+    try:
+        for frame_index, frame in reader.iter_frames(first, last):
+            # The decoded frames are read-only, since they may be cached
+            if frame.ndim == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            elif reader.movtype != 'video':
+                frame = cv2.cvtColor(np.ascontiguousarray(frame[..., :3]), cv2.COLOR_RGB2BGR)
+            else:
+                frame = frame.copy()
+
+            stop = np.searchsorted(sorted_starts, frame_index, side='right')
+            active.extend(order[added:stop])
+            added = stop
+            active = [jj for jj in active if ends[jj] >= frame_index]
 
-    if framerange is None:
-        framerange = [1, int(vid.get(cv2.CAP_PROP_FRAME_COUNT))]
-    
-    # Color list from current color cycle
-    colorlist = plt.rcParams['axes.prop_cycle'].by_key()['color']
+            # One polylines call per color
+            lines = [[] for _ in colors]
+            for jj in active:
+                hi = np.searchsorted(times[jj], frame_index, side='right')
+                lo = 0 if tail_length is None else np.searchsorted(times[jj], frame_index - tail_length)
+                if hi - lo > 1:
+                    lines[jj % len(colors)].append(points[jj][lo:hi])
+            for color, polylines in zip(colors, lines):
+                if polylines:
+                    cv2.polylines(frame, polylines, False, color, thickness, cv2.LINE_AA, _SHIFT)
+            yield frame_index, frame
+    finally:
+        if reader is not inputname:
+            reader.close()
 
-    ntracks = len(vtracks)
-    track_frame_range = np.full((ntracks, 2), np.nan)
 
-    print(ntracks)
-    print(vtracks)
-    for jj in range(ntracks):
-        track_frame_range[jj, 0] = vtracks[jj]['T']
-        track_frame_range[jj, 1] = vtracks[jj]['T']
+def render_tracks_video(inputname, vtracks, outputname, framerange=None, tail_length=None,
+                        thickness=1, fps=None, fourcc=None, progress=None):
+    """
+    Writes a movie with the tracks drawn on it, without a display.
 
-    first_track = np.nanmin(track_frame_range)
-    last_track = np.nanmax(track_frame_range)
-    print(framerange[0])
-    print(framerange[1] + 1)
-    print(last_track)
-    for i in range(int(first_track), int(last_track)):
-        if i < first_track or i > last_track:
-            continue
+    Inputs:
+        inputname - path of the tracked movie.
+        vtracks - tracks from Predictive_tracker.
+        outputname - path of the output movie; '.mp4' and '.avi' files are supported.
+        framerange, tail_length, thickness - see iter_track_overlay.
+        fps - frame rate of the output. Defaults to that of the input, or 25.
+        fourcc - four-letter codec code. Defaults to 'mp4v' for MP4 and 'MJPG' for AVI.
+        progress - optional ProgressReporter, updated after every frame.
+    Outputs:
+        Number of frames written.
+    """
+    if fourcc is None:
+        extension = os.path.splitext(outputname)[1].lower()
+        if extension not in _FOURCC:
+            raise ValueError(f"Unsupported output format '{extension}'; use '.mp4' or '.avi', or give a fourcc.")
+        fourcc = _FOURCC[extension]
 
-        vid.set(cv2.CAP_PROP_POS_FRAMES, i - 1)
-        ret, frame = vid.read()
+    reader = FrameReader(inputname)
+    if fps is None:
+        fps = reader.fps or 25
+    first, last = _frame_limits(reader, framerange)
 
-        if not ret:
-            break
+    writer = cv2.VideoWriter(outputname, cv2.VideoWriter_fourcc(*fourcc), fps, (reader.width, reader.height))
+    if not writer.isOpened():
+        reader.close()
+        raise IOError(f"Could not open {outputname} for writing.")
+    if progress is not None:
+        progress.start(last - first + 1, 'render')
 
-        plt.imshow(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        plt.title(f'frame {i}')
-        plt.axis('image')
+    n_written = 0
+    try:
+        for _, frame in iter_track_overlay(reader, vtracks, [first + 1, last + 1], tail_length, thickness):
+            writer.write(frame)
+            n_written += 1
+            if progress is not None:
+                progress.update()
+    finally:
+        writer.release()
+        reader.close()
+    logger.info("Wrote %d frames with %d tracks to %s", n_written, len(vtracks), outputname)
+    return n_written
 
-        for jj in range(ntracks):
-            if track_frame_range[jj, 0] <= i <= track_frame_range[jj, 1]:
-                col = colorlist[jj % len(colorlist)]
-                indt = slice(0, i - int(track_frame_range[jj, 0]) + 1)
-                plt.plot(vtracks[jj]['X'], vtracks[jj]['Y'], '-', color=col)
 
-        plt.pause(0.5)
-        plt.clf()
+def plot_tracks_avi(inputname, vtracks, framerange=None, outputname=None, tail_length=None, pause=0.5):
+    """
+    Shows the tracks over the movie, one frame at a time, or writes them to a
+    movie file if outputname is given (see render_tracks_video).
 
-    vid.release()
+    Inputs:
+        inputname - path to the tracked movie.
+        vtracks - tracks from Predictive_tracker.
+        framerange - [first, last] 1-based frames to show, as for ParticleFinder_MHD.
+            Defaults to the whole movie.
+        outputname - optional path of an '.mp4' or '.avi' file to write instead.
+        tail_length - number of past frames of each track to draw (None: all).
+        pause - seconds each frame is shown for.
+    """
+    if outputname is not None:
+        render_tracks_video(inputname, vtracks, outputname, framerange, tail_length)
+        return
 
-    # plot_tracks_avi('video.avi', vtracks, [5, 10])
+    # One image artist whose data is replaced for every frame
+    image = None
+    for frame_index, frame in iter_track_overlay(inputname, vtracks, framerange, tail_length):
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if image is None:
+            image = plt.imshow(rgb)
+            plt.axis('image')
+        else:
+            image.set_data(rgb)
+        plt.title(f'frame {frame_index + 1}')
+        plt.pause(pause)
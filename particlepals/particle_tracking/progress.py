@@ -0,0 +1,139 @@
+"""
+Module for reporting the progress of long-running computations and cancelling them.
+ParticleFinder_MHD, Predictive_tracker and process_csv_folder take an optional
+"progress" argument. They call its start() method when a stage begins and its
+update() method after every frame; update() raises OperationCancelled once the
+computation has been cancelled, which stops it at the next frame.
+Components:
+    * Progress - the fraction done, rate and estimated time left, passed to callbacks.
+    * ProgressReporter - tracks the progress of a computation and calls a callback with it.
+    * OperationCancelled - raised by ProgressReporter.update() after cancellation.
+Examples:
+    # Print the progress, and cancel when the callback returns True
+    def show(progress):
+        print(f"{progress.stage}: {progress.fraction:.0%}, ETA {progress.eta:.1f} s")
+        return stop_requested()
+    vtracks = Predictive_tracker(..., progress=ProgressReporter(show))
+    # Cancel from another thread
+    cancel_event = threading.Event()
+    reporter = ProgressReporter(cancel_event=cancel_event)
+"""
+import time
+from collections import namedtuple
+
+# stage - name of the current stage, e.g. 'detect' or 'link'
+# completed, total - number of items (frames) done and in the stage
+# fraction - completed / total
+# rate - items per second since the stage started
+# eta - estimated seconds left in the stage (None until the rate is known)
+Progress = namedtuple('Progress', ['stage', 'completed', 'total', 'fraction', 'rate', 'eta'])
+
+
+class OperationCancelled(Exception):
+    """
+    Raised when a computation is cancelled through its ProgressReporter.
+    """
+
+
+class ProgressReporter:
+    """
+    Tracks the progress of a computation made of stages of countable steps, such as
+    frames, and reports it to a callback.
+
+    The callback is called with a Progress tuple when a stage starts, at most every
+    "min_interval" seconds while it runs, and when it completes. The computation is
+    cancelled when the callback returns True, when "cancel_event" (any object with an
+    is_set() method, e.g. threading.Event) is set, or when cancel() is called.
+
+    Example:
+        >>> reporter = ProgressReporter(lambda progress: print(progress.fraction))
+        >>> reporter.start(10, 'detect')
+        >>> reporter.update()
+    """
+
+    def __init__(self, callback=None, cancel_event=None, min_interval=0.1):
+        """
+        Parameters:
+            callback (callable): Called with a Progress tuple; returning True cancels.
+            cancel_event: Object with an is_set() method that signals cancellation.
+            min_interval (float): Smallest time in seconds between two callbacks.
+        """
+        self.callback = callback
+        self.cancel_event = cancel_event
+        self.min_interval = min_interval
+        self.stage = ''
+        self.total = 0
+        self.completed = 0
+        self._cancelled = False
+        self._start_time = time.perf_counter()
+        self._last_report = -float('inf')
+
+    @property
+    def cancelled(self):
+        """
+        True once the computation has been cancelled.
+        """
+        if not self._cancelled and self.cancel_event is not None and self.cancel_event.is_set():
+            self._cancelled = True
+        return self._cancelled
+
+    def cancel(self):
+        """
+        Cancels the computation; the next update() raises OperationCancelled.
+        """
+        self._cancelled = True
+
+    def progress(self):
+        """
+        Returns the Progress of the current stage.
+        """
+        elapsed = time.perf_counter() - self._start_time
+        fraction = self.completed / self.total if self.total else 1.0
+        rate = self.completed / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.completed) / rate if rate > 0 else None
+        return Progress(self.stage, self.completed, self.total, fraction, rate, eta)
+
+    def start(self, total, stage=''):
+        """
+        Starts a new stage of "total" steps.
+        """
+        self.stage = stage
+        self.total = total
+        self.completed = 0
+        self._start_time = time.perf_counter()
+        self._report(force=True)
+
+    def update(self, completed=None, step=1):
+        """
+        Records progress in the current stage and raises OperationCancelled if the
+        computation was cancelled.
+
+        Parameters:
+            completed (int): Number of steps done so far. By default the count is
+                increased by "step".
+            step (int): Number of steps done since the last update.
+        """
+        self.completed = self.completed + step if completed is None else completed
+        self._report(force=self.completed >= self.total)
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        """
+        Raises OperationCancelled if the computation was cancelled.
+        """
+        if self.cancelled:
+            raise OperationCancelled(f"Cancelled during '{self.stage}' after "
+                                     f"{self.completed} of {self.total} steps.")
+
+    def _report(self, force=False):
+        """
+        Calls the callback, unless it was called less than min_interval seconds ago.
+        """
+        if self.callback is None:
+            return
+        now = time.perf_counter()
+        if not force and now - self._last_report < self.min_interval:
+            return
+        self._last_report = now
+        if self.callback(self.progress()):
+            self._cancelled = True
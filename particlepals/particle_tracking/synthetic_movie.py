@@ -0,0 +1,327 @@
+"""
+Module for generating synthetic particle movies with known ground truth.
+Gaussian particles are advected through a velocity field, for example one made by
+generate_turbulent_velocity_field, and rendered into frames that ParticleFinder_MHD
+and Predictive_tracker can read, so detection and tracking can be benchmarked
+offline at any seeding density and resolution.
+Components:
+    * advect_particles - moves particles one frame forward through a velocity field.
+    * render_particles - draws Gaussian particles into an 8 or 16 bit image.
+    * iter_particle_frames - yields rendered frames and the particles in them, one at a time.
+    * generate_synthetic_movie - renders a whole movie and its ground-truth trajectories.
+    * save_tiff_stack, save_avi - write a movie to a multi-page TIFF or an uncompressed AVI.
+    * save_ground_truth, read_ground_truth - write and read trajectories as CSV.
+    * score_detections - compares detected particle positions with the ground truth.
+Examples:
+    frames = generate_spectral_velocity_field(32, 50, rms_velocity=2.0)
+    movie, trajectories = generate_synthetic_movie(frames, (256, 256), seeding_density=0.002)
+    save_tiff_stack(movie, 'synthetic.tif')
+    save_ground_truth(trajectories, 'synthetic_tracks.csv')
+    x, y, t, ang = ParticleFinder_MHD(movie, 50)
+    scores = score_detections(x, y, t, trajectories)
+"""
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+from scipy.spatial import cKDTree
+
+# Columns of the ground-truth trajectory array
+TRAJECTORY_COLUMNS = ('track', 'frame', 'x', 'y')
+
+
+def _interpolate_velocity(velocity, positions, image_shape):
+    """
+    Bilinearly interpolates a gridded velocity field at particle positions.
+
+    The field has shape (nx, ny, 2), with x along the first axis as produced by
+    generate_turbulent_velocity_field, and its grid is stretched over the image so
+    that the corner grid points sit on the corner pixels.
+
+    Parameters:
+        velocity (numpy.ndarray): Velocity field of shape (nx, ny, 2).
+        positions (numpy.ndarray): (n, 2) array of x (column) and y (row) pixel positions.
+        image_shape (tuple): (height, width) of the image in pixels.
+
+    Returns:
+        numpy.ndarray: (n, 2) array of interpolated velocities.
+    """
+    nx, ny = velocity.shape[:2]
+    height, width = image_shape
+    gx = positions[:, 0] * (nx - 1) / max(width - 1, 1)
+    gy = positions[:, 1] * (ny - 1) / max(height - 1, 1)
+    gx = np.clip(gx, 0, nx - 1)
+    gy = np.clip(gy, 0, ny - 1)
+    i0 = np.minimum(gx.astype(np.intp), max(nx - 2, 0))
+    j0 = np.minimum(gy.astype(np.intp), max(ny - 2, 0))
+    i1 = np.minimum(i0 + 1, nx - 1)
+    j1 = np.minimum(j0 + 1, ny - 1)
+    fx = (gx - i0)[:, None]
+    fy = (gy - j0)[:, None]
+    return ((1 - fx) * (1 - fy) * velocity[i0, j0] + fx * (1 - fy) * velocity[i1, j0] +
+            (1 - fx) * fy * velocity[i0, j1] + fx * fy * velocity[i1, j1])
+
+
+def advect_particles(positions, velocity, image_shape, velocity_scale=1.0):
+    """
+    Moves particles one frame forward through a velocity field with a second-order
+    Runge-Kutta (midpoint) step.
+
+    Parameters:
+        positions (numpy.ndarray): (n, 2) array of x (column) and y (row) pixel positions.
+        velocity (numpy.ndarray): Velocity field of shape (nx, ny, 2) covering the image.
+        image_shape (tuple): (height, width) of the image in pixels.
+        velocity_scale (float): Pixels per frame moved for a unit of velocity.
+
+    Returns:
+        numpy.ndarray: (n, 2) array of the new positions.
+    """
+    positions = np.asarray(positions, dtype=float)
+    velocity = np.asarray(velocity, dtype=float)
+    half_step = positions + 0.5 * velocity_scale * _interpolate_velocity(velocity, positions, image_shape)
+    return positions + velocity_scale * _interpolate_velocity(velocity, half_step, image_shape)
+
+
+def render_particles(positions, image_shape, particle_size=1.0, brightness=200,
+                     background=0, noise=0.0, bit_depth=8, rng=None):
+    """
+    Draws particles as Gaussian spots into an image.
+
+    Parameters:
+        positions (numpy.ndarray): (n, 2) array of x (column) and y (row) pixel positions.
+        image_shape (tuple): (height, width) of the image in pixels.
+        particle_size (float): Standard deviation of the Gaussian spots in pixels.
+        brightness (float): Peak brightness of a particle above the background.
+        background (float): Brightness of the background.
+        noise (float): Standard deviation of the Gaussian noise added to the image.
+        bit_depth (int): Bit depth of the image; 8 gives uint8 and up to 16 gives uint16.
+        rng (numpy.random.Generator): Random number generator for the noise.
+
+    Returns:
+        numpy.ndarray: The rendered (height, width) image.
+    """
+    if not 1 <= bit_depth <= 16:
+        raise ValueError("bit_depth must be between 1 and 16.")
+    height, width = image_shape
+    positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+
+    # Every particle is drawn into a square stamp of radius three sigma
+    radius = max(int(np.ceil(3 * particle_size)), 1)
+    offsets = np.arange(-radius, radius + 1)
+    centers = np.rint(positions).astype(np.intp)
+    cols = centers[:, 0, None, None] + offsets[None, None, :]
+    rows = centers[:, 1, None, None] + offsets[None, :, None]
+    dx = cols - positions[:, 0, None, None]
+    dy = rows - positions[:, 1, None, None]
+    weights = brightness * np.exp(-(dx * dx + dy * dy) / (2 * particle_size**2))
+
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+    flat = (rows * width + cols)[inside]
+    image = np.bincount(flat, weights=weights[inside], minlength=height * width)
+    image = image.reshape(height, width) + background
+
+    if noise > 0:
+        rng = np.random.default_rng() if rng is None else rng
+        image += rng.normal(0.0, noise, size=image.shape)
+
+    dtype = np.uint8 if bit_depth <= 8 else np.uint16
+    return np.clip(np.rint(image), 0, 2**bit_depth - 1).astype(dtype)
+
+
+def iter_particle_frames(velocity_frames, image_shape, seeding_density=0.002, num_frames=None,
+                         velocity_scale=1.0, particle_size=1.0, brightness=200, background=0,
+                         noise=0.0, bit_depth=8, seed=0):
+    """
+    Yields a synthetic particle movie one frame at a time.
+
+    Particles are seeded uniformly at random and advected through the velocity
+    frames. A particle that leaves the image ends its track and is replaced by a new
+    particle, with a new track number, at a random position, so the seeding density
+    stays constant.
+
+    Parameters:
+        velocity_frames (array-like or iterable): Velocity frames of shape (nx, ny, 2),
+            as a (num_frames, nx, ny, 2) array or any iterable such as
+            iter_spectral_velocity_field. A single (nx, ny, 2) array is used as a
+            steady field for num_frames frames.
+        image_shape (tuple): (height, width) of the image in pixels.
+        seeding_density (float): Number of particles per pixel.
+        num_frames (int): Number of frames to render. Defaults to the number of
+            velocity frames.
+        velocity_scale (float): Pixels per frame moved for a unit of velocity.
+        particle_size, brightness, background, noise, bit_depth: See render_particles.
+        seed (int): Seed of the random number generator.
+
+    Yields:
+        image (numpy.ndarray): The rendered (height, width) frame.
+        particles (numpy.ndarray): (n, 3) array of the track number, x and y of every
+            particle in the frame.
+    """
+    height, width = image_shape
+    rng = np.random.default_rng(seed)
+
+    if isinstance(velocity_frames, np.ndarray) and velocity_frames.ndim == 3:
+        if num_frames is None:
+            raise ValueError("num_frames is required for a steady velocity field.")
+        steady = velocity_frames
+        velocity_frames = (steady for _ in range(num_frames))
+
+    n_particles = max(int(round(seeding_density * height * width)), 1)
+    positions = rng.uniform((0, 0), (width - 1, height - 1), size=(n_particles, 2))
+    tracks = np.arange(n_particles)
+    next_track = n_particles
+
+    for frame, velocity in enumerate(velocity_frames):
+        if num_frames is not None and frame >= num_frames:
+            break
+        image = render_particles(positions, image_shape, particle_size, brightness,
+                                 background, noise, bit_depth, rng)
+        yield image, np.column_stack((tracks, positions))
+
+        positions = advect_particles(positions, velocity, image_shape, velocity_scale)
+
+        # Replace the particles that left the image
+        lost = ((positions[:, 0] < 0) | (positions[:, 0] > width - 1) |
+                (positions[:, 1] < 0) | (positions[:, 1] > height - 1))
+        n_lost = np.count_nonzero(lost)
+        if n_lost:
+            positions[lost] = rng.uniform((0, 0), (width - 1, height - 1), size=(n_lost, 2))
+            tracks[lost] = np.arange(next_track, next_track + n_lost)
+            next_track += n_lost
+
+
+def generate_synthetic_movie(velocity_frames, image_shape, seeding_density=0.002, num_frames=None,
+                             velocity_scale=1.0, particle_size=1.0, brightness=200, background=0,
+                             noise=0.0, bit_depth=8, seed=0):
+    """
+    Renders a synthetic particle movie and its ground-truth trajectories.
+
+    Parameters:
+        See iter_particle_frames.
+
+    Returns:
+        movie (numpy.ndarray): Movie of shape (num_frames, height, width).
+        trajectories (numpy.ndarray): (n, 4) array whose columns are the track number,
+            frame number (starting at 0, like the t returned by ParticleFinder_MHD),
+            x (column) and y (row) of every particle in every frame, sorted by track
+            and frame.
+
+    Example:
+        >>> frames = generate_spectral_velocity_field(32, 50, rms_velocity=2.0)
+        >>> movie, trajectories = generate_synthetic_movie(frames, (256, 256))
+    """
+    images = []
+    rows = []
+    for frame, (image, particles) in enumerate(iter_particle_frames(
+            velocity_frames, image_shape, seeding_density, num_frames, velocity_scale,
+            particle_size, brightness, background, noise, bit_depth, seed)):
+        images.append(image)
+        rows.append(np.column_stack((particles[:, 0], np.full(len(particles), frame), particles[:, 1:])))
+
+    movie = np.stack(images)
+    trajectories = np.concatenate(rows)
+    trajectories = trajectories[np.lexsort((trajectories[:, 1], trajectories[:, 0]))]
+    return movie, trajectories
+
+
+def save_tiff_stack(movie, file_path="synthetic_movie.tif"):
+    """
+    Saves a movie as a multi-page TIFF stack that ParticleFinder_MHD can read.
+
+    Parameters:
+        movie (numpy.ndarray): Movie of shape (num_frames, height, width).
+        file_path (str): Path of the TIFF file.
+    """
+    pages = [Image.fromarray(image) for image in movie]
+    pages[0].save(file_path, save_all=True, append_images=pages[1:])
+
+
+def save_avi(movie, file_path="synthetic_movie.avi", fps=30):
+    """
+    Saves an 8 bit movie as an uncompressed AVI file that ParticleFinder_MHD can read.
+
+    Parameters:
+        movie (numpy.ndarray): uint8 movie of shape (num_frames, height, width).
+        file_path (str): Path of the AVI file.
+        fps (float): Frame rate stored in the file.
+    """
+    if movie.dtype != np.uint8:
+        raise ValueError("AVI files can only store 8 bit movies; use save_tiff_stack instead.")
+    height, width = movie.shape[1:3]
+    writer = cv2.VideoWriter(file_path, 0, fps, (width, height), isColor=False)
+    if not writer.isOpened():
+        raise IOError(f"Could not open {file_path} for writing.")
+    for image in movie:
+        writer.write(image)
+    writer.release()
+
+
+def save_ground_truth(trajectories, file_path="synthetic_tracks.csv"):
+    """
+    Saves ground-truth trajectories as a CSV file with a track,frame,x,y header.
+
+    Parameters:
+        trajectories (numpy.ndarray): (n, 4) trajectory array from generate_synthetic_movie.
+        file_path (str): Path of the CSV file.
+    """
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    np.savetxt(file_path, trajectories, delimiter=',', fmt=['%d', '%d', '%.6f', '%.6f'],
+               header=','.join(TRAJECTORY_COLUMNS), comments='')
+
+
+def read_ground_truth(file_path):
+    """
+    Reads ground-truth trajectories saved by save_ground_truth.
+
+    Parameters:
+        file_path (str): Path of the CSV file.
+
+    Returns:
+        numpy.ndarray: (n, 4) array of track, frame, x and y.
+    """
+    return np.loadtxt(file_path, delimiter=',', skiprows=1, ndmin=2)
+
+
+def score_detections(x, y, t, trajectories, tolerance=1.0):
+    """
+    Compares detected particle positions with the ground truth, frame by frame.
+
+    True particles and detections are matched one to one, closest pairs first, and
+    only pairs closer than "tolerance" pixels are matched. The pairs are found with
+    k-d trees, so no distance matrix of all particles and detections is made.
+
+    Parameters:
+        x, y, t (numpy.ndarray): Detected positions and frame numbers, as returned by
+            ParticleFinder_MHD.
+        trajectories (numpy.ndarray): (n, 4) trajectory array from generate_synthetic_movie.
+        tolerance (float): Largest distance in pixels between a true particle and its match.
+
+    Returns:
+        dict: 'recall' (fraction of true particles found), 'precision' (fraction of
+        detections that match a true particle) and 'rms_error' (root-mean-square
+        position error of the matches, in pixels).
+    """
+    x, y, t = (np.asarray(values, dtype=float) for values in (x, y, t))
+    matched = 0
+    squared_errors = []
+    for frame in np.unique(trajectories[:, 1]):
+        truth = trajectories[trajectories[:, 1] == frame, 2:]
+        found = np.column_stack((x[t == frame], y[t == frame]))
+        if len(found) == 0:
+            continue
+        pairs = cKDTree(truth).sparse_distance_matrix(cKDTree(found), tolerance, output_type='ndarray')
+        # Greedy assignment: each pair is kept if neither of its points is matched yet
+        truth_used = np.zeros(len(truth), dtype=bool)
+        found_used = np.zeros(len(found), dtype=bool)
+        for ii, jj, distance in pairs[np.argsort(pairs['v'], kind='stable')]:
+            if not truth_used[ii] and not found_used[jj]:
+                truth_used[ii] = found_used[jj] = True
+                matched += 1
+                squared_errors.append(distance**2)
+
+    return {'recall': matched / max(len(trajectories), 1),
+            'precision': matched / max(len(x), 1),
+            'rms_error': np.sqrt(np.mean(squared_errors)) if len(squared_errors) else np.nan}
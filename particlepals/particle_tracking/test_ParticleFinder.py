@@ -0,0 +1,300 @@
+"""
+Test the detection functions in the ParticleFinder module.
+"""
+import unittest
+import os
+import shutil
+import threading
+from unittest.mock import patch
+
+import numpy as np
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking import ParticleFinder as pf
+from particlepals.particle_tracking import detection_sweep as sd
+from particlepals.particle_tracking.BackgroundImage import BackgroundImage
+
+class TestDetectionWorkspace(unittest.TestCase):
+    """
+    Class for testing FindParticles and FindRegions with scratch workspaces.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.small = sm.render_particles(rng.uniform(0, 99, size=(60, 2)), (80, 100), noise=2.0, rng=rng)
+        self.large = sm.render_particles(rng.uniform(0, 99, size=(30, 2)), (80, 100), particle_size=2.0,
+                                         noise=2.0, rng=rng)
+        self.logs = np.insert(np.log(np.arange(1, 2**8 + 1)), 0, np.log(0.0001))
+
+    def test_find_particles(self):
+        """
+        Test that the scratch arrays are reused, that results do not depend on the
+        workspace, and that maxima on the outer ring are ignored.
+        """
+        workspace = pf.DetectionWorkspace()
+        pos = pf.FindParticles(self.small, 40, self.logs, workspace)
+        maxima = workspace.buffer('maxima', self.small.shape, bool)
+        pf.FindParticles(self.large, 40, self.logs, workspace)
+        self.assertIs(workspace.buffer('maxima', self.small.shape, bool), maxima)
+        np.testing.assert_array_equal(pos, pf.FindParticles(self.small, 40, self.logs, pf.DetectionWorkspace()))
+        self.assertGreater(len(pos), 30)
+
+        image = np.zeros((10, 12), dtype=np.uint8)
+        image[0, 5] = image[5, 0] = image[9, 6] = 200
+        image[3:6, 6] = image[4, 5:8] = 100
+        image[4, 6] = 200
+        pos = pf.FindParticles(image, 40, self.logs)
+        np.testing.assert_array_almost_equal(pos, [[6.0, 4.0]])
+
+    def test_find_regions(self):
+        """
+        Test that regions smaller than the minimum area are removed and that
+        the labels are written into the workspace.
+        """
+        workspace = pf.DetectionWorkspace()
+        image = np.zeros((20, 20), dtype=np.uint8)
+        image[3:6, 3:7] = 100   # 12 pixels
+        image[12, 12] = 100     # 1 pixel
+        image[15:17, 3:5] = 100  # 4 pixels
+        pos, ang = pf.FindRegions(image, 50, [3, 100], workspace=workspace)
+        np.testing.assert_array_almost_equal(pos, [[4.5, 4.0], [3.5, 15.5]])
+        self.assertEqual(len(ang), 2)
+        self.assertEqual(workspace.buffer('labels', image.shape, np.int32).max(), 2)
+
+        pos, _ = pf.FindRegions(self.large, 60, [4, 400], workspace=workspace)
+        np.testing.assert_array_equal(pos, pf.FindRegions(self.large, 60, [4, 400], workspace=pf.DetectionWorkspace())[0])
+
+    def test_workspace_per_thread(self):
+        """
+        Test that every thread gets its own workspace.
+        """
+        workspaces = []
+        thread = threading.Thread(target=lambda: workspaces.append(pf.get_workspace()))
+        thread.start()
+        thread.join()
+        self.assertIs(pf.get_workspace(), pf.get_workspace())
+        self.assertIsNot(workspaces[0], pf.get_workspace())
+
+class TestBitDepth(unittest.TestCase):
+    """
+    Class for testing detection in 12 and 16 bit movies, in their own type.
+    """
+
+    test_directory = 'test_bit_depth_directory'
+
+    def setUp(self):
+        os.makedirs(self.test_directory, exist_ok=True)
+        rng = np.random.default_rng(1)
+        grid = np.stack(np.meshgrid(np.arange(10, 80, 14), np.arange(10, 80, 14)), axis=-1).reshape(-1, 2)
+        self.positions = grid + rng.uniform(-2, 2, size=grid.shape)
+        # A 12 bit movie whose background is brighter than any 8 bit value
+        self.movie = np.stack([sm.render_particles(self.positions, (80, 80), brightness=2000, background=1500,
+                                                   noise=5.0, bit_depth=12, rng=rng) for _ in range(4)])
+        self.empty = np.stack([sm.render_particles(self.positions, (80, 80), brightness=0, background=1500,
+                                                   noise=5.0, bit_depth=12, rng=rng) for _ in range(5)])
+        self.background_path = os.path.join(self.test_directory, 'background.tif')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_directory, ignore_errors=True)
+
+    def assert_found(self, x, y, n_frames):
+        self.assertEqual(len(x), n_frames * len(self.positions))
+        found = np.column_stack((x, y))[:len(self.positions)]
+        distance = np.linalg.norm(found[:, None, :] - self.positions[None, :, :], axis=2).min(axis=1)
+        self.assertLess(distance.max(), 0.3)
+
+    def test_background_subtraction(self):
+        """
+        Test that the background of a 12 bit movie is computed and subtracted
+        without truncation, with a threshold above 255.
+        """
+        sm.save_tiff_stack(self.empty, os.path.join(self.test_directory, 'empty.tif'))
+        background = BackgroundImage(os.path.join(self.test_directory, 'empty.tif'), self.background_path)
+        self.assertEqual(background.dtype, np.uint16)
+        np.testing.assert_array_equal(background, (self.empty.sum(axis=0, dtype=np.uint64) + 2) // 5)
+
+        x, y, t, _ = pf.ParticleFinder_MHD(self.movie, 1000, bground_name=self.background_path, invert=0)
+        self.assert_found(x, y, 4)
+        # Without the background the noise of the bright background is found too
+        x, _, _, _ = pf.ParticleFinder_MHD(self.movie, 1000, bground_name=[], invert=0)
+        self.assertGreater(len(x), 4 * len(self.positions))
+
+    def test_dark_particles(self):
+        """
+        Test that dark particles are found against the background with invert=1
+        and invert=-1, that the subtraction saturates at zero, and that without a
+        background the frames are inverted against the brightest value of their type.
+        """
+        flat = np.full(self.movie.shape[1:], 3500, dtype=np.uint16)
+        sm.save_tiff_stack(flat[None], self.background_path)
+        dark = (4095 - self.movie + 1500 - 595).astype(np.uint16)
+        for invert in (1, -1):
+            x, y, _, _ = pf.ParticleFinder_MHD(dark, 1000, bground_name=self.background_path, invert=invert)
+            self.assert_found(x, y, 4)
+        x, _, _, _ = pf.ParticleFinder_MHD(dark, 1000, bground_name=self.background_path, invert=0)
+        self.assertEqual(len(x), 0)
+
+        # Frames brighter than the first one saturate instead of wrapping around
+        np.testing.assert_array_equal(pf.SubtractBackground(np.array([100, 3000], dtype=np.uint16), None, 1, 1023),
+                                      [923, 0])
+        dim = np.full((2, 40, 40), 800, dtype=np.uint16)
+        dim[1, 20, 20] = 3000
+        x, _, _, _ = pf.ParticleFinder_MHD(dim, 500, bground_name=[], invert=1)
+        self.assertEqual(len(x), 0)
+
+        # The inverse is taken against the type, not the brightness of the first frame
+        movie = np.full((2, 40, 40), 500, dtype=np.uint16)
+        movie[1] = 2000
+        movie[1, 20, 20] = 1000
+        x, y, _, _ = pf.ParticleFinder_MHD(movie, 300, framerange=[2, 2], bground_name=[], invert=1)
+        np.testing.assert_allclose(np.column_stack((x, y)), [[20, 20]])
+        frames, _ = sd.sample_frames(movie, [2, 2], bground_name=[], invert=1)
+        self.assertEqual(frames[0][20, 20], 65535 - 1000)
+
+        contrast = pf.SubtractBackground(dark[0], flat, 0)
+        self.assertEqual(contrast.dtype, np.uint16)
+        self.assertFalse(contrast[dark[0] < flat].any())
+
+    def test_log_table(self):
+        """
+        Test that the table of logarithms is extended for images brighter than
+        it covers, and that fractional thresholds select the same pixels.
+        """
+        frame = pf.SubtractBackground(self.movie[0], self.empty[0], 0)
+        pos = pf.FindParticles(frame, 1000, pf.log_table(8))
+        np.testing.assert_array_equal(pos, pf.FindParticles(frame, 1000, pf.log_table(12)))
+        np.testing.assert_array_equal(pf.FindParticles(frame, 999.5, pf.log_table(12)),
+                                      pf.FindParticles(frame, 1000, pf.log_table(12)))
+        self.assertEqual(pf.image_bit_depth(frame), 12)
+        self.assertEqual(pf.image_bit_depth(frame.astype(np.uint8)), 8)
+
+class TestLocalThreshold(unittest.TestCase):
+    """
+    Class for testing detection with a threshold that follows the illumination.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(2)
+        grid = np.stack(np.meshgrid(np.arange(8, 160, 12), np.arange(8, 80, 12)), axis=-1).reshape(-1, 2)
+        self.positions = grid + rng.uniform(-2, 2, size=grid.shape)
+        # The illumination grows from 10 on the left to 160 on the right
+        particles = sm.render_particles(self.positions, (90, 170), brightness=80, noise=2.0, rng=rng)
+        ramp = np.linspace(10, 160, 170).astype(np.uint8)
+        self.image = particles + ramp[None, :]
+        self.logs = pf.log_table(8)
+
+    def test_local_threshold(self):
+        """
+        Test that the local threshold is the block mean plus the threshold and the
+        weighted standard deviation.
+        """
+        local = pf.LocalThreshold(self.image, 40, 15, workspace=pf.DetectionWorkspace())
+        self.assertEqual(local.dtype, np.float32)
+        block = self.image[30:45, 50:65].astype(float)
+        self.assertAlmostEqual(local[37, 57], block.mean() + 40, places=3)
+        local = pf.LocalThreshold(self.image, 40, 14, k=2.0, workspace=pf.DetectionWorkspace())
+        self.assertAlmostEqual(local[37, 57], block.mean() + 40 + 2 * block.std(), places=2)
+
+    def test_uneven_illumination(self):
+        """
+        Test that a global threshold either misses the particles in the dark or finds
+        the bright background, while the local threshold finds every particle.
+        """
+        self.assertLess(len(pf.FindParticles(self.image, 200, self.logs)), len(self.positions))
+        self.assertGreater(len(pf.FindParticles(self.image, 100, self.logs)), len(self.positions))
+
+        # Only particles are found; a few have two equally bright pixels and no maximum
+        pos = pf.FindParticles(self.image, pf.LocalThreshold(self.image, 40, 15), self.logs)
+        self.assertGreater(len(pos), len(self.positions) - 4)
+        distance = np.linalg.norm(pos[:, None, :] - self.positions[None, :, :], axis=2).min(axis=1)
+        self.assertLess(distance.max(), 0.5)
+
+        x, y, t, _ = pf.ParticleFinder_MHD(np.stack([self.image] * 2), 40, bground_name=[],
+                                           threshold_block=15)
+        self.assertEqual(len(x), 2 * len(pos))
+        regions, _ = pf.FindRegions(self.image, pf.LocalThreshold(self.image, 30, 15), [3, 100])
+        self.assertEqual(len(regions), len(self.positions))
+
+class TestFindTiled(unittest.TestCase):
+    """
+    Class for testing detection in tiles with halos.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.small = sm.render_particles(rng.uniform(0, 299, size=(900, 2)), (250, 300), noise=2.0, rng=rng)
+        self.large = sm.render_particles(rng.uniform(0, 299, size=(150, 2)), (250, 300), particle_size=2.0,
+                                         noise=2.0, rng=rng)
+        self.logs = pf.log_table(8)
+
+    def assert_same_particles(self, pos, expected):
+        self.assertEqual(len(pos), len(expected))
+        order = np.lexsort(pos.T)
+        expected_order = np.lexsort(expected.T)
+        np.testing.assert_allclose(pos[order], expected[expected_order], atol=1e-9)
+
+    def test_particles(self):
+        """
+        Test that single-pixel particles are found once each, exactly as in the whole
+        image, for tiles that do not divide the image and in parallel.
+        """
+        expected = pf.FindParticles(self.small, 40, self.logs)
+        for tile_size, workers in ((64, None), (100, 3), (1000, None)):
+            pos, ang = pf.FindTiled(self.small, 40, 1, self.logs, tile_size, workers=workers)
+            self.assert_same_particles(pos, expected)
+            self.assertEqual(len(ang), len(pos))
+
+        local = pf.LocalThreshold(self.small, 30, 15)
+        expected = pf.FindParticles(self.small, local, self.logs).copy()
+        self.assert_same_particles(pf.FindTiled(self.small, local, 1, tile_size=70)[0], expected)
+
+    def test_regions(self):
+        """
+        Test that regions straddling tile edges are found once, with the centroid of
+        the whole region.
+        """
+        expected, expected_ang = pf.FindRegions(self.large, 60, [4, 400])
+        pos, ang = pf.FindTiled(self.large, 60, [4, 400], tile_size=64, workers=2)
+        self.assert_same_particles(pos, expected)
+        np.testing.assert_allclose(np.sort(ang), np.sort(expected_ang), atol=1e-9)
+
+        x, y, _, _ = pf.ParticleFinder_MHD(self.large[None], 60, bground_name=[], arealim=[4, 400],
+                                           tile_size=64)
+        self.assert_same_particles(np.column_stack((x, y)), expected)
+
+    def test_long_region_across_seam(self):
+        """
+        Test that a streak longer than the side of a square of its area, crossing a
+        tile edge, is found once with the centroid of the whole streak, and that
+        regions without a largest area need a halo.
+        """
+        im = np.zeros((200, 200), dtype=np.uint8)
+        im[50:52, 70:130] = 200
+        expected, _ = pf.FindRegions(im, 60, [4, 200])
+        np.testing.assert_allclose(expected, [[99.5, 50.5]])
+        pos, _ = pf.FindTiled(im, 60, [4, 200], tile_size=100)
+        self.assert_same_particles(pos, expected)
+
+        with self.assertRaises(ValueError):
+            pf.FindTiled(im, 60, 4, tile_size=100)
+        pos, _ = pf.FindTiled(im, 60, 4, tile_size=100, halo=60)
+        self.assert_same_particles(pos, expected)
+
+    def test_shared_executor(self):
+        """
+        Test that a thread pool can be passed in, and that ParticleFinder_MHD makes
+        one pool for the whole movie.
+        """
+        expected = pf.FindParticles(self.small, 40, self.logs).copy()
+        with pf._tile_executor(2) as executor:
+            for _ in range(2):
+                pos, _ = pf.FindTiled(self.small, 40, 1, self.logs, 64, executor=executor)
+                self.assert_same_particles(pos, expected)
+
+        movie = np.stack([self.small] * 3)
+        with patch.object(pf, '_tile_executor', wraps=pf._tile_executor) as make_executor:
+            x, y, t, _ = pf.ParticleFinder_MHD(movie, 40, bground_name=[], tile_size=64, tile_workers=2)
+        self.assertEqual(make_executor.call_count, 1)
+        self.assertEqual(len(t), 3 * len(expected))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""
+Test the detection parameter sweep in the detection_sweep module.
+"""
+import unittest
+
+import numpy as np
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking import ParticleFinder as pf
+from particlepals.particle_tracking.detection_sweep import sample_frames, sweep_detection
+
+class TestDetectionSweep(unittest.TestCase):
+    """
+    Class for testing sweep_detection against ParticleFinder_MHD.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        small = [sm.render_particles(rng.uniform(0, 119, size=(80, 2)), (100, 120), brightness=150,
+                                     background=20, noise=4.0, rng=rng) for _ in range(3)]
+        large = [sm.render_particles(rng.uniform(0, 119, size=(40, 2)), (100, 120), particle_size=1.5,
+                                     brightness=150, background=20, noise=4.0, rng=rng) for _ in range(3)]
+        self.movie = np.stack(small + large)
+
+    def test_sample_frames(self):
+        """
+        Test that the sample is spread evenly over the frame range.
+        """
+        frames, indices = sample_frames(self.movie, [2, 6], n_frames=3, bground_name=[])
+        np.testing.assert_array_equal(indices, [1, 3, 5])
+        np.testing.assert_array_equal(frames[1], self.movie[3])
+        _, indices = sample_frames(self.movie, n_frames=20, bground_name=[])
+        np.testing.assert_array_equal(indices, np.arange(6))
+
+    def test_counts_match_particle_finder(self):
+        """
+        Test that every setting counts the particles ParticleFinder_MHD finds in
+        the sampled frames, for single-pixel particles and regions, including area
+        limits that share their minimum area.
+        """
+        thresholds = [30, 45.5, 60, 90]
+        arealims = [1, 3, [4, 30], [4, 8], [6, np.inf]]
+        results = sweep_detection(self.movie, thresholds, arealims, n_frames=6, bground_name=[], invert=0)
+        self.assertEqual(len(results), len(thresholds) * len(arealims))
+        for row in results.itertuples():
+            arealim = 1 if row.arealim == 1 else list(row.arealim)
+            x, _, _, _ = pf.ParticleFinder_MHD(self.movie, row.threshold, bground_name=[], arealim=arealim, invert=0)
+            self.assertEqual(row.particles, len(x), msg=f"threshold {row.threshold}, arealim {arealim}")
+            self.assertAlmostEqual(row.density, len(x) / 6 / (100 * 120))
+
+        counts = results[results.arealim == 1].particles.to_numpy()
+        self.assertTrue(np.all(np.diff(counts) <= 0))
+        self.assertTrue(np.isinf(results.spacing[results.particles == 0]).all())
+
+        with self.assertRaises(ValueError):
+            sweep_detection(self.movie, [], bground_name=[])
+
+if __name__ == '__main__':
+    unittest.main()
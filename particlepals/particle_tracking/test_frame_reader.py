@@ -0,0 +1,148 @@
+"""
+Test the FrameReader class in the frame_reader module.
+"""
+import unittest
+import os
+import shutil
+import threading
+
+import numpy as np
+from PIL import Image
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking.frame_reader import FrameReader, FrameCache
+from particlepals.particle_tracking.BackgroundImage import BackgroundImage
+
+class TestFrameReader(unittest.TestCase):
+    """
+    Class for testing the FrameReader class.
+    """
+
+    test_directory = 'test_reader_directory'
+
+    def setUp(self):
+        os.makedirs(self.test_directory, exist_ok=True)
+        # Frame i is filled with the value 10 * i
+        self.movie = (10 * np.arange(6, dtype=np.uint8))[:, None, None] * np.ones((6, 8, 12), dtype=np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_directory, ignore_errors=True)
+
+    def check_frames(self, reader):
+        self.assertEqual((reader.n_frames, reader.height, reader.width), (6, 8, 12))
+        self.assertEqual(reader.color_depth, 256)
+        frames = list(reader.iter_frames(2, 4))
+        self.assertEqual([index for index, _ in frames], [2, 3, 4])
+        for index, frame in frames:
+            np.testing.assert_array_equal(frame, self.movie[index])
+        np.testing.assert_array_equal(reader.read(0), self.movie[0])
+        self.assertEqual(len(list(reader.iter_frames(4, 10))), 2)
+        with self.assertRaises(IndexError):
+            reader.read(6)
+
+    def test_array(self):
+        """
+        Test reading a movie held in an array.
+        """
+        with FrameReader(self.movie) as reader:
+            self.assertEqual(reader.movtype, 'array')
+            self.check_frames(reader)
+
+    def test_video(self):
+        """
+        Test that a video is decoded sequentially, and that recent frames come from
+        the cache without moving the decoder.
+        """
+        file_path = os.path.join(self.test_directory, 'movie.avi')
+        sm.save_avi(self.movie, file_path)
+        cache = FrameCache(max_bytes=3 * 8 * 12)
+        with FrameReader(file_path, gray=True, cache=cache) as reader:
+            self.assertEqual(reader.movtype, 'video')
+            self.check_frames(reader)
+            self.assertEqual(reader._position, 6)
+            self.assertEqual(len(cache), 3)
+            frame = reader.read(4)
+            self.assertEqual(reader._position, 6)
+            self.assertFalse(frame.flags.writeable)
+
+        with FrameReader(file_path) as reader:
+            self.assertEqual(reader.read(1).shape, (8, 12, 3))
+
+    def test_shared_cache(self):
+        """
+        Test that readers of the same movie share decoded frames, keyed by ROI and
+        dtype, and that an edited movie is decoded again.
+        """
+        file_path = os.path.join(self.test_directory, 'movie.avi')
+        sm.save_avi(self.movie, file_path)
+        cache = FrameCache()
+        background = BackgroundImage(file_path, os.path.join(self.test_directory, 'background.tif'))
+        self.assertEqual(background.dtype, np.uint8)
+        np.testing.assert_array_equal(background, np.full((8, 12), 25))
+
+        with FrameReader(file_path, gray=True, cache=cache) as reader:
+            list(reader.iter_frames())
+        self.assertEqual((cache.hits, cache.misses), (1, 6))
+        with FrameReader(file_path, gray=True, cache=cache) as reader:
+            list(reader.iter_frames())
+        self.assertEqual(cache.hits, 8)
+
+        with FrameReader(file_path, gray=True, roi=(2, 6, 3, 9), dtype=np.float32, cache=cache) as reader:
+            frame = reader.read(3)
+        self.assertEqual((frame.shape, frame.dtype), ((4, 6), np.float32))
+        self.assertIsNone(frame.base)
+        self.assertEqual(cache.nbytes, 6 * 8 * 12 + 2 * 4 * 6 * 4)
+
+        sm.save_avi(self.movie[::-1].copy(), file_path)
+        with FrameReader(file_path, gray=True, cache=cache) as reader:
+            np.testing.assert_array_equal(reader.read(0), self.movie[5])
+
+        cache.resize(0)
+        self.assertEqual((len(cache), cache.nbytes), (0, 0))
+
+    def test_prefetch(self):
+        """
+        Test that frames decoded ahead on a thread arrive in order, and that the
+        thread stops when the iteration is abandoned or fails.
+        """
+        file_path = os.path.join(self.test_directory, 'movie.avi')
+        sm.save_avi(self.movie, file_path)
+        with FrameReader(file_path, gray=True, cache=False) as reader:
+            indices = []
+            for index, frame in reader.iter_frames(1, 5, prefetch=2):
+                np.testing.assert_array_equal(frame, self.movie[index])
+                indices.append(index)
+            self.assertEqual(indices, [1, 2, 3, 4, 5])
+
+            frames = reader.iter_frames(prefetch=2)
+            next(frames)
+            frames.close()
+            self.assertFalse(any(thread.name == 'particlepals-decode' for thread in threading.enumerate()))
+
+        def fail(index):
+            raise ValueError("bad frame")
+        with FrameReader(file_path, cache=False) as reader:
+            reader.read = fail
+            with self.assertRaises(ValueError):
+                list(reader.iter_frames(prefetch=2))
+
+    def test_tiff_stack_and_images(self):
+        """
+        Test reading a multi-page TIFF and a sequence of image files.
+        """
+        stack_path = os.path.join(self.test_directory, 'movie.tif')
+        sm.save_tiff_stack(self.movie, stack_path)
+        with FrameReader(stack_path) as reader:
+            self.assertEqual(reader.movtype, 'stack')
+            self.check_frames(reader)
+
+        for index, image in enumerate(self.movie):
+            Image.fromarray(np.dstack([image] * 3)).save(os.path.join(self.test_directory, f'frame_{index}.png'))
+        with FrameReader(os.path.join(self.test_directory, 'frame_*.png'), gray=True) as reader:
+            self.assertEqual(reader.movtype, 'images')
+            self.check_frames(reader)
+
+        with self.assertRaises(FileNotFoundError):
+            FrameReader(os.path.join(self.test_directory, 'missing_*.png'))
+
+if __name__ == '__main__':
+    unittest.main()
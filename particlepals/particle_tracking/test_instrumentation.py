@@ -0,0 +1,145 @@
+"""
+Test the functions in the instrumentation module.
+"""
+import threading
+import unittest
+import logging
+
+import numpy as np
+from particlepals.particle_tracking import instrumentation as ins
+from particlepals.particle_tracking import ParticleFinder as pf
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking.PredictiveTracker import Predictive_tracker
+
+class TestStageTimer(unittest.TestCase):
+    """
+    Class for testing the StageTimer class.
+    """
+
+    def test_stages_and_counters(self):
+        """
+        Test that stage times, calls and counters are accumulated.
+        """
+        timer = ins.StageTimer()
+        for _ in range(3):
+            with timer.stage('decode'):
+                pass
+        timer.count('frames', 3)
+        timer.count('frames')
+        summary = timer.summary()
+        self.assertEqual(summary['stages']['decode']['calls'], 3)
+        self.assertGreaterEqual(summary['stages']['decode']['seconds'], 0)
+        self.assertEqual(summary['counters'], {'frames': 4})
+        self.assertIn('decode', timer.report())
+        timer.reset()
+        self.assertEqual(timer.summary()['stages'], {})
+
+    def test_stage_records_time_on_error(self):
+        """
+        Test that a stage is recorded even when its block raises.
+        """
+        timer = ins.StageTimer()
+        with self.assertRaises(RuntimeError):
+            with timer.stage('link'):
+                raise RuntimeError
+        self.assertEqual(timer.calls['link'], 1)
+
+    def test_threads(self):
+        """
+        Test that stages and counters updated from several threads at once are all recorded.
+        """
+        timer = ins.StageTimer()
+
+        def work():
+            for _ in range(1000):
+                with timer.stage('refine'):
+                    timer.count('particles')
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(timer.calls['refine'], 4000)
+        self.assertEqual(timer.counters['particles'], 4000)
+
+    def test_disabled_by_default(self):
+        """
+        Test that the default timer records nothing.
+        """
+        timer = ins.get_timer()
+        self.assertFalse(timer.enabled)
+        with timer.stage('decode'):
+            pass
+        timer.count('frames')
+
+    def test_timer_per_thread(self):
+        """
+        Test that instrument() blocks overlapping on two threads each record into
+        their own timer and restore their own state.
+        """
+        entered = threading.Barrier(2)
+        timers = {}
+
+        def run(name):
+            with ins.instrument() as timer:
+                entered.wait()
+                with ins.get_timer().stage(name):
+                    pass
+                timers[name] = timer
+                entered.wait()
+            timers[name + '_after'] = ins.get_timer()
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('decode', 'link')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(list(timers['decode'].calls), ['decode'])
+        self.assertEqual(list(timers['link'].calls), ['link'])
+        self.assertFalse(timers['decode_after'].enabled)
+        self.assertFalse(timers['link_after'].enabled)
+        self.assertFalse(ins.get_timer().enabled)
+
+
+class TestInstrumentedTracking(unittest.TestCase):
+    """
+    Class for testing the instrumentation of the particle finder and tracker.
+    """
+
+    def setUp(self):
+        velocity = np.ones((4, 4, 2))
+        self.movie, _ = sm.generate_synthetic_movie(velocity, (60, 80), num_frames=10, seed=1)
+
+    def test_instrument_tracking(self):
+        """
+        Test that a tracking run records every stage and restores the default timer.
+        """
+        with ins.instrument() as timer:
+            Predictive_tracker(self.movie, 40, 3, None, 1, 0, 0, None, None, None, None, 1)
+        self.assertFalse(ins.get_timer().enabled)
+        summary = timer.summary()
+        for stage in ins.STAGES:
+            self.assertIn(stage, summary['stages'])
+        self.assertEqual(summary['stages']['decode']['calls'], 10)
+        self.assertEqual(summary['counters']['frames'], 10)
+        self.assertGreater(summary['counters']['particles'], 0)
+
+    def test_tile_threads_are_timed(self):
+        """
+        Test that the tiles searched on worker threads are timed by the caller's timer.
+        """
+        with ins.instrument() as timer:
+            pf.FindTiled(self.movie[0], 40, 1, tile_size=20, workers=2)
+        self.assertEqual(timer.calls['refine'], 12)
+
+    def test_progress_is_logged(self):
+        """
+        Test that progress messages go to the particlepals logger.
+        """
+        with self.assertLogs('particlepals', level=logging.DEBUG) as logs:
+            Predictive_tracker(self.movie, 40, 3, None, 1, 0, 0, None, None, None, None, 1)
+        self.assertTrue(any('Processed frame 2 of 10' in message for message in logs.output))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+Test the functions in the plottracks module.
+"""
+import unittest
+import os
+import shutil
+
+import cv2
+import numpy as np
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking import plottracks
+
+class TestTrackOverlay(unittest.TestCase):
+    """
+    Class for testing the track overlay renderer.
+    """
+
+    test_directory = 'test_overlay_directory'
+
+    def setUp(self):
+        os.makedirs(self.test_directory, exist_ok=True)
+        self.movie_path = os.path.join(self.test_directory, 'movie.avi')
+        sm.save_avi(np.zeros((10, 40, 60), dtype=np.uint8), self.movie_path)
+        # A horizontal track over frames 2 to 6 and a vertical one over frames 5 to 9
+        self.vtracks = [{'len': 5, 'X': np.arange(10.0, 35.0, 5.0), 'Y': np.full(5, 10.0), 'T': np.arange(2, 7)},
+                        {'len': 5, 'X': np.full(5, 50.0), 'Y': np.arange(5.0, 30.0, 5.0), 'T': np.arange(5, 10)}]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_directory, ignore_errors=True)
+
+    def test_iter_track_overlay(self):
+        """
+        Test that only the active tracks are drawn, up to the current frame.
+        """
+        frames = dict(plottracks.iter_track_overlay(self.movie_path, self.vtracks))
+        self.assertEqual(sorted(frames), list(range(10)))
+        self.assertEqual(frames[4].shape, (40, 60, 3))
+
+        # Frame 4: the first track is drawn from x = 10 to 20
+        self.assertGreater(frames[4][10, 15].max(), 0)
+        self.assertEqual(frames[4][10, 28].max(), 0)
+        self.assertEqual(frames[4][:, 45:].max(), 0)
+        # Frame 7: the first track has ended, the second is drawn from y = 5 to 15
+        self.assertEqual(frames[7][:, :40].max(), 0)
+        self.assertGreater(frames[7][12, 50].max(), 0)
+        self.assertEqual(frames[7][25, 50].max(), 0)
+
+        # With a tail of one frame, only the last segment is drawn
+        frames = dict(plottracks.iter_track_overlay(self.movie_path, self.vtracks, [7, 7], tail_length=1))
+        self.assertEqual(list(frames), [6])
+        self.assertEqual(frames[6][10, 12].max(), 0)
+        self.assertGreater(frames[6][10, 27].max(), 0)
+
+    def test_render_tracks_video(self):
+        """
+        Test that the overlay movie is written with one frame per frame in the range.
+        """
+        output_path = os.path.join(self.test_directory, 'tracks.avi')
+        n_written = plottracks.render_tracks_video(self.movie_path, self.vtracks, output_path, framerange=[3, 8])
+        self.assertEqual(n_written, 6)
+
+        vid = cv2.VideoCapture(output_path)
+        self.assertEqual(int(vid.get(cv2.CAP_PROP_FRAME_COUNT)), 6)
+        vid.release()
+
+        # The frame range is 1-based and read from its ends, as in ParticleFinder_MHD
+        self.assertEqual(list(dict(plottracks.iter_track_overlay(self.movie_path, self.vtracks, range(3, 6)))),
+                         [2, 3, 4])
+
+        with self.assertRaises(ValueError):
+            plottracks.render_tracks_video(self.movie_path, self.vtracks, 'tracks.gif')
+
+if __name__ == '__main__':
+    unittest.main()
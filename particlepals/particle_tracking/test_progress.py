@@ -0,0 +1,99 @@
+"""
+Test the functions in the progress module.
+"""
+import unittest
+import threading
+
+import numpy as np
+from particlepals.particle_tracking import progress as pr
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking.PredictiveTracker import Predictive_tracker
+
+class TestProgressReporter(unittest.TestCase):
+    """
+    Class for testing the ProgressReporter class.
+    """
+
+    def test_progress_values(self):
+        """
+        Test the fraction, rate and ETA passed to the callback.
+        """
+        reports = []
+        reporter = pr.ProgressReporter(reports.append, min_interval=0)
+        reporter.start(4, 'detect')
+        reporter.update()
+        reporter.update(completed=4)
+        self.assertEqual([report.completed for report in reports], [0, 1, 4])
+        self.assertEqual(reports[0].eta, None)
+        self.assertEqual(reports[1].fraction, 0.25)
+        self.assertGreater(reports[1].rate, 0)
+        self.assertEqual(reports[-1].fraction, 1.0)
+        self.assertEqual(reports[-1].eta, 0)
+        self.assertEqual(reports[-1].stage, 'detect')
+
+    def test_min_interval(self):
+        """
+        Test that callbacks are throttled but the end of a stage is always reported.
+        """
+        reports = []
+        reporter = pr.ProgressReporter(reports.append, min_interval=3600)
+        reporter.start(10)
+        for _ in range(10):
+            reporter.update()
+        self.assertEqual([report.completed for report in reports], [0, 10])
+
+    def test_cancel_from_callback(self):
+        """
+        Test that a callback returning True cancels at the next update.
+        """
+        reporter = pr.ProgressReporter(lambda progress: progress.completed >= 2, min_interval=0)
+        reporter.start(5)
+        reporter.update()
+        with self.assertRaises(pr.OperationCancelled):
+            reporter.update()
+
+    def test_cancel_event(self):
+        """
+        Test that setting the cancel event cancels.
+        """
+        event = threading.Event()
+        reporter = pr.ProgressReporter(cancel_event=event)
+        reporter.start(5)
+        reporter.update()
+        event.set()
+        self.assertTrue(reporter.cancelled)
+        with self.assertRaises(pr.OperationCancelled):
+            reporter.update()
+
+class TestTrackingProgress(unittest.TestCase):
+    """
+    Class for testing progress reporting and cancellation of tracking.
+    """
+
+    def setUp(self):
+        velocity = np.ones((4, 4, 2))
+        self.movie, _ = sm.generate_synthetic_movie(velocity, (60, 80), num_frames=10, seed=1)
+
+    def test_tracking_reports_stages(self):
+        """
+        Test that detection and linking are both reported to completion.
+        """
+        reports = []
+        Predictive_tracker(self.movie, 40, 3, None, 1, 0, 0, None, None, None, None, 1,
+                           progress=pr.ProgressReporter(reports.append, min_interval=0))
+        for stage in ('detect', 'link'):
+            completed = [report.completed for report in reports if report.stage == stage]
+            self.assertEqual(completed[0], 0)
+            self.assertEqual(completed[-1], 10)
+
+    def test_tracking_cancelled(self):
+        """
+        Test that tracking stops when it is cancelled.
+        """
+        reporter = pr.ProgressReporter(lambda progress: progress.stage == 'link', min_interval=0)
+        with self.assertRaises(pr.OperationCancelled):
+            Predictive_tracker(self.movie, 40, 3, None, 1, 0, 0, None, None, None, None, 1, progress=reporter)
+        self.assertEqual(reporter.completed, 1)
+
+if __name__ == '__main__':
+    unittest.main()
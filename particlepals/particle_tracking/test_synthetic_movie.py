@@ -0,0 +1,160 @@
+"""
+Test the functions in the synthetic_movie module.
+"""
+import unittest
+import os
+import shutil
+
+import numpy as np
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking.ParticleFinder import ParticleFinder_MHD
+from particlepals.particle_tracking.PredictiveTracker import Predictive_tracker
+
+class TestRendering(unittest.TestCase):
+    """
+    Class for testing the rendering and advection of particles.
+    """
+
+    def test_render_particles(self):
+        """
+        Test that a particle is drawn with its peak at its position.
+        """
+        image = sm.render_particles(np.array([[10.0, 5.0]]), (20, 30), brightness=100, background=7)
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertEqual(image.shape, (20, 30))
+        self.assertEqual(image[5, 10], 107)
+        self.assertEqual(image[0, 0], 7)
+
+    def test_render_particles_16_bit(self):
+        """
+        Test that 12 bit images are stored as uint16 and clipped to their bit depth.
+        """
+        image = sm.render_particles(np.array([[10.0, 5.0]]), (20, 30), brightness=10000, bit_depth=12)
+        self.assertEqual(image.dtype, np.uint16)
+        self.assertEqual(image.max(), 4095)
+
+    def test_render_particles_invalid_bit_depth(self):
+        """
+        Test that a bit depth above 16 raises a ValueError.
+        """
+        with self.assertRaises(ValueError):
+            sm.render_particles(np.zeros((1, 2)), (20, 30), bit_depth=32)
+
+    def test_advect_particles_uniform_flow(self):
+        """
+        Test that particles in a uniform flow move by the velocity times the scale.
+        """
+        velocity = np.zeros((4, 5, 2))
+        velocity[..., 0] = 1.5
+        velocity[..., 1] = -0.5
+        positions = np.array([[10.0, 10.0], [3.2, 7.7]])
+        result = sm.advect_particles(positions, velocity, (40, 60), velocity_scale=2.0)
+        np.testing.assert_array_almost_equal(result, positions + [3.0, -1.0])
+
+class TestSyntheticMovie(unittest.TestCase):
+    """
+    Class for testing generate_synthetic_movie against the particle finder and tracker.
+    """
+
+    def setUp(self):
+        self.velocity = np.zeros((8, 8, 2))
+        self.velocity[..., 0] = 1.0
+        self.velocity[..., 1] = 0.5
+        self.movie, self.trajectories = sm.generate_synthetic_movie(
+            self.velocity, (80, 100), seeding_density=0.002, num_frames=12, seed=3)
+        self.test_folder = 'test_synthetic_movie_files'
+
+    def tearDown(self):
+        if os.path.exists(self.test_folder):
+            shutil.rmtree(self.test_folder)
+
+    def test_movie_and_trajectories(self):
+        """
+        Test the shapes of the movie and the ground truth.
+        """
+        self.assertEqual(self.movie.shape, (12, 80, 100))
+        self.assertEqual(self.trajectories.shape[1], 4)
+        # Every frame holds the same number of particles
+        counts = np.bincount(self.trajectories[:, 1].astype(int))
+        np.testing.assert_array_equal(counts, 16)
+        # Particles move with the flow along their tracks
+        track = self.trajectories[self.trajectories[:, 0] == self.trajectories[0, 0]]
+        if len(track) > 1:
+            np.testing.assert_array_almost_equal(np.diff(track[:, 2:], axis=0), [[1.0, 0.5]] * (len(track) - 1))
+
+    def test_reproducible(self):
+        """
+        Test that the same seed gives the same movie.
+        """
+        movie, trajectories = sm.generate_synthetic_movie(
+            self.velocity, (80, 100), seeding_density=0.002, num_frames=12, seed=3)
+        np.testing.assert_array_equal(movie, self.movie)
+        np.testing.assert_array_equal(trajectories, self.trajectories)
+
+    def test_steady_field_requires_num_frames(self):
+        """
+        Test that a single velocity frame without num_frames raises a ValueError.
+        """
+        with self.assertRaises(ValueError):
+            sm.generate_synthetic_movie(self.velocity, (80, 100))
+
+    def test_detection_matches_ground_truth(self):
+        """
+        Test that ParticleFinder_MHD finds the rendered particles at their true positions.
+        """
+        x, y, t, ang = ParticleFinder_MHD(self.movie, 40)
+        scores = sm.score_detections(x, y, t, self.trajectories)
+        self.assertGreater(scores['recall'], 0.9)
+        self.assertGreater(scores['precision'], 0.95)
+        self.assertLess(scores['rms_error'], 0.2)
+
+    def test_score_one_to_one(self):
+        """
+        Test that a detection is matched to at most one true particle, the closest.
+        """
+        # Two true particles 0.8 pixels apart share the one detection between them
+        trajectories = np.array([[0, 0, 10.0, 10.0], [1, 0, 10.8, 10.0], [2, 0, 30.0, 30.0]])
+        scores = sm.score_detections([10.5, 30.0], [10.0, 30.0], [0, 0], trajectories)
+        self.assertAlmostEqual(scores['recall'], 2 / 3)
+        self.assertEqual(scores['precision'], 1.0)
+        self.assertAlmostEqual(scores['rms_error'], np.sqrt(0.3**2 / 2))
+
+        # Detections farther than the tolerance are not matched
+        scores = sm.score_detections([12.0], [10.0], [0], trajectories)
+        self.assertEqual(scores['precision'], 0.0)
+        self.assertTrue(np.isnan(scores['rms_error']))
+
+    def test_tracking_recovers_velocity(self):
+        """
+        Test that Predictive_tracker links the particles and recovers the flow velocity.
+        """
+        vtracks = Predictive_tracker(self.movie, 40, 3, None, 1, 0, 0, None, None, None, None, 1)
+        self.assertGreater(len(vtracks), 0)
+        u = np.concatenate([vtrack['U'] for vtrack in vtracks])
+        v = np.concatenate([vtrack['V'] for vtrack in vtracks])
+        np.testing.assert_allclose(np.median(u), 1.0, atol=0.05)
+        np.testing.assert_allclose(np.median(v), 0.5, atol=0.05)
+
+    def test_save_and_read_files(self):
+        """
+        Test that saved movies and ground truth can be read back.
+        """
+        os.makedirs(self.test_folder, exist_ok=True)
+        tiff_path = os.path.join(self.test_folder, 'movie.tif')
+        avi_path = os.path.join(self.test_folder, 'movie.avi')
+        csv_path = os.path.join(self.test_folder, 'tracks.csv')
+        sm.save_tiff_stack(self.movie, tiff_path)
+        sm.save_avi(self.movie, avi_path)
+        sm.save_ground_truth(self.trajectories, csv_path)
+
+        expected = ParticleFinder_MHD(self.movie, 40)
+        for path in (tiff_path, avi_path):
+            x, y, t, ang = ParticleFinder_MHD(path, 40)
+            np.testing.assert_array_almost_equal(x, expected[0])
+            np.testing.assert_array_almost_equal(y, expected[1])
+            np.testing.assert_array_equal(t, expected[2])
+
+        np.testing.assert_array_almost_equal(sm.read_ground_truth(csv_path), self.trajectories, decimal=5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+"""
+Test that the numba kernels in tracking_kernels give the same results as the
+NumPy code of ParticleFinder and PredictiveTracker.
+"""
+import importlib
+import unittest
+
+import numpy as np
+from particlepals.particle_tracking import synthetic_movie as sm
+from particlepals.particle_tracking import ParticleFinder as pf
+from particlepals.particle_tracking import PredictiveTracker as pt
+from particlepals.particle_tracking import tracking_kernels as tk
+
+class TestBackendSetting(unittest.TestCase):
+    """
+    Class for testing the selection of the backend.
+    """
+
+    def setUp(self):
+        self.saved = tk.get_backend()
+
+    def tearDown(self):
+        tk.set_backend(self.saved)
+
+    def test_set_backend(self):
+        """
+        Test that the backend is validated and that 'numpy' turns the kernels off.
+        """
+        tk.set_backend('NumPy')
+        self.assertEqual(tk.get_backend(), 'numpy')
+        self.assertFalse(tk.use_numba())
+        tk.set_backend('auto')
+        self.assertEqual(tk.use_numba(), tk.numba is not None)
+        with self.assertRaises(ValueError):
+            tk.set_backend('cuda')
+        if tk.numba is None:
+            with self.assertRaises(ModuleNotFoundError):
+                tk.set_backend('numba')
+
+class TestPackageImport(unittest.TestCase):
+    """
+    Class for testing the kernels imported through the particlepals package.
+    """
+
+    def test_backend_shared_by_packages(self):
+        """
+        Test that the tracker and vector_operations import under the package path, and
+        that their kernels share one backend setting.
+        """
+        tracker = importlib.import_module('particlepals.particle_tracking.PredictiveTracker')
+        operations = importlib.import_module('particlepals.vector_analysis.vector_operations')
+        self.assertEqual(tracker.kernels.__name__, 'particlepals.particle_tracking.tracking_kernels')
+        self.assertEqual(operations.fk.__name__, 'particlepals.vector_analysis.field_kernels')
+        self.assertIs(tracker.kernels.set_backend, operations.fk.set_backend)
+
+@unittest.skipIf(tk.numba is None, "numba is not installed")
+class TestNumbaKernels(TestBackendSetting):
+    """
+    Class for comparing the numba kernels with the NumPy code.
+    """
+
+    def compare(self, function):
+        tk.set_backend('numpy')
+        expected = function()
+        tk.set_backend('numba')
+        result = function()
+        for value, expected_value in zip(result, expected):
+            np.testing.assert_array_equal(value, expected_value)
+        return result
+
+    def test_find_particles(self):
+        """
+        Test detection in 8 and 12 bit images, read-only frames and tiles of frames.
+        """
+        rng = np.random.default_rng(0)
+        for bit_depth in (8, 12):
+            image = sm.render_particles(rng.uniform(0, 199, size=(150, 2)), (160, 200),
+                                        brightness=200 * 2**(bit_depth - 8), noise=3.0,
+                                        bit_depth=bit_depth, rng=rng)
+            image.flags.writeable = False
+            pos = self.compare(lambda: [pf.FindParticles(image, 30.5, pf.log_table(8))])[0]
+            self.assertGreater(len(pos), 100)
+            self.compare(lambda: [pf.FindParticles(image[20:90, 35:150], 40, pf.log_table(bit_depth))])
+            self.compare(lambda: [pf.FindParticles(image.astype(float), 40, pf.log_table(bit_depth))])
+
+    def test_link_particles(self):
+        """
+        Test linking with ties, conflicts and tracks out of reach.
+        """
+        rng = np.random.default_rng(1)
+        positions = np.round(rng.uniform(0, 40, size=(300, 2)))
+        estimate = np.round(rng.uniform(0, 40, size=(500, 2)))
+        links, _ = self.compare(lambda: pt.LinkParticles(estimate, positions, 2))
+        self.assertTrue((links == -1).any() and (links >= 0).any())
+        self.compare(lambda: pt.LinkParticles(estimate[:1], positions[:1], 2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,15 @@
+import importlib.util
 import os
 import unittest
+from unittest import mock
 
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
 
-import velocities 
+from particlepals.particle_tracking import velocities
 
 
 class test_Velocities(unittest.TestCase):
@@ -24,3 +30,40 @@ class test_Velocities(unittest.TestCase):
         """
 
         return  
+
+
+class TestVelocitiesPlot(unittest.TestCase):
+    """
+    Class for testing the plot of the velocities.
+    """
+
+    def setUp(self):
+        self.vtracks = [{'len': 5, 'X': np.arange(5.0), 'Y': np.arange(5.0), 'T': np.arange(5),
+                         'U': np.ones(5), 'V': np.zeros(5)}]
+
+    def tearDown(self):
+        plt.close('all')
+
+    def test_plot(self):
+        """
+        Test that the velocities are plotted through the package.
+        """
+        with mock.patch.object(plt, 'show'):
+            velocities.velocities(self.vtracks, [1, 5], noisy=1)
+        self.assertGreater(len(plt.gca().collections), 0)
+
+    def test_plot_outside_package(self):
+        """
+        Test that the velocities are plotted with plt.quiver when the module
+        is loaded on its own, without the particlepals package.
+        """
+        spec = importlib.util.spec_from_file_location('velocities', velocities.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        with mock.patch.object(plt, 'show'):
+            module.velocities(self.vtracks, [1, 5], noisy=1)
+        self.assertEqual(len(plt.gca().collections), 1)
+        np.testing.assert_array_equal(plt.gca().collections[0].U, np.ones(5))
+
+if __name__ == '__main__':
+    unittest.main()
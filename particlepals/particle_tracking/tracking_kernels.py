@@ -0,0 +1,134 @@
+"""
+Module with compiled versions of the innermost loops of particle detection and
+linking. When numba is installed, the local maximum search, the sub-pixel
+refinement and the nearest-particle search run as single compiled passes over
+the data, without the intermediate arrays of their NumPy versions; without
+numba, or with the 'numpy' backend, ParticleFinder and PredictiveTracker use
+their NumPy code, which gives the same results.
+The backend is selected with kernel_backend, whose functions are imported here, so
+one setting also applies to vector_analysis (see field_kernels).
+Components:
+    * BACKENDS, get_backend, set_backend, use_numba - backend selection, from kernel_backend.
+    * find_maxima - row and column of the local maxima above a threshold.
+    * refine_maxima - sub-pixel positions of the maxima, from Gaussian fits.
+    * nearest_particles - nearest particle to each predicted track position.
+Examples:
+    set_backend('numba')
+    if use_numba():
+        rows, cols = find_maxima(frame, threshold)
+        pos = refine_maxima(frame, rows, cols, logs)
+"""
+import numpy as np
+
+try:
+    import numba
+except ModuleNotFoundError:
+    numba = None
+
+from ..kernel_backend import BACKENDS, BACKEND_VARIABLE, get_backend, set_backend, use_numba
+
+
+def _jit(function):
+    """
+    Compiles a kernel with numba, if it is installed. The kernels release the GIL,
+    and divide by zero like NumPy does (giving inf or nan) instead of raising.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True, error_model='numpy')(function)
+
+
+@_jit
+def _is_maximum(im, row, col, threshold):
+    value = im[row, col]
+    return (value >= threshold and value > im[row, col - 1] and value > im[row, col + 1]
+            and value > im[row - 1, col] and value > im[row + 1, col])
+
+
+@_jit
+def find_maxima(im, threshold):
+    """
+    Returns the rows and columns, in row-major order, of the pixels of im that are
+    at least threshold and brighter than their four nearest neighbors, ignoring the
+    outer ring of pixels (see FindParticles).
+    """
+    height, width = im.shape
+    count = 0
+    for row in range(1, height - 1):
+        for col in range(1, width - 1):
+            if _is_maximum(im, row, col, threshold):
+                count += 1
+
+    rows = np.empty(count, dtype=np.intp)
+    cols = np.empty(count, dtype=np.intp)
+    count = 0
+    for row in range(1, height - 1):
+        for col in range(1, width - 1):
+            if _is_maximum(im, row, col, threshold):
+                rows[count] = row
+                cols[count] = col
+                count += 1
+    return rows, cols
+
+
+@_jit
+def refine_maxima(im, rows, cols, logs):
+    """
+    Returns the (x, y) sub-pixel positions of the maxima at rows, cols, from a
+    Gaussian fit through each maximum and its neighbors in each direction. Maxima
+    whose fit fails are left out. logs must cover every pixel value (see log_table).
+    """
+    xcenters = np.empty(len(rows))
+    ycenters = np.empty(len(rows))
+    n_good = 0
+    for ii in range(len(rows)):
+        x = rows[ii]
+        y = cols[ii]
+        z2 = logs[np.intp(im[x, y]) + 1]
+        z1 = logs[np.intp(im[x - 1, y]) + 1]
+        z3 = logs[np.intp(im[x + 1, y]) + 1]
+        xcenter = -0.5 * (z1 * (-2*x - 1) + z2 * (4*x) + z3 * (-2*x + 1)) / (z1 + z3 - 2*z2)
+        z1 = logs[np.intp(im[x, y - 1]) + 1]
+        z3 = logs[np.intp(im[x, y + 1]) + 1]
+        ycenter = -0.5 * (z1 * (-2*y - 1) + z2 * (4*y) + z3 * (-2*y + 1)) / (z1 + z3 - 2*z2)
+        if np.isfinite(xcenter) and np.isfinite(ycenter):
+            xcenters[n_good] = xcenter
+            ycenters[n_good] = ycenter
+            n_good += 1
+
+    # Match MATLAB's coordinate system: x is the column, y the row
+    pos = np.empty((n_good, 2))
+    pos[:, 0] = ycenters[:n_good]
+    pos[:, 1] = xcenters[:n_good]
+    return pos
+
+
+@_jit
+def nearest_particles(estimate, positions):
+    """
+    For each predicted position in estimate, returns the index of the nearest
+    particle in positions (the first one in a tie), the squared distance to it, and
+    whether no other particle is at the same distance (see LinkParticles).
+    """
+    n_tracks = estimate.shape[0]
+    best = np.empty(n_tracks, dtype=np.intp)
+    costs = np.empty(n_tracks)
+    unique = np.empty(n_tracks, dtype=np.bool_)
+    for track in range(n_tracks):
+        cost = np.inf
+        nearest = 0
+        ties = 0
+        for particle in range(positions.shape[0]):
+            dx = estimate[track, 0] - positions[particle, 0]
+            dy = estimate[track, 1] - positions[particle, 1]
+            dist = dx * dx + dy * dy
+            if dist < cost:
+                cost = dist
+                nearest = particle
+                ties = 1
+            elif dist == cost:
+                ties += 1
+        best[track] = nearest
+        costs[track] = cost
+        unique[track] = ties == 1
+    return best, costs, unique
@@ -1,23 +1,32 @@
 
+import logging
+import os
+import sys
 import cv2
 import matplotlib.pyplot as plt
-from PredictiveTracker import Predictive_tracker
-from velocities import velocities
-from plottracks import plot_tracks_avi
 import numpy as np
 
-inputname = '/Users/mohankukreja/Documents/ParticleTrackingGUI/src/Translation/testtracks.avi'
+# The modules are imported through the particlepals package, from the repository folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from particlepals.particle_tracking.PredictiveTracker import Predictive_tracker
+from particlepals.particle_tracking.instrumentation import instrument
+from particlepals.particle_tracking.velocities import velocities
+from particlepals.particle_tracking.plottracks import plot_tracks_avi
+from particlepals.particle_tracking.frame_reader import FrameReader
 
-vid = cv2.VideoCapture(inputname)
+inputname = '/Users/mohankukreja/Documents/ParticleTrackingGUI/src/Translation/testtracks.avi'
 
-if not vid.isOpened():
+# Decodes the frames in order, with a few recent frames cached
+try:
+    reader = FrameReader(inputname)
+except FileNotFoundError:
     print("Error opening video file")
     exit()
 
 
 frame_num = 0
-vid.set(cv2.CAP_PROP_POS_FRAMES, frame_num)  # Frame numbering starts at 0 in cv2
-success, img = vid.read()
+img = reader.read(frame_num)  # Frame numbering starts at 0
+success = True
 
 # if success:
 #     # Plot one frame
@@ -33,32 +42,33 @@ max_disp = 8
 bground_name = []
 minarea = 2
 invert = 0
-framerange = range(11,20)
+framerange = [11, 19]  # 1-based first and last frames
 
-vtracks = Predictive_tracker(inputname, threshold, max_disp, bground_name, minarea, invert, None, framerange, None, None, None, None)
+# Log the progress and the time spent in each stage
+logging.basicConfig(level=logging.INFO)
+with instrument(log_report=True):
+    vtracks = Predictive_tracker(inputname, threshold, max_disp, bground_name, minarea, invert, None, framerange, None, None, None, None)
 print(vtracks)
 u,v,x,y,t, tr=velocities(vtracks, framerange);
 
 if not framerange:
-    images2plot = range(int(vid.get(cv2.CAP_PROP_FRAME_COUNT)))  # All frames
+    images2plot = reader.iter_frames()  # All frames
 else:
-    images2plot = range(framerange[0], framerange[1] + 1)
+    images2plot = reader.iter_frames(framerange[0] - 1, framerange[-1] - 1)  # 0-based indices
 
-# Plotting particles
-for i in images2plot:
-    vid.set(cv2.CAP_PROP_POS_FRAMES, i)
-    success, frame = vid.read()
-    if success:
-        plt.figure(2)
-        plt.imshow(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-        plt.axis('off')
+# Plotting particles, decoding the frames in one pass
+for i, frame in images2plot:
+    plt.figure(2)
+    plt.imshow(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    plt.axis('off')
 
-        # Find and scatter particles
-        part = np.where(t == i)[0]
-        plt.scatter(x[part], y[part], c='r', marker='o')
+    # Find and scatter particles
+    part = np.where(t == i)[0]
+    plt.scatter(x[part], y[part], c='r', marker='o')
 
-        plt.pause(0.1)  # Pause in seconds
-        plt.clf()
+    plt.pause(0.1)  # Pause in seconds
+    plt.clf()
 
 
+reader.close()
 plot_tracks_avi(inputname, vtracks, framerange)
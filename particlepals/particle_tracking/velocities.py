@@ -6,7 +6,8 @@ def velocities(vtracks, framerange=[-np.inf, np.inf], noisy=0):
     Converts velocity tracks to velocities and plots if noisy is not 0.
     vtracks: Input data in structured format.
     framerange: Range of frames to consider.
-    noisy: Controls plotting, 0 means no plot.
+    noisy: Controls plotting, 0 means no plot. The velocities are plotted
+        averaged on a coarse grid (see vector_analysis.quiver_rendering).
     """
 
     if not vtracks:
@@ -50,8 +51,19 @@ def velocities(vtracks, framerange=[-np.inf, np.inf], noisy=0):
     #The aspect ratio is set to equal, and the plot is adjusted to be tight around the data.
     #The plot title is set based on the range of frames considered.
     if noisy:
+        # Average the velocities on a grid of about one arrow per 20 pixels, so
+        # the plot stays fast however many particles were tracked
+        try:
+            from ..vector_analysis.quiver_rendering import bin_vectors, max_arrows_for_axes, plot_vector_field
+        except ImportError:
+            # Loaded outside the particlepals package: plot every velocity
+            plot_vector_field = None
         plt.figure()
-        plt.quiver(x, y, u, v)
+        ax = plt.gca()
+        if plot_vector_field is None:
+            ax.quiver(x, y, u, v)
+        else:
+            plot_vector_field(ax, *bin_vectors(x, y, u, v, max_arrows_for_axes(ax)))
         plt.gca().set_aspect('equal', adjustable='box')
         plt.axis('tight')
         if framerange[0] == framerange[1]:
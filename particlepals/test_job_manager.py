@@ -0,0 +1,95 @@
+"""
+Test the classes in the job_manager module.
+"""
+import unittest
+import threading
+
+from particlepals import job_manager as jm
+
+
+def count_frames(n_frames, progress=None, started=None, release=None):
+    """
+    Stand-in computation that reports progress for n_frames frames.
+    """
+    progress.start(n_frames, 'count')
+    if started is not None:
+        started.set()
+    for _ in range(n_frames):
+        if release is not None:
+            release.wait(5)
+        progress.update()
+    return n_frames
+
+
+def fail(progress=None):
+    raise ValueError("bad input")
+
+
+class TestJobManager(unittest.TestCase):
+    """
+    Class for testing the JobManager class.
+    """
+
+    def setUp(self):
+        self.manager = jm.JobManager(max_workers=1, max_jobs=3)
+
+    def tearDown(self):
+        self.manager.shutdown()
+
+    def test_job_result(self):
+        """
+        Test that a job runs in the background and stores its result and progress.
+        """
+        job = self.manager.submit(count_frames, 4, description='count')
+        job.future.result(timeout=5)
+        self.assertIs(self.manager.get(job.id), job)
+        self.assertEqual(job.status, jm.DONE)
+        self.assertEqual(job.result, 4)
+        self.assertEqual(job.progress.completed, 4)
+        self.assertEqual(job.progress.stage, 'count')
+        self.assertTrue(job.finished_running)
+        self.assertLessEqual(job.started, job.finished)
+
+    def test_failed_job(self):
+        """
+        Test that the exception of a failed job is stored.
+        """
+        job = self.manager.submit(fail)
+        job.future.result(timeout=5)
+        self.assertEqual(job.status, jm.FAILED)
+        self.assertIsInstance(job.error, ValueError)
+
+    def test_cancel_running_and_pending_jobs(self):
+        """
+        Test that a running job stops at its next update and a pending job never runs.
+        """
+        started = threading.Event()
+        release = threading.Event()
+        running = self.manager.submit(count_frames, 100, started=started, release=release)
+        pending = self.manager.submit(count_frames, 1)
+        self.assertTrue(started.wait(5))
+        self.assertEqual(running.status, jm.RUNNING)
+        self.assertEqual(pending.status, jm.PENDING)
+
+        self.manager.cancel(pending.id)
+        self.manager.cancel(running.id)
+        release.set()
+        running.future.result(timeout=5)
+        self.assertEqual(running.status, jm.CANCELLED)
+        self.assertLess(running.progress.completed, 100)
+        self.assertEqual(pending.status, jm.CANCELLED)
+        self.assertIsNone(pending.result)
+
+    def test_old_jobs_are_forgotten(self):
+        """
+        Test that only max_jobs jobs are kept, dropping the oldest finished ones.
+        """
+        jobs = []
+        for n_frames in range(5):
+            jobs.append(self.manager.submit(count_frames, n_frames))
+            jobs[-1].future.result(timeout=5)
+        self.assertEqual([job.id for job in self.manager.jobs()], [job.id for job in jobs[-3:]])
+        self.assertIsNone(self.manager.get(jobs[0].id))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+"""
+Module with compiled versions of the neighborhood loops of vector_operations.
+With numba installed, a pass of fill_in_nan_values_using_filter visits only the
+NaN points and their eight neighbors, instead of building the neighbor sums and
+sliding windows of the whole grid. Without numba, or with the 'numpy' backend,
+vector_operations uses its NumPy code, which gives the same results.
+The backend is shared with particle_tracking through kernel_backend, whose
+functions are imported here: 'auto' (numba if installed), 'numpy' or 'numba'.
+Components:
+    * get_backend, set_backend, use_numba - backend selection, from kernel_backend.
+    * fill_pass - replacement values for the NaN points of one filling pass.
+Examples:
+    set_backend('numpy')
+    result, replaced_count, unsuccessful_count, total_points = vo.fill_in_nan_values_using_filter(grid, 'mean')
+"""
+import numpy as np
+
+try:
+    import numba
+except ModuleNotFoundError:
+    numba = None
+
+from ..kernel_backend import BACKENDS, BACKEND_VARIABLE, get_backend, set_backend, use_numba
+
+
+def _jit(function):
+    """
+    Compiles a kernel with numba. Without numba the plain Python function is
+    returned; vector_operations then uses its NumPy code and never calls it.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True, error_model='numpy')(function)
+
+
+@_jit
+def _neighbors(result, nan_mask, row, col, values):
+    """
+    Writes the valid values around (row, col) into values, in row-major order,
+    and returns how many there are.
+    """
+    n_rows, n_cols = result.shape
+    count = 0
+    for di in range(-1, 2):
+        for dj in range(-1, 2):
+            r = row + di
+            c = col + dj
+            if (di == 0 and dj == 0) or r < 0 or r >= n_rows or c < 0 or c >= n_cols:
+                continue
+            if not nan_mask[r, c]:
+                values[count] = result[r, c]
+                count += 1
+    return count
+
+
+@_jit
+def fill_pass(result, nan_mask, required, median):
+    """
+    Returns the rows, columns and replacement values of the NaN points (nan_mask)
+    with at least "required" valid neighbors: the mean, or the median if median is
+    True, of the valid values in their 3x3 neighborhood. result is a float64 grid
+    and required an integer grid of the same shape.
+    """
+    n_rows, n_cols = result.shape
+    values = np.empty(8)
+    n_replace = 0
+    for row in range(n_rows):
+        for col in range(n_cols):
+            if nan_mask[row, col] and _neighbors(result, nan_mask, row, col, values) >= required[row, col]:
+                n_replace += 1
+
+    rows = np.empty(n_replace, dtype=np.intp)
+    cols = np.empty(n_replace, dtype=np.intp)
+    filled = np.empty(n_replace)
+    index = 0
+    for row in range(n_rows):
+        for col in range(n_cols):
+            if not nan_mask[row, col]:
+                continue
+            count = _neighbors(result, nan_mask, row, col, values)
+            if count < required[row, col]:
+                continue
+            rows[index] = row
+            cols[index] = col
+            if not median:
+                # Summed in the same order as the NumPy neighbor sums
+                total = 0.0
+                for jj in range(count):
+                    total += values[jj]
+                filled[index] = total / count
+            elif count == 0:
+                filled[index] = np.nan
+            else:
+                ordered = np.sort(values[:count])
+                half = count // 2
+                if count % 2:
+                    filled[index] = ordered[half]
+                else:
+                    filled[index] = (ordered[half - 1] + ordered[half]) / 2
+            index += 1
+    return rows, cols, filled
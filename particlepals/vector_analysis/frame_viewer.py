@@ -0,0 +1,171 @@
+"""
+Module for browsing the frames of a velocity field folder interactively.
+The frames are read once into a memory-mapped stack, which is kept in a cache
+folder and reopened instantly afterwards, so any frame can be loaded without
+parsing its CSV file again. The viewer draws a single quiver plot, thinned out to
+the number of arrows that can be told apart on screen, and only replaces the
+arrow data when another frame is shown.
+Components:
+    * open_frame_stack - opens the cached memory-mapped stack of a folder, building it if needed.
+    * FrameViewer - quiver plot of one frame of a stack that can be switched to any other frame.
+Examples:
+    x_grid, y_grid, u_stack, v_stack, numbers = open_frame_stack(folder_path)
+    viewer = FrameViewer(x_grid, y_grid, u_stack, v_stack, numbers)
+    figure = viewer.show_number(numbers[10])
+"""
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from matplotlib.figure import Figure
+
+from . import read_and_reshape_csv as rrc
+from .quiver_rendering import decimation_steps, max_arrows_for_axes
+
+def _path_key(folder_path):
+    """
+    Returns a key identifying the path of a folder, the prefix of its cached stacks.
+    """
+    return hashlib.sha1(os.path.abspath(folder_path).encode()).hexdigest()[:12]
+
+def _folder_key(folder_path):
+    """
+    Returns a key identifying the current contents of the frame files of a folder.
+    """
+    digest = hashlib.sha1()
+    for _, file_name in rrc._list_frame_files(folder_path):
+        stat = os.stat(os.path.join(folder_path, file_name))
+        digest.update(f"{file_name}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return f'{_path_key(folder_path)}_{digest.hexdigest()[:20]}'
+
+def _remove_stale_stacks(cache_dir, folder_path, key):
+    """
+    Deletes the cached stacks of earlier contents of a folder, keeping the one of key.
+    Stacks still open elsewhere (on Windows) are left for a later call.
+    """
+    prefix = f'{_path_key(folder_path)}_'
+    for file_name in os.listdir(cache_dir):
+        if (file_name.startswith(prefix) and not file_name.startswith(f'{key}.')
+                and not file_name.startswith(f'{key}_') and file_name.endswith(('.npy', '_grid.npz'))):
+            try:
+                os.remove(os.path.join(cache_dir, file_name))
+            except OSError:
+                pass
+
+def open_frame_stack(folder_path, cache_dir=None):
+    """
+    Opens the frames of a folder as a read-only memory-mapped stack. The stack is
+    built with read_csv_folder_as_stack the first time and stored in cache_dir;
+    later calls reopen it without reading the CSV files, until a frame file changes.
+    The stack then built replaces the stacks of the earlier contents of the folder.
+
+    Parameters:
+        folder_path (str): Path to the folder containing the frame_N.csv files.
+        cache_dir (str): Folder for the cached stacks. Defaults to a
+            'particlepals_frames' folder in the temporary directory.
+
+    Returns:
+        x_grid, y_grid (numpy.ndarray): The spatial grids.
+        u_stack, v_stack (numpy.memmap): (n_frames, ny, nx) velocity stacks.
+        numbers (list): The frame numbers in stack order.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(tempfile.gettempdir(), 'particlepals_frames')
+    os.makedirs(cache_dir, exist_ok=True)
+    key = _folder_key(folder_path)
+    stack_path = os.path.join(cache_dir, f'{key}.npy')
+    grid_path = os.path.join(cache_dir, f'{key}_grid.npz')
+
+    if not (os.path.exists(stack_path) and os.path.exists(grid_path)):
+        # Build under temporary names so an interrupted build is never reused
+        partial_path = f'{stack_path}.{os.getpid()}.partial'
+        x_grid, y_grid, u_stack, v_stack, numbers = rrc.read_csv_folder_as_stack(folder_path, mmap_path=partial_path)
+        u_stack.base.flush()
+        del u_stack, v_stack
+        np.savez(f'{grid_path}.{os.getpid()}.partial.npz', x_grid=x_grid, y_grid=y_grid, numbers=numbers)
+        os.replace(partial_path, stack_path)
+        os.replace(f'{grid_path}.{os.getpid()}.partial.npz', grid_path)
+        _remove_stale_stacks(cache_dir, folder_path, key)
+
+    stack = np.load(stack_path, mmap_mode='r')
+    with np.load(grid_path) as grids:
+        x_grid, y_grid, numbers = grids['x_grid'], grids['y_grid'], grids['numbers'].tolist()
+    return x_grid, y_grid, stack[0], stack[1], numbers
+
+class FrameViewer:
+    """
+    Quiver plot of one frame of a velocity stack that can be switched to any other
+    frame. The figure and the quiver are made once; showing another frame only
+    reads the decimated arrows of that frame and updates the quiver with set_UVC.
+
+    Example:
+        >>> viewer = FrameViewer(x_grid, y_grid, u_stack, v_stack, numbers)
+        >>> figure = viewer.show(0)
+        >>> figure = viewer.show(1)  # same figure, new arrows
+    """
+
+    def __init__(self, x_grid, y_grid, u_stack, v_stack, numbers=None, max_arrows=None,
+                 figsize=(4, 4), title='Turbulent Velocity Field', **quiver_kwargs):
+        """
+        Parameters:
+            x_grid, y_grid (numpy.ndarray): (ny, nx) spatial grids.
+            u_stack, v_stack (numpy.ndarray): (n_frames, ny, nx) velocity stacks,
+                e.g. memory-mapped stacks from open_frame_stack.
+            numbers (list): Frame numbers of the stack. Defaults to 0, 1, 2, ...
+            max_arrows (int or tuple): Largest number of arrows along each axis.
+                Defaults to one arrow every 20 pixels of the figure.
+            figsize (tuple): Size of the figure in inches.
+            title (str): Title of the plot; the frame number is appended.
+            quiver_kwargs: Options of Axes.quiver, by default
+                scale=15, scale_units='xy', angles='xy'.
+        """
+        self.u_stack = u_stack
+        self.v_stack = v_stack
+        self.numbers = list(range(len(u_stack))) if numbers is None else list(numbers)
+        self.title = title
+        self._quiver_kwargs = dict(scale=15, scale_units='xy', angles='xy')
+        self._quiver_kwargs.update(quiver_kwargs)
+
+        self.figure = Figure(figsize=figsize)
+        self.axes = self.figure.add_subplot()
+        self.axes.set_xlabel('X')
+        self.axes.set_ylabel('Y')
+
+        if max_arrows is None:
+            max_arrows = max_arrows_for_axes(self.axes)
+        self.steps = decimation_steps(x_grid.shape, max_arrows)
+        self._slices = (slice(None, None, self.steps[0]), slice(None, None, self.steps[1]))
+        self._x = x_grid[self._slices]
+        self._y = y_grid[self._slices]
+        self.quiver = None
+        self.index = None
+
+    def show(self, index):
+        """
+        Shows the frame at position index of the stack.
+
+        Returns:
+            matplotlib.figure.Figure: The updated figure.
+        """
+        if index == self.index:
+            return self.figure
+        # Only the decimated points of the frame are read from the stack
+        u = np.asarray(self.u_stack[index][self._slices])
+        v = np.asarray(self.v_stack[index][self._slices])
+        if self.quiver is None:
+            self.quiver = self.axes.quiver(self._x, self._y, u, v, **self._quiver_kwargs)
+        else:
+            self.quiver.set_UVC(u, v)
+        self.axes.set_title(f'{self.title}, Frame {self.numbers[index]}')
+        self.index = index
+        return self.figure
+
+    def show_number(self, number):
+        """
+        Shows the frame with the given frame number.
+
+        Returns:
+            matplotlib.figure.Figure: The updated figure.
+        """
+        return self.show(self.numbers.index(number))
@@ -1,70 +1,276 @@
 """
 Module to generate a turbulent velocity field using Perlin noise. 
-The turbulent velocity field is generated as a list
-of frames, where each frame is a 3D array of shape (grid_size, grid_size, 2), 
-where the last dimension contains the u and v components of the velocity 
-field. The frames can be saved to CSV files using the save_frames_to_csv function.
+The turbulent velocity field is generated as an array of frames of shape
+(num_frames, grid_size, grid_size, 2), where the last dimension contains the
+u and v components of the velocity field. The noise is evaluated with NumPy
+for whole frames at once, so large synthetic benchmarks can be produced quickly.
+The iter_* functions produce the frames lazily, so they can be streamed to disk
+without holding the whole dataset in memory.
+The frames can be saved to CSV files using the save_frames_to_csv function.
 The frames can be plotted using the plot_frame function. The turbulent velocity 
 field can be generated using the generate_turbulent_velocity_field 
-function.
+function, or with a prescribed energy spectrum using the
+generate_spectral_velocity_field function.
 Components:
-    * generate_turbulent_velocity_field - generates a turbulent velocity field.
-    * save_frames_to_csv - saves the frames to CSV files.
+    * perlin_noise_2d - evaluates multi-octave Perlin gradient noise on arrays of coordinates.
+    * iter_turbulent_velocity_field - lazily generates the frames of a turbulent velocity field from Perlin noise.
+    * generate_turbulent_velocity_field - generates all frames of that field as one array.
+    * iter_spectral_velocity_field - lazily generates the frames of a divergence-free turbulent velocity
+      field synthesized in Fourier space.
+    * generate_spectral_velocity_field - generates all frames of that field as one array.
+    * save_frames_to_csv - saves the frames to CSV files, one frame at a time.
+    * save_frames_to_npy - saves the frames to a single memory-mapped .npy file, one frame at a time.
     * plot_frame - plots the velocity field of a frame.
 Examples:
     # Generate a turbulent velocity field
     turbulent_frames = generate_turbulent_velocity_field(grid_size, num_frames)
+    # Generate a reproducible field with a Kolmogorov-like spectrum
+    turbulent_frames = generate_spectral_velocity_field(grid_size, num_frames, seed=1)
     # Save the frames to CSV files
     save_frames_to_csv(turbulent_frames)
+    # Stream a dataset larger than memory to a binary file
+    save_frames_to_npy(iter_turbulent_velocity_field(1024, 1000), 'frames.npy', num_frames=1000)
     # Plot the velocity field of a frame
     plot_frame(frame)
     """
 import os
 import numpy as np
-import noise
-import csv
 import matplotlib.pyplot as plt
 
-def generate_turbulent_velocity_field(grid_size, num_frames, amplitude = 10000, persistence=0.5, lacunarity=2.0, scale=500.0):
-    frames = []
+from . import quiver_rendering as qr
 
+# Gradient directions of the 2D Perlin noise lattice
+_GRADIENTS = np.array([[1, 1], [-1, 1], [1, -1], [-1, -1],
+                       [1, 0], [-1, 0], [0, 1], [0, -1]], dtype=float)
+
+# Number of grid points evaluated at once, bounding the size of temporary arrays
+_CHUNK_POINTS = 2**22
+
+def _permutation_table(seed):
+    """
+    Build the doubled permutation table of the noise lattice from a seed.
+    """
+    permutation = np.random.default_rng(seed).permutation(256)
+    return np.concatenate((permutation, permutation))
+
+def _fade(t):
+    """
+    Perlin's quintic fade curve 6t^5 - 15t^4 + 10t^3, which blends the lattice corners
+    with zero first and second derivatives at the cell edges.
+    """
+    return t * t * t * (t * (t * 6 - 15) + 10)
+
+def _lattice_noise(x, y, permutation):
+    """
+    Evaluate a single octave of Perlin gradient noise at the coordinates x, y.
+    """
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    xf = x - x0
+    yf = y - y0
+    xi = x0.astype(np.int64) & 255
+    yi = y0.astype(np.int64) & 255
+
+    # Hash the four lattice corners around each point
+    px0 = permutation[xi]
+    px1 = permutation[xi + 1]
+    h00 = permutation[px0 + yi] & 7
+    h01 = permutation[px0 + yi + 1] & 7
+    h10 = permutation[px1 + yi] & 7
+    h11 = permutation[px1 + yi + 1] & 7
+
+    # Dot products of the corner gradients with the offsets to the point
+    n00 = _GRADIENTS[h00, 0] * xf + _GRADIENTS[h00, 1] * yf
+    n10 = _GRADIENTS[h10, 0] * (xf - 1) + _GRADIENTS[h10, 1] * yf
+    n01 = _GRADIENTS[h01, 0] * xf + _GRADIENTS[h01, 1] * (yf - 1)
+    n11 = _GRADIENTS[h11, 0] * (xf - 1) + _GRADIENTS[h11, 1] * (yf - 1)
+
+    u = _fade(xf)
+    v = _fade(yf)
+    nx0 = n00 + u * (n10 - n00)
+    nx1 = n01 + u * (n11 - n01)
+    return nx0 + v * (nx1 - nx0)
+
+def perlin_noise_2d(x, y, octaves=6, persistence=0.5, lacunarity=2.0, seed=0):
+    """
+    Evaluate multi-octave Perlin gradient noise at arrays of coordinates.
+    x and y are broadcast against each other, so a whole grid (or a stack of
+    grids) is evaluated in one vectorized call.
+    Inputs:
+        x (numpy.ndarray): x coordinates in noise units.
+        y (numpy.ndarray): y coordinates in noise units.
+        octaves (int): Number of octaves summed.
+        persistence (float): Amplitude ratio between successive octaves.
+        lacunarity (float): Frequency ratio between successive octaves.
+        seed (int): Seed of the permutation table; the same seed gives the same noise.
+    Outputs:
+        noise (numpy.ndarray): Noise values, normalized by the total octave amplitude.
+    Examples:
+        world = perlin_noise_2d(i[:, np.newaxis] / scale, j[np.newaxis, :] / scale)
+    """
+    permutation = _permutation_table(seed)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    # x and y are only broadcast where they meet, so the per-axis work of
+    # separable coordinates (rows and columns of a grid) stays one-dimensional
+    total = np.zeros(np.broadcast_shapes(x.shape, y.shape))
+    frequency = 1.0
+    amplitude = 1.0
+    max_amplitude = 0.0
+    for _ in range(octaves):
+        total += amplitude * _lattice_noise(x * frequency, y * frequency, permutation)
+        max_amplitude += amplitude
+        amplitude *= persistence
+        frequency *= lacunarity
+
+    return total / max_amplitude
+
+def iter_turbulent_velocity_field(grid_size, num_frames, amplitude = 10000, persistence=0.5, lacunarity=2.0, scale=500.0,
+                                  octaves=6, seed=0):
+    """
+    Lazily generate the frames of a turbulent velocity field from the gradient of Perlin
+    noise. The noise is shifted along the diagonal from frame to frame, and the velocity
+    is the rotated gradient of the noise, u = -d(noise)/dy and v = d(noise)/dx. Frames are
+    evaluated a few at a time, so memory use does not grow with num_frames.
+    Inputs:
+        grid_size (int): Number of grid points along each side of a frame.
+        num_frames (int): Number of frames.
+        amplitude (float): Scale factor of the velocity.
+        persistence (float): Amplitude ratio between successive noise octaves.
+        lacunarity (float): Frequency ratio between successive noise octaves.
+        scale (float): Size of a noise lattice cell in grid points.
+        octaves (int): Number of noise octaves.
+        seed (int): Seed of the noise; the same seed gives the same frames.
+    Outputs:
+        Yields one (grid_size, grid_size, 2) array per frame.
+    Examples:
+        save_frames_to_csv(iter_turbulent_velocity_field(grid_size, num_frames))
+    """
     base = np.linspace(10,20,num_frames)
-    for _ in range(num_frames):
-        # Generate 2D Perlin noise
-        # base = np.random.randint(0, 1000)
-        world = np.empty((grid_size, grid_size))
-        for i in range(grid_size):
-            for j in range(grid_size):
-                world[i][j] = noise.pnoise2(
-                    (i + base[_]) / scale,
-                    (j + base[_]) / scale,
-                    octaves=6,
-                    persistence=persistence,
-                    lacunarity=lacunarity,
-                    repeatx=1024,
-                    repeaty=1024,
-                    base=0,
-                )
+    index = np.arange(grid_size)
+
+    # Evaluate the noise for as many frames at a time as fit in a chunk
+    chunk = max(1, _CHUNK_POINTS // (grid_size * grid_size))
+    for start in range(0, num_frames, chunk):
+        offset = base[start:start + chunk, np.newaxis, np.newaxis]
+        world = perlin_noise_2d(
+            (index[np.newaxis, :, np.newaxis] + offset) / scale,
+            (index[np.newaxis, np.newaxis, :] + offset) / scale,
+            octaves=octaves,
+            persistence=persistence,
+            lacunarity=lacunarity,
+            seed=seed,
+        )
 
         # Calculate the gradient
-        dx, dy = np.gradient(world)
+        dx, dy = np.gradient(world, axis=(1, 2))
 
         # Calculate the velocity field
-        u = amplitude * (-dy)
-        v = amplitude * dx
+        for frame in range(world.shape[0]):
+            yield np.stack((amplitude * (-dy[frame]), amplitude * dx[frame]), axis=-1)
+
+def generate_turbulent_velocity_field(grid_size, num_frames, amplitude = 10000, persistence=0.5, lacunarity=2.0, scale=500.0,
+                                      octaves=6, seed=0):
+    """
+    Generate all frames of a turbulent velocity field from the gradient of Perlin noise.
+    See iter_turbulent_velocity_field for the parameters; this function collects its
+    frames into one array.
+    Outputs:
+        frames (numpy.ndarray): Array of shape (num_frames, grid_size, grid_size, 2).
+    Examples:
+        turbulent_frames = generate_turbulent_velocity_field(grid_size, num_frames)
+    """
+    frames = np.empty((num_frames, grid_size, grid_size, 2))
+    for index, frame in enumerate(iter_turbulent_velocity_field(grid_size, num_frames, amplitude, persistence,
+                                                                lacunarity, scale, octaves, seed)):
+        frames[index] = frame
+    return frames
+
+def iter_spectral_velocity_field(grid_size, num_frames, rms_velocity=1.0, spectral_slope=5/3,
+                                 correlation_frames=10.0, seed=0):
+    """
+    Lazily generate the frames of a periodic, divergence-free turbulent velocity field
+    synthesized in Fourier space. The streamfunction has random phases and an amplitude
+    chosen so that the energy spectrum follows E(k) ~ k^(-spectral_slope). Its Fourier
+    modes evolve from frame to frame as independent Ornstein-Uhlenbeck processes, so
+    frames are correlated in time while the statistics stay stationary. The velocity is
+    obtained from spectral derivatives of the streamfunction, u = -d(psi)/dy and
+    v = d(psi)/dx, so its divergence is zero.
+    Inputs:
+        grid_size (int): Number of grid points along each side of a frame.
+        num_frames (int): Number of frames.
+        rms_velocity (float): Root-mean-square speed of the field.
+        spectral_slope (float): Slope of the energy spectrum (5/3 for the inertial range).
+        correlation_frames (float): Number of frames over which the modes decorrelate.
+        seed (int): Seed of the random phases; the same seed gives the same frames.
+    Outputs:
+        Yields one (grid_size, grid_size, 2) array per frame.
+    Examples:
+        save_frames_to_npy(iter_spectral_velocity_field(1024, 1000), 'frames.npy', num_frames=1000)
+    """
+    rng = np.random.default_rng(seed)
+
+    # Wavenumbers of the real FFT layout, with x along axis 0 and y along axis 1
+    kx = 2 * np.pi * np.fft.fftfreq(grid_size)[:, np.newaxis]
+    ky = 2 * np.pi * np.fft.rfftfreq(grid_size)[np.newaxis, :]
+    k = np.hypot(kx, ky)
+
+    # |psi_hat|^2 ~ E(k) / k^3 in two dimensions; drop the mean and Nyquist modes
+    spectrum = np.zeros_like(k)
+    nonzero = k > 0
+    spectrum[nonzero] = k[nonzero] ** (-(spectral_slope + 3) / 2)
+    if grid_size % 2 == 0:
+        spectrum[grid_size // 2, :] = 0
+        spectrum[:, -1] = 0
+
+    def random_modes():
+        return (rng.standard_normal(k.shape) + 1j * rng.standard_normal(k.shape)) / np.sqrt(2)
+
+    memory = np.exp(-1.0 / correlation_frames)
+    modes = random_modes()
+    normalization = None
+    for frame in range(num_frames):
+        if frame > 0:
+            modes = memory * modes + np.sqrt(1 - memory**2) * random_modes()
+        psi_hat = spectrum * modes
+        u = np.fft.irfft2(-1j * ky * psi_hat, s=(grid_size, grid_size))
+        v = np.fft.irfft2(1j * kx * psi_hat, s=(grid_size, grid_size))
 
-        # Append the frame to the list
-        frames.append(np.stack((u, v), axis=-1))
+        # Use the same normalization for every frame to keep the statistics stationary
+        if normalization is None:
+            normalization = rms_velocity / np.sqrt(np.mean(u**2 + v**2))
+        yield np.stack((normalization * u, normalization * v), axis=-1)
 
+def generate_spectral_velocity_field(grid_size, num_frames, rms_velocity=1.0, spectral_slope=5/3,
+                                     correlation_frames=10.0, seed=0):
+    """
+    Generate all frames of a divergence-free turbulent velocity field synthesized in
+    Fourier space. See iter_spectral_velocity_field for the parameters; this function
+    collects its frames into one array.
+    Outputs:
+        frames (numpy.ndarray): Array of shape (num_frames, grid_size, grid_size, 2).
+    Examples:
+        turbulent_frames = generate_spectral_velocity_field(256, 100, seed=1)
+    """
+    frames = np.empty((num_frames, grid_size, grid_size, 2))
+    for index, frame in enumerate(iter_spectral_velocity_field(grid_size, num_frames, rms_velocity, spectral_slope,
+                                                               correlation_frames, seed)):
+        frames[index] = frame
     return frames
 
-def save_frames_to_csv(frames, folder_path="turbulent_frames"):
+def save_frames_to_csv(frames, folder_path="turbulent_frames", float_format="%r", rows_per_write=65536):
     """
     Save the frames to CSV files. Each CSV file contains the x and y coordinates of the grid points, and the u and v
-    components of the velocity field at each grid point.
+    components of the velocity field at each grid point. Frames are written one at a time as they are produced,
+    so frames can be a lazy iterator and datasets larger than memory can be written.
     Inputs:
-        frames (list): List of frames to be saved.
+        frames (iterable): Frames to be saved, each an array of shape (nx, ny, 2), e.g. an array of frames
+            or the iterator returned by iter_turbulent_velocity_field.
         folder_path (str): Path to the folder where the CSV files will be saved.
+        float_format (str): printf-style format of the velocities. The default writes the shortest
+            representation that reads back exactly; a shorter format such as '%.6g' writes faster.
+        rows_per_write (int): Number of rows formatted in one vectorized string operation.
     Outputs:
         None
     Examples:
@@ -73,39 +279,96 @@ def save_frames_to_csv(frames, folder_path="turbulent_frames"):
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
 
+    row_format = f"%d,%d,{float_format},{float_format}\n"
+    block = None
     for i, frame in enumerate(frames):
         csv_file_path = f"{folder_path}/frame_{i}.csv"
-        header = ["x", "y", "u", "v"]
+        header = "x,y,u,v\n"
 
-        data = [(x, y, u, v) for x, row_x in enumerate(frame) for y, (u, v) in enumerate(row_x)]
+        # Columns x, y, u, v with x along the first axis of the frame; the x and y
+        # columns are only rebuilt when the frame size changes
+        if block is None or block.shape[0] != frame.shape[0] * frame.shape[1]:
+            x, y = np.meshgrid(np.arange(frame.shape[0]), np.arange(frame.shape[1]), indexing='ij')
+            block = np.empty((x.size, 4))
+            block[:, 0] = x.ravel()
+            block[:, 1] = y.ravel()
+        block[:, 2:] = np.reshape(frame, (-1, 2))
 
         with open(csv_file_path, "w", newline="") as csv_file:
-            writer = csv.writer(csv_file)
-            writer.writerow(header)
-            writer.writerows(data)
+            csv_file.write(header)
+            for start in range(0, block.shape[0], rows_per_write):
+                rows = block[start:start + rows_per_write]
+                csv_file.write((row_format * rows.shape[0]) % tuple(rows.ravel().tolist()))
 
         print(f"Frame {i} saved to {csv_file_path}")
 
-def plot_frame(frame, title="Turbulent Velocity Field"):
+def save_frames_to_npy(frames, file_path="turbulent_frames.npy", num_frames=None, dtype=np.float64):
+    """
+    Save the frames to a single binary .npy file of shape (num_frames, nx, ny, 2). The file is written through a
+    memory map one frame at a time, so frames can be a lazy iterator and the dataset can be larger than memory.
+    The file can be opened again without loading it with np.load(file_path, mmap_mode='r').
+    Inputs:
+        frames (iterable): Frames to be saved, each an array of shape (nx, ny, 2).
+        file_path (str): Path of the .npy file.
+        num_frames (int): Number of frames. Required if frames has no length, e.g. for an iterator.
+        dtype (numpy.dtype): Data type stored in the file.
+    Outputs:
+        None
+    Raises:
+        ValueError: If num_frames is missing for an iterator, no frames are given, or the number of frames does
+            not match num_frames.
+    Examples:
+        save_frames_to_npy(iter_turbulent_velocity_field(1024, 1000), 'frames.npy', num_frames=1000)
+    """
+    if num_frames is None:
+        if not hasattr(frames, '__len__'):
+            raise ValueError("num_frames is required when frames is an iterator.")
+        num_frames = len(frames)
+    if num_frames == 0:
+        raise ValueError("No frames were given; the shape of the frames is needed to write the file.")
+
+    stack = None
+    count = 0
+    for i, frame in enumerate(frames):
+        if i >= num_frames:
+            raise ValueError(f"More than num_frames={num_frames} frames were given.")
+        if stack is None:
+            stack = np.lib.format.open_memmap(file_path, mode='w+', dtype=dtype, shape=(num_frames,) + np.shape(frame))
+        stack[i] = frame
+        count += 1
+
+    if count != num_frames:
+        raise ValueError(f"Expected {num_frames} frames but {count} were given.")
+    stack.flush()
+
+def plot_frame(frame, title="Turbulent Velocity Field", max_arrows=None, background=None, streamlines=False):
     """
     Plot the velocity field of a frame. The frame is a 3D array of shape (grid_size, grid_size, 2), where the last
-    dimension contains the u and v components of the velocity field.
+    dimension contains the u and v components of the velocity field. Large frames are block-averaged to the
+    number of arrows the figure can show (see quiver_rendering.plot_vector_field), so plotting stays fast.
     Inputs:
         frame (numpy.ndarray): 3D array containing the velocity field.
         title (str): Title of the plot.
+        max_arrows (int): Largest number of arrows along each axis. Defaults to one arrow every 20 pixels.
+        background (str): 'magnitude' or 'vorticity' to show that quantity under the arrows, or None.
+        streamlines (bool): Draw streamlines of the field.
     Outputs:
         None
     Examples:
         plot_frame(frame)
+        plot_frame(frame, background='vorticity', streamlines=True)
     """
     u = frame[:, :, 0]
     v = frame[:, :, 1]
+    # Same layout as plt.quiver(u, v): the second axis is plotted along X
+    x_grid, y_grid = np.meshgrid(np.arange(u.shape[1]), np.arange(u.shape[0]))
 
-    plt.figure(figsize=(8, 8))
-    plt.quiver(u, v, scale=20, scale_units='xy', angles='xy', cmap='viridis')
-    plt.title(title)
-    plt.xlabel('X')
-    plt.ylabel('Y')
+    fig, ax = plt.subplots(figsize=(8, 8))
+    qr.plot_vector_field(ax, x_grid, y_grid, u, v, max_arrows=max_arrows, background=background,
+                         streamlines=streamlines, scale=20, scale_units='xy', angles='xy')
+    ax.set_title(title)
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
     plt.show()
 
 if __name__ == "__main__":
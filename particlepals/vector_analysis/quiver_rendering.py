@@ -0,0 +1,192 @@
+"""
+Module for plotting large vector fields at a bounded cost.
+Matplotlib draws every arrow of a quiver plot, which becomes unusably slow past
+about 10^5 arrows, although a plot a few hundred pixels wide cannot show more than
+a few thousand of them. The functions below reduce a field to the number of arrows
+the axes can display, by keeping every n-th vector or by averaging blocks of
+vectors, before it is plotted. The full-resolution magnitude or vorticity can be
+shown underneath as a raster image, which costs one image however large the field.
+Components:
+    * max_arrows_for_axes - returns the number of arrows that fit in axes at a given spacing in pixels.
+    * decimation_steps - returns the grid strides that keep a quiver plot readable.
+    * decimate_field - thins out a gridded field by striding or block averaging.
+    * bin_vectors - averages scattered vectors, e.g. particle velocities, on a coarse grid.
+    * plot_vector_field - plots a decimated quiver, with an optional raster and streamlines.
+Examples:
+    fig, ax = plt.subplots()
+    plot_vector_field(ax, x_grid, y_grid, u_grid, v_grid, background='vorticity', streamlines=True)
+    # Scattered particle velocities
+    plot_vector_field(ax, *bin_vectors(x, y, u, v, max_arrows_for_axes(ax)))
+"""
+import warnings
+
+import numpy as np
+
+def max_arrows_for_axes(ax, spacing=20):
+    """
+    Returns the number of arrows along each axis of a quiver plot that fit in the
+    axes with "spacing" screen pixels between neighbouring arrows.
+
+    Parameters:
+        ax (matplotlib.axes.Axes): The axes the field is plotted in.
+        spacing (float): Distance in pixels between neighbouring arrows.
+
+    Returns:
+        tuple: (arrows along y, arrows along x), at least 1 each.
+    """
+    bbox = ax.get_window_extent()
+    return (max(int(bbox.height // spacing), 1), max(int(bbox.width // spacing), 1))
+
+def decimation_steps(shape, max_arrows=40):
+    """
+    Returns the strides along the rows and columns of a grid that leave at most
+    max_arrows arrows along each axis of a quiver plot.
+
+    Parameters:
+        shape (tuple): (ny, nx) shape of the grid; leading dimensions are ignored.
+        max_arrows (int or tuple): Largest number of arrows along each axis,
+            or (largest along y, largest along x).
+
+    Returns:
+        tuple: (row stride, column stride).
+    """
+    limits = np.broadcast_to(max_arrows, 2)
+    return tuple(max(int(np.ceil(size / limit)), 1) for size, limit in zip(shape[-2:], limits))
+
+def _block_mean(grid, steps):
+    """
+    Averages (row stride, column stride) blocks of the last two axes of a grid,
+    ignoring NaN values. Blocks cut off by the edges are averaged over what remains.
+    """
+    ny, nx = grid.shape[-2:]
+    by, bx = steps
+    pad = [(0, 0)] * (grid.ndim - 2) + [(0, -ny % by), (0, -nx % bx)]
+    padded = np.pad(np.asarray(grid, dtype=float), pad, constant_values=np.nan)
+    blocks = padded.reshape(padded.shape[:-2] + (padded.shape[-2] // by, by, padded.shape[-1] // bx, bx))
+    with warnings.catch_warnings():
+        # Blocks without any valid value stay NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(blocks, axis=(-3, -1))
+
+def decimate_field(x_grid, y_grid, u_grid, v_grid, max_arrows=40, method='mean'):
+    """
+    Reduces a gridded vector field to at most max_arrows arrows along each axis.
+
+    Parameters:
+        x_grid, y_grid (numpy.ndarray): (ny, nx) spatial grids.
+        u_grid, v_grid (numpy.ndarray): (ny, nx) velocity grids, or (n_frames, ny, nx) stacks.
+        max_arrows (int or tuple): Largest number of arrows along each axis (see decimation_steps).
+        method (str): 'stride' keeps every n-th vector, which is fastest and reads
+            the fewest values; 'mean' averages the vectors and positions of each block,
+            so small-scale features are smoothed instead of aliased.
+
+    Returns:
+        x_grid, y_grid, u_grid, v_grid (numpy.ndarray): The decimated grids.
+
+    Raises:
+        ValueError: If the method is not 'stride' or 'mean'.
+    """
+    steps = decimation_steps(np.shape(x_grid), max_arrows)
+    if method == 'stride':
+        slices = (Ellipsis, slice(None, None, steps[0]), slice(None, None, steps[1]))
+        return x_grid[slices[1:]], y_grid[slices[1:]], u_grid[slices], v_grid[slices]
+    if method == 'mean':
+        if steps == (1, 1):
+            return x_grid, y_grid, u_grid, v_grid
+        return tuple(_block_mean(grid, steps) for grid in (x_grid, y_grid, u_grid, v_grid))
+    raise ValueError(f"Invalid method '{method}'. Valid methods are 'stride' and 'mean'.")
+
+def bin_vectors(x, y, u, v, max_arrows=40, extent=None):
+    """
+    Averages scattered vectors, such as the velocities of tracked particles, in
+    the cells of a regular grid. Cells without vectors are NaN and are not drawn.
+
+    Parameters:
+        x, y (numpy.ndarray): Positions of the vectors.
+        u, v (numpy.ndarray): Components of the vectors.
+        max_arrows (int or tuple): Number of cells along each axis, or
+            (cells along y, cells along x).
+        extent (tuple): (xmin, xmax, ymin, ymax) of the grid. Defaults to the
+            range of the positions.
+
+    Returns:
+        x_grid, y_grid, u_grid, v_grid (numpy.ndarray): The cell centres and mean vectors.
+    """
+    x, y, u, v = (np.asarray(values, dtype=float).ravel() for values in (x, y, u, v))
+    valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(u) & np.isfinite(v)
+    x, y, u, v = x[valid], y[valid], u[valid], v[valid]
+    ny, nx = np.broadcast_to(max_arrows, 2)
+    if extent is None:
+        extent = (x.min(), x.max(), y.min(), y.max()) if x.size else (0.0, 1.0, 0.0, 1.0)
+    x_edges = np.linspace(extent[0], extent[1], nx + 1)
+    y_edges = np.linspace(extent[2], extent[3], ny + 1)
+
+    inside = (x >= x_edges[0]) & (x <= x_edges[-1]) & (y >= y_edges[0]) & (y <= y_edges[-1])
+    column = np.clip(np.searchsorted(x_edges, x[inside], side='right') - 1, 0, nx - 1)
+    row = np.clip(np.searchsorted(y_edges, y[inside], side='right') - 1, 0, ny - 1)
+    cell = row * nx + column
+    counts = np.bincount(cell, minlength=ny * nx).reshape(ny, nx)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u_grid = np.bincount(cell, u[inside], minlength=ny * nx).reshape(ny, nx) / counts
+        v_grid = np.bincount(cell, v[inside], minlength=ny * nx).reshape(ny, nx) / counts
+
+    x_grid, y_grid = np.meshgrid((x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2)
+    return x_grid, y_grid, u_grid, v_grid
+
+def plot_vector_field(ax, x_grid, y_grid, u_grid, v_grid, max_arrows=None, method='mean',
+                      background=None, streamlines=False, cmap='viridis', **quiver_kwargs):
+    """
+    Plots a vector field with a bounded number of arrows.
+
+    Parameters:
+        ax (matplotlib.axes.Axes): The axes to plot in.
+        x_grid, y_grid (numpy.ndarray): (ny, nx) spatial grids, with x varying along
+            the columns and y along the rows, as produced by reshape_csv_file.
+        u_grid, v_grid (numpy.ndarray): (ny, nx) velocity grids.
+        max_arrows (int or tuple): Largest number of arrows along each axis.
+            Defaults to one arrow every 20 pixels of the axes.
+        method (str): Decimation method, 'mean' or 'stride' (see decimate_field).
+        background (str or numpy.ndarray): 'magnitude' or 'vorticity' to show that
+            quantity of the full-resolution field as a raster under the arrows, or
+            an (ny, nx) array to show. None shows no raster.
+        streamlines (bool): Draw streamlines of the decimated field.
+        cmap (str): Colormap of the raster.
+        quiver_kwargs: Options of Axes.quiver.
+
+    Returns:
+        matplotlib.quiver.Quiver: The quiver of the decimated field.
+
+    Raises:
+        ValueError: If background is not 'magnitude', 'vorticity', an array or None.
+    """
+    if max_arrows is None:
+        max_arrows = max_arrows_for_axes(ax)
+
+    if background is not None:
+        if isinstance(background, str):
+            if background == 'magnitude':
+                raster = np.hypot(u_grid, v_grid)
+            elif background == 'vorticity':
+                # Imported here, as only the vorticity background needs it
+                from . import vector_operations as vo
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    raster = vo.calculate_vorticity(np.asarray(u_grid, dtype=float), np.asarray(v_grid, dtype=float),
+                                                    x_grid, y_grid)
+            else:
+                raise ValueError(f"Invalid background '{background}'. Valid backgrounds are 'magnitude' and 'vorticity'.")
+        else:
+            raster = np.asarray(background)
+        # One image of the whole field, resampled to the screen by matplotlib
+        extent = (x_grid[0, 0], x_grid[0, -1], y_grid[0, 0], y_grid[-1, 0])
+        image = ax.imshow(raster, origin='lower', extent=extent, cmap=cmap, aspect='auto', interpolation='nearest')
+        ax.figure.colorbar(image, ax=ax, label=background if isinstance(background, str) else None)
+
+    if streamlines:
+        # streamplot needs evenly spaced coordinates, which striding preserves
+        x_lines, y_lines, u_lines, v_lines = decimate_field(x_grid, y_grid, u_grid, v_grid, max_arrows, 'stride')
+        if min(x_lines.shape) > 1:
+            ax.streamplot(x_lines[0, :], y_lines[:, 0], np.nan_to_num(u_lines), np.nan_to_num(v_lines),
+                          color='white' if background is not None else 'grey', linewidth=0.7, arrowsize=0.7)
+    x_small, y_small, u_small, v_small = decimate_field(x_grid, y_grid, u_grid, v_grid, max_arrows, method)
+    return ax.quiver(x_small, y_small, u_small, v_small, **quiver_kwargs)
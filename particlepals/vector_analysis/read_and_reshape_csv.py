@@ -36,10 +36,7 @@ from datetime import datetime
 import pandas as pd
 import numpy as np
 
-try:
-    import vector_analysis.vector_operations as vo
-except ModuleNotFoundError:
-    import vector_operations as vo
+from . import vector_operations as vo
 
 def extract_metadata_from_csv(file_path):
     """
@@ -292,6 +289,91 @@ def reshape_csv_file(x_positions, y_positions, u_velocities, v_velocities):
 
     return x_grid, y_grid, u_grid, v_grid
 
+def iterate_csv_folder(folder_path):
+    """
+    The function iterates over the frame CSV files in a folder in frame-number order,
+    reading and reshaping one frame at a time. Only the current frame is held in memory,
+    so arbitrarily long frame sequences can be processed in constant memory.
+    Input:
+    - folder_path: Path to the folder containing the frame_N.csv files.
+    Output (yielded for each frame):
+    - number: The frame number taken from the file name.
+    - x_grid: A 2D array containing x positions.
+    - y_grid: A 2D array containing y positions.
+    - u_grid: A 2D array containing u velocities.
+    - v_grid: A 2D array containing v velocities.
+    Example usage:
+    >>> for number, x_grid, y_grid, u_grid, v_grid in iterate_csv_folder(folder_path):
+    ...     magnitude_grid, angle_grid = vo.calculate_magnitude_and_angle(u_grid, v_grid)
+    """
+    for number, file_name in _list_frame_files(folder_path):
+        x_positions, y_positions, u_velocities, v_velocities = read_csv_file(os.path.join(folder_path, file_name))
+        x_grid, y_grid, u_grid, v_grid = reshape_csv_file(x_positions, y_positions, u_velocities, v_velocities)
+        yield number, x_grid, y_grid, u_grid, v_grid
+
+def _list_frame_files(folder_path):
+    """
+    Return (frame number, file name) pairs of the frame_N.csv files in a folder,
+    sorted by frame number.
+    """
+    # Check if the input folder exists
+    if not os.path.exists(folder_path):
+        raise FileNotFoundError(f"The specified folder '{folder_path}' does not exist.")
+
+    pattern = re.compile(r'frame_(\d+)\.csv$', re.IGNORECASE)
+    frames = []
+    for file_name in os.listdir(folder_path):
+        match = pattern.match(file_name)
+        if match:
+            frames.append((int(match.group(1)), file_name))
+    if not frames:
+        raise FileNotFoundError(f"No frame CSV files found in the directory '{folder_path}'.")
+
+    return sorted(frames)
+
+def read_csv_folder_as_stack(folder_path, mmap_path=None):
+    """
+    The function reads every frame CSV file in a folder and stacks the velocity
+    grids into 3D arrays of shape (n_frames, ny, nx), ordered by frame number.
+    The stacks can be passed directly to the functions in 'vector_operations',
+    which then transform the whole time series with one vectorized call.
+    Input:
+    - folder_path: Path to the folder containing the frame_N.csv files.
+    - mmap_path: Optional path of a .npy file. If given, the stacks are written to
+      a memory-mapped file of shape (2, n_frames, ny, nx) instead of being held in memory.
+    Output:
+    - x_grid: A 2D array containing x positions.
+    - y_grid: A 2D array containing y positions.
+    - u_stack: A 3D array containing u velocities for every frame.
+    - v_stack: A 3D array containing v velocities for every frame.
+    - numbers: A list of the frame numbers in stack order.
+    Example usage:
+    >>> x_grid, y_grid, u_stack, v_stack, numbers = read_csv_folder_as_stack(folder_path)
+    >>> magnitude_stack, angle_stack = vo.calculate_magnitude_and_angle(u_stack, v_stack)
+    """
+    n_frames = len(_list_frame_files(folder_path))
+
+    u_stack = v_stack = None
+    numbers = []
+    for index, (number, frame_x, frame_y, u_grid, v_grid) in enumerate(iterate_csv_folder(folder_path)):
+        if u_stack is None:
+            # Allocate the stacks once the grid size of the first frame is known
+            x_grid, y_grid = frame_x, frame_y
+            shape = (2, n_frames) + x_grid.shape
+            if mmap_path is None:
+                stack = np.empty(shape)
+            else:
+                stack = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.float64, shape=shape)
+            u_stack, v_stack = stack[0], stack[1]
+        elif not (np.array_equal(frame_x, x_grid) and np.array_equal(frame_y, y_grid)):
+            raise ValueError(f"The spatial grid of frame {number} does not match the other frames.")
+
+        u_stack[index] = u_grid
+        v_stack[index] = v_grid
+        numbers.append(number)
+
+    return x_grid, y_grid, u_stack, v_stack, numbers
+
 def convert_grid_to_csv(x_grid, y_grid, u_grid, v_grid, file_path):
     """
     The function converts a grid to a CSV file and saves the CSV file in file_path.
@@ -348,14 +430,13 @@ def convert_grid_to_csv(x_grid, y_grid, u_grid, v_grid, file_path):
 
     # print(f"Grid data saved to '{file_path}'.")
 
-def process_csv_folder(folder_path, operation=None, vector=None):
+def process_csv_folder(folder_path, operation=None, vector=None, progress=None):
     """
     The function processes all CSV files in a folder located in the original folder.
-    It loads all the CSV files in the folder using the functions in 
-    'read_and_reshape_csv'. It performs any processing that you want to do on 
-    the data from functions in module 'vector_operations'. The user inputs 
-    which vector operation to be performed.
-    Analyze each frame and plot the processed frame at each step.
+    It loads all the frame CSV files in the folder into stacks with
+    'read_csv_folder_as_stack'. It performs any processing that you want to do on 
+    the data from functions in module 'vector_operations', on the whole stacks at
+    once. The user inputs which vector operation to be performed.
 
     The processed data is saved in a new folder located in the original folder.
     The name of the new folder is the same as the original folder with the 
@@ -365,14 +446,22 @@ def process_csv_folder(folder_path, operation=None, vector=None):
 
     Inputs:
         folder_path (str): Path to the folder containing the CSV files.
+        operation (str): 'add', 'subtract', 'multiply', 'divide', 'mean', 'median' or None.
+        vector (tuple): (u, v) values used by the arithmetic operations.
+        progress: Optional progress reporter (particle_tracking.progress.ProgressReporter,
+            or any object with start(total, stage) and update() methods). It is updated
+            after every frame is saved, and can stop the processing by raising from update().
     Outputs:
         New folder with processed csv files, metadata, and list of operations performed.
+        Returns the processed u and v grids of the last frame and the frame numbers.
     Examples:
         process_csv_folder(folder_path)
     """
     # Check if the input folder exists
     if not os.path.exists(folder_path):
         raise FileNotFoundError(f"The specified folder '{folder_path}' does not exist.")
+    if operation not in {'add', 'subtract', 'multiply', 'divide', 'mean', 'median', None}:
+        raise ValueError(f"Invalid operation '{operation}'. Valid operations are 'add', 'subtract', 'multiply', 'divide', 'mean', and 'median'.")
 
     numbers = extract_and_check_consecutive_numbers(folder_path)
 
@@ -381,52 +470,38 @@ def process_csv_folder(folder_path, operation=None, vector=None):
     processed_folder_path = os.path.join(folder_path, processed_folder_name)
     os.makedirs(processed_folder_path)
 
-    # Get a list of all CSV files in the input folder
-    csv_files = [file for file in os.listdir(folder_path) if file.lower().endswith('.csv')]
-
-    # Process each CSV file
-    for csv_file in csv_files:
-        # Read and reshape CSV data
-        file_path = os.path.join(folder_path, csv_file)
-        # original_data = read_and_reshape_csv(file_path)
-        # Read CSV file
-        x_positions, y_positions, u_velocities, v_velocities = read_csv_file(file_path)
-        # Reshape CSV file
-        x_grid, y_grid, u_grid, v_grid = reshape_csv_file(x_positions, y_positions, u_velocities, v_velocities)
-
-        # Perform the specified vector operation
-        if operation in {'add', 'subtract', 'multiply', 'divide'}:
-            u_processed_data = vo.operate_on_grid(u_grid, vector=vector[0], operation=operation)
-            v_processed_data = vo.operate_on_grid(v_grid, vector=vector[1], operation=operation)
-        elif operation in {'mean', 'median'}:
-            u_processed_data = vo.fill_in_nan_values_using_filter(u_grid, method=operation)
-            v_processed_data = vo.fill_in_nan_values_using_filter(v_grid, method=operation)
-        elif operation is None:
-            # If operation is empty, don't process data
-            pass
-            # processed_data = original_data
-        else:
-            raise ValueError(f"Invalid operation '{operation}'. Valid operations are 'add', 'subtract', 'multiply', 'divide', 'mean', and 'median'.")
-            
+    # Read all the frames into (n_frames, ny, nx) stacks, in frame-number order
+    frame_files = _list_frame_files(folder_path)
+    x_grid, y_grid, u_stack, v_stack, _ = read_csv_folder_as_stack(folder_path)
+    if progress is not None:
+        progress.start(len(frame_files), 'process')
+
+    # Perform the specified vector operation on the whole stacks, in place
+    if operation in {'add', 'subtract', 'multiply', 'divide'}:
+        vo.operate_on_grid(u_stack, vector=vector[0], operation=operation, out=u_stack)
+        vo.operate_on_grid(v_stack, vector=vector[1], operation=operation, out=v_stack)
+    elif operation in {'mean', 'median'}:
+        # The filter works on single frames
+        for u_grid, v_grid in zip(u_stack, v_stack):
+            vo.fill_in_nan_values_using_filter(u_grid, method=operation, out=u_grid)
+            vo.fill_in_nan_values_using_filter(v_grid, method=operation, out=v_grid)
+
+    for (_, csv_file), u_processed_data, v_processed_data in zip(frame_files, u_stack, v_stack):
+        if operation is not None:
+            # Save the processed data
+            processed_file_path = os.path.join(processed_folder_path, csv_file)
+            convert_grid_to_csv(x_grid, y_grid, u_processed_data, v_processed_data, processed_file_path)
+
+        if progress is not None:
+            progress.update()
 
     if operation is not None:
-        # Save metadata CSV file
-        # metadata_file_path = os.path.join(processed_folder_path, 'metadata.csv')
-        # metadata_df = pd.DataFrame({'ProcessedDate': [datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
-        #                             'OperationPerformed': [operation]})
-        # metadata_df.to_csv(metadata_file_path, index=False)
-
         # Save list of operations performed CSV file
         operations_file_path = os.path.join(processed_folder_path, 'operations_performed.csv')
         operations_df = pd.DataFrame({'ProcessedDate': [datetime.now().strftime('%Y-%m-%d %H:%M:%S')],
                                         'Operation': [operation]})
         operations_df.to_csv(operations_file_path, index=False)
 
-        # Save the processed data
-        processed_file_path = os.path.join(processed_folder_path, csv_file)
-        # processed_data.to_csv(processed_file_path, index=False)
-        convert_grid_to_csv(x_grid, y_grid, u_processed_data, v_processed_data, processed_file_path)
-
         print(f"Processing complete. Processed data saved in '{processed_folder_path}'.")
 
-    return u_processed_data, v_processed_data, numbers
\ No newline at end of file
+    return u_processed_data, v_processed_data, numbers
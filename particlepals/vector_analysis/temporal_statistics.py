@@ -0,0 +1,192 @@
+"""
+Module for computing ensemble statistics of a velocity field over a sequence of frames.
+The statistics are accumulated in a single pass with Welford's algorithm, so only
+running sums of the size of one grid are kept in memory, regardless of the number
+of frames.
+Components:
+    * StreamingFieldStatistics - accumulates the mean, variance and covariance of u and v
+      at every grid point, one frame (or a stack of frames) at a time.
+    * compute_temporal_statistics - computes the statistics of the frame_N.csv files in a folder.
+Examples:
+    # Accumulate statistics frame by frame
+    statistics = StreamingFieldStatistics()
+    for u_grid, v_grid in frames:
+        statistics.update(u_grid, v_grid)
+    mean_u, rms_u = statistics.mean_u, statistics.rms_u
+    # Compute the statistics of a folder of frames
+    x_grid, y_grid, statistics = compute_temporal_statistics(folder_path)
+    stresses = statistics.reynolds_stresses()
+"""
+import numpy as np
+
+from . import read_and_reshape_csv as rrc
+
+class StreamingFieldStatistics:
+    """
+    Single-pass accumulator of per-grid-point statistics of a 2D velocity field.
+
+    Frames are added with update(), either one (ny, nx) frame at a time or as a
+    (n_frames, ny, nx) stack, which is merged with the running statistics using
+    the parallel form of Welford's algorithm. Points where u or v is NaN are skipped,
+    so every grid point keeps its own sample count.
+
+    Attributes:
+        count (numpy.ndarray): Number of valid samples at each grid point.
+        mean_u, mean_v (numpy.ndarray): Mean velocity components.
+        variance_u, variance_v (numpy.ndarray): Variance of the velocity components.
+        covariance_uv (numpy.ndarray): Covariance of u and v.
+        rms_u, rms_v (numpy.ndarray): Root-mean-square velocity fluctuations.
+
+    Example:
+        >>> statistics = StreamingFieldStatistics()
+        >>> statistics.update(u_grid, v_grid)
+        >>> statistics.rms_u
+    """
+
+    def __init__(self, ddof=0):
+        """
+        Parameters:
+            ddof (int): Delta degrees of freedom of the variances. The default of 0 gives
+                the mean squared fluctuations used for Reynolds stresses.
+        """
+        self.ddof = ddof
+        self.n_frames = 0
+        self.count = None
+        self.mean_u = None
+        self.mean_v = None
+        self._m2_u = None
+        self._m2_v = None
+        self._c_uv = None
+
+    def update(self, u_grid, v_grid):
+        """
+        Add a frame or a stack of frames to the statistics.
+
+        Parameters:
+            u_grid (numpy.ndarray): (ny, nx) frame or (n_frames, ny, nx) stack of u velocities.
+            v_grid (numpy.ndarray): (ny, nx) frame or (n_frames, ny, nx) stack of v velocities.
+
+        Raises:
+            ValueError: If the grids do not have the same shape or do not match the previous frames.
+        """
+        u_grid = np.asarray(u_grid, dtype=float)
+        v_grid = np.asarray(v_grid, dtype=float)
+        if u_grid.shape != v_grid.shape or u_grid.ndim not in (2, 3):
+            raise ValueError("u_grid and v_grid must be 2D or 3D arrays with the same shape.")
+        if u_grid.ndim == 2:
+            u_grid = u_grid[np.newaxis]
+            v_grid = v_grid[np.newaxis]
+
+        if self.count is None:
+            shape = u_grid.shape[1:]
+            self.count = np.zeros(shape, dtype=np.int64)
+            self.mean_u = np.zeros(shape)
+            self.mean_v = np.zeros(shape)
+            self._m2_u = np.zeros(shape)
+            self._m2_v = np.zeros(shape)
+            self._c_uv = np.zeros(shape)
+        elif u_grid.shape[1:] != self.count.shape:
+            raise ValueError("Grid shape does not match the previous frames.")
+
+        # Statistics of the new frames, ignoring points where either component is NaN
+        valid = ~(np.isnan(u_grid) | np.isnan(v_grid))
+        count_b = valid.sum(axis=0)
+        safe_count_b = np.maximum(count_b, 1)
+        u_b = np.where(valid, u_grid, 0.0)
+        v_b = np.where(valid, v_grid, 0.0)
+        mean_u_b = u_b.sum(axis=0) / safe_count_b
+        mean_v_b = v_b.sum(axis=0) / safe_count_b
+        du_b = np.where(valid, u_b - mean_u_b, 0.0)
+        dv_b = np.where(valid, v_b - mean_v_b, 0.0)
+        m2_u_b = np.einsum('ijk,ijk->jk', du_b, du_b)
+        m2_v_b = np.einsum('ijk,ijk->jk', dv_b, dv_b)
+        c_uv_b = np.einsum('ijk,ijk->jk', du_b, dv_b)
+
+        # Merge with the running statistics
+        count = self.count + count_b
+        weight = count_b / np.maximum(count, 1)
+        delta_u = mean_u_b - self.mean_u
+        delta_v = mean_v_b - self.mean_v
+        self.mean_u += delta_u * weight
+        self.mean_v += delta_v * weight
+        correction = self.count * weight
+        self._m2_u += m2_u_b + delta_u**2 * correction
+        self._m2_v += m2_v_b + delta_v**2 * correction
+        self._c_uv += c_uv_b + delta_u * delta_v * correction
+        self.count = count
+        self.n_frames += u_grid.shape[0]
+
+    def _normalize(self, moment):
+        """
+        Divide a second moment by the number of degrees of freedom; NaN where there are none.
+        """
+        dof = self.count - self.ddof
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(dof > 0, moment / np.maximum(dof, 1), np.nan)
+
+    @property
+    def variance_u(self):
+        """Variance of u at each grid point."""
+        return self._normalize(self._m2_u)
+
+    @property
+    def variance_v(self):
+        """Variance of v at each grid point."""
+        return self._normalize(self._m2_v)
+
+    @property
+    def covariance_uv(self):
+        """Covariance of u and v at each grid point."""
+        return self._normalize(self._c_uv)
+
+    @property
+    def rms_u(self):
+        """Root-mean-square fluctuation of u at each grid point."""
+        return np.sqrt(self.variance_u)
+
+    @property
+    def rms_v(self):
+        """Root-mean-square fluctuation of v at each grid point."""
+        return np.sqrt(self.variance_v)
+
+    def reynolds_stresses(self):
+        """
+        Return the kinematic Reynolds stresses <u'u'>, <v'v'> and <u'v'> at each grid point.
+
+        Returns:
+            dict: Keys 'uu', 'vv' and 'uv' mapping to numpy arrays.
+        """
+        return {'uu': self.variance_u, 'vv': self.variance_v, 'uv': self.covariance_uv}
+
+def compute_temporal_statistics(folder_path):
+    """
+    Compute the mean field, RMS fluctuations and Reynolds stresses of the frame_N.csv
+    files in a folder. Frames are read one at a time, so memory use does not grow
+    with the number of frames.
+
+    Parameters:
+        folder_path (str): Path to the folder containing the frame CSV files.
+
+    Returns:
+        x_grid (numpy.ndarray): 2D array containing x positions.
+        y_grid (numpy.ndarray): 2D array containing y positions.
+        statistics (StreamingFieldStatistics): The accumulated statistics.
+
+    Raises:
+        ValueError: If the spatial grids of the frames do not match.
+
+    Example:
+        >>> x_grid, y_grid, statistics = compute_temporal_statistics(folder_path)
+        >>> mean_u, rms_u = statistics.mean_u, statistics.rms_u
+    """
+    statistics = StreamingFieldStatistics()
+    x_grid = y_grid = None
+
+    for number, frame_x, frame_y, u_grid, v_grid in rrc.iterate_csv_folder(folder_path):
+        if x_grid is None:
+            x_grid, y_grid = frame_x, frame_y
+        elif not (np.array_equal(frame_x, x_grid) and np.array_equal(frame_y, y_grid)):
+            raise ValueError(f"The spatial grid of frame {number} does not match the other frames.")
+        statistics.update(u_grid, v_grid)
+
+    return x_grid, y_grid, statistics
@@ -0,0 +1,42 @@
+"""
+Test that the numba kernels in field_kernels give the same results as the NumPy
+code of vector_operations.
+"""
+import unittest
+
+import numpy as np
+from particlepals.vector_analysis import vector_operations as vo
+from particlepals.vector_analysis import field_kernels as fk
+
+@unittest.skipIf(fk.numba is None, "numba is not installed")
+class TestFillPass(unittest.TestCase):
+    """
+    Class for comparing fill_in_nan_values_using_filter with both backends.
+    """
+
+    def setUp(self):
+        self.saved = fk.get_backend()
+        rng = np.random.default_rng(0)
+        self.grid = rng.normal(size=(60, 80))
+        self.grid[rng.random(self.grid.shape) < 0.3] = np.nan
+        self.grid[20:30, 30:45] = np.nan
+
+    def tearDown(self):
+        fk.set_backend(self.saved)
+
+    def test_fill_in_nan_values(self):
+        """
+        Test the mean and median filters with one pass, repeated passes and a
+        minimum number of neighbors.
+        """
+        for method in ('mean', 'median'):
+            for options in ({}, {'iterations': None, 'min_neighbors': 3}, {'iterations': 2, 'min_neighbors': 5}):
+                fk.set_backend('numpy')
+                expected = vo.fill_in_nan_values_using_filter(self.grid, method, **options)
+                fk.set_backend('numba')
+                result = vo.fill_in_nan_values_using_filter(self.grid, method, **options)
+                np.testing.assert_array_equal(result[0], expected[0])
+                self.assertEqual(result[1:], expected[1:])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Test the functions and classes in the frame_viewer module.
+"""
+import unittest
+import os
+import shutil
+
+import numpy as np
+from particlepals.vector_analysis import generate_turbulent_velocity_field as gtvf
+from particlepals.vector_analysis import frame_viewer as fv
+
+class TestFrameStack(unittest.TestCase):
+    """
+    Class for testing the open_frame_stack function.
+    """
+
+    test_directory = 'test_viewer_frames'
+    cache_directory = 'test_viewer_cache'
+
+    def setUp(self):
+        self.frames = gtvf.generate_turbulent_velocity_field(6, 3)
+        gtvf.save_frames_to_csv(iter(self.frames), self.test_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_directory, ignore_errors=True)
+        shutil.rmtree(self.cache_directory, ignore_errors=True)
+
+    def test_open_frame_stack(self):
+        """
+        Test that the stack holds the frames, and is reused until a frame changes.
+        """
+        x_grid, y_grid, u_stack, v_stack, numbers = fv.open_frame_stack(self.test_directory, self.cache_directory)
+        self.assertEqual(numbers, [0, 1, 2])
+        self.assertIsInstance(u_stack, np.memmap)
+        # CSV grids have x along the columns, the generated frames along the first axis
+        np.testing.assert_array_equal(u_stack, self.frames[..., 0].transpose(0, 2, 1))
+        np.testing.assert_array_equal(v_stack, self.frames[..., 1].transpose(0, 2, 1))
+        self.assertEqual(len(os.listdir(self.cache_directory)), 2)
+
+        fv.open_frame_stack(self.test_directory, self.cache_directory)
+        self.assertEqual(len(os.listdir(self.cache_directory)), 2)
+
+        gtvf.save_frames_to_csv(iter(2 * self.frames), self.test_directory)
+        _, _, u_stack, _, _ = fv.open_frame_stack(self.test_directory, self.cache_directory)
+        np.testing.assert_array_equal(u_stack, 2 * self.frames[..., 0].transpose(0, 2, 1))
+        # The stack of the earlier frames is deleted
+        self.assertEqual(len(os.listdir(self.cache_directory)), 2)
+
+        # The stacks of other folders are kept
+        other_directory = os.path.join(self.test_directory, 'other')
+        gtvf.save_frames_to_csv(iter(self.frames), other_directory)
+        fv.open_frame_stack(other_directory, self.cache_directory)
+        self.assertEqual(len(os.listdir(self.cache_directory)), 4)
+
+class TestFrameViewer(unittest.TestCase):
+    """
+    Class for testing the FrameViewer class.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x_grid, self.y_grid = np.meshgrid(np.arange(90.0), np.arange(60.0))
+        self.u_stack = rng.normal(size=(4, 60, 90))
+        self.v_stack = rng.normal(size=(4, 60, 90))
+
+    def test_show_reuses_quiver(self):
+        """
+        Test that showing another frame updates the same decimated quiver.
+        """
+        viewer = fv.FrameViewer(self.x_grid, self.y_grid, self.u_stack, self.v_stack,
+                                numbers=[10, 11, 12, 13], max_arrows=30)
+        figure = viewer.show(0)
+        quiver = viewer.quiver
+        self.assertEqual(quiver.N, 30 * 30)
+
+        self.assertIs(viewer.show_number(12), figure)
+        self.assertIs(viewer.quiver, quiver)
+        self.assertEqual(len(viewer.axes.collections), 1)
+        self.assertEqual(viewer.index, 2)
+        np.testing.assert_array_equal(quiver.U, self.u_stack[2, ::2, ::3].ravel())
+        np.testing.assert_array_equal(quiver.V, self.v_stack[2, ::2, ::3].ravel())
+        self.assertEqual(viewer.axes.get_title(), 'Turbulent Velocity Field, Frame 12')
+
+        with self.assertRaises(ValueError):
+            viewer.show_number(99)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+"""
+Test the functions in the generate_turbulent_velocity_field module.
+"""
+import unittest
+import os
+import shutil
+
+import numpy as np
+from particlepals.vector_analysis import generate_turbulent_velocity_field as gtvf
+from particlepals.vector_analysis import read_and_reshape_csv as rrc
+
+class TestPerlinNoise(unittest.TestCase):
+    """
+    Class for testing the perlin_noise_2d function.
+    """
+
+    def test_zero_at_lattice_points(self):
+        """
+        Test that gradient noise vanishes at the lattice points.
+        """
+        x, y = np.meshgrid(np.arange(5.), np.arange(5.))
+        noise = gtvf.perlin_noise_2d(x, y, octaves=1)
+        np.testing.assert_array_almost_equal(noise, np.zeros((5, 5)))
+
+    def test_broadcasting(self):
+        """
+        Test that row and column coordinates are broadcast to a grid
+        with the same values as full coordinate grids.
+        """
+        i = np.arange(4)[:, np.newaxis] / 7
+        j = np.arange(6)[np.newaxis, :] / 7
+        x, y = np.broadcast_arrays(i, j)
+        np.testing.assert_array_equal(gtvf.perlin_noise_2d(i, j), gtvf.perlin_noise_2d(x, y))
+
+
+class TestGenerateTurbulentVelocityField(unittest.TestCase):
+    """
+    Class for testing the velocity field generators.
+    """
+
+    def test_shape(self):
+        """
+        Test that all frames are returned in one array.
+        """
+        frames = gtvf.generate_turbulent_velocity_field(16, 3)
+        self.assertEqual(frames.shape, (3, 16, 16, 2))
+        self.assertTrue(np.all(np.isfinite(frames)))
+
+    def test_reproducible(self):
+        """
+        Test that the same seed gives the same frames
+        and a different seed gives different frames.
+        """
+        frames = gtvf.generate_turbulent_velocity_field(16, 2, seed=3)
+        np.testing.assert_array_equal(frames, gtvf.generate_turbulent_velocity_field(16, 2, seed=3))
+        self.assertFalse(np.allclose(frames, gtvf.generate_turbulent_velocity_field(16, 2, seed=4)))
+
+    def test_spectral_field(self):
+        """
+        Test that the spectral field is reproducible, has the requested
+        rms velocity and is divergence free.
+        """
+        frames = gtvf.generate_spectral_velocity_field(32, 3, rms_velocity=2.0, seed=1)
+        self.assertEqual(frames.shape, (3, 32, 32, 2))
+        np.testing.assert_array_equal(frames, gtvf.generate_spectral_velocity_field(32, 3, rms_velocity=2.0, seed=1))
+        self.assertAlmostEqual(np.sqrt(np.mean(frames[0, :, :, 0]**2 + frames[0, :, :, 1]**2)), 2.0)
+
+        # Divergence computed with spectral derivatives, x along axis 0 and y along axis 1
+        k = 2 * np.pi * np.fft.fftfreq(32)
+        u_hat = np.fft.fft2(frames[2, :, :, 0])
+        v_hat = np.fft.fft2(frames[2, :, :, 1])
+        divergence = np.fft.ifft2(1j * k[:, np.newaxis] * u_hat + 1j * k[np.newaxis, :] * v_hat).real
+        self.assertLess(np.abs(divergence).max(), 1e-10)
+
+    def test_iterators_match_arrays(self):
+        """
+        Test that the lazy generators yield the same frames as the array versions.
+        """
+        frames = list(gtvf.iter_turbulent_velocity_field(8, 3))
+        self.assertEqual(len(frames), 3)
+        np.testing.assert_array_equal(np.stack(frames), gtvf.generate_turbulent_velocity_field(8, 3))
+        frames = list(gtvf.iter_spectral_velocity_field(8, 3, seed=2))
+        np.testing.assert_array_equal(np.stack(frames), gtvf.generate_spectral_velocity_field(8, 3, seed=2))
+
+
+class TestSaveFrames(unittest.TestCase):
+    """
+    Class for testing the functions that save frames.
+    """
+
+    test_directory = 'test_frames_directory'
+
+    def tearDown(self):
+        shutil.rmtree(self.test_directory, ignore_errors=True)
+
+    def test_save_frames_to_csv(self):
+        """
+        Test that frames streamed to CSV files read back exactly.
+        """
+        frames = gtvf.generate_turbulent_velocity_field(4, 2)
+        gtvf.save_frames_to_csv(iter(frames), self.test_directory, rows_per_write=5)
+
+        self.assertEqual(sorted(os.listdir(self.test_directory)), ['frame_0.csv', 'frame_1.csv'])
+        x_positions, y_positions, u_velocities, v_velocities = rrc.read_csv_file(
+            os.path.join(self.test_directory, 'frame_1.csv'))
+        np.testing.assert_array_equal(x_positions, np.repeat(np.arange(4), 4))
+        np.testing.assert_array_equal(y_positions, np.tile(np.arange(4), 4))
+        np.testing.assert_array_equal(u_velocities, frames[1, :, :, 0].ravel())
+        np.testing.assert_array_equal(v_velocities, frames[1, :, :, 1].ravel())
+
+    def test_save_frames_to_npy(self):
+        """
+        Test that frames streamed to a .npy file read back exactly,
+        that an iterator needs the number of frames, and that empty input is refused.
+        """
+        os.makedirs(self.test_directory)
+        file_path = os.path.join(self.test_directory, 'frames.npy')
+        gtvf.save_frames_to_npy(gtvf.iter_spectral_velocity_field(8, 3), file_path, num_frames=3)
+        np.testing.assert_array_equal(np.load(file_path), gtvf.generate_spectral_velocity_field(8, 3))
+
+        with self.assertRaises(ValueError):
+            gtvf.save_frames_to_npy(gtvf.iter_spectral_velocity_field(8, 3), file_path)
+        with self.assertRaises(ValueError):
+            gtvf.save_frames_to_npy(gtvf.iter_spectral_velocity_field(8, 2), file_path, num_frames=3)
+        for frames, num_frames in (([], None), (iter([]), 0), (gtvf.iter_spectral_velocity_field(8, 0), 0)):
+            with self.assertRaises(ValueError):
+                gtvf.save_frames_to_npy(frames, file_path, num_frames=num_frames)
+
+if __name__ == '__main__':
+    unittest.main()
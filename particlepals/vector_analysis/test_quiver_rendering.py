@@ -0,0 +1,110 @@
+"""
+Test the functions in the quiver_rendering module.
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+import unittest
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from particlepals.vector_analysis import quiver_rendering as qr
+
+class TestQuiverRendering(unittest.TestCase):
+    """
+    Class for testing the functions in the quiver_rendering module.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x_grid, self.y_grid = np.meshgrid(np.arange(500.0), np.arange(400.0))
+        self.u_grid = rng.normal(size=(400, 500))
+        self.v_grid = rng.normal(size=(400, 500))
+
+    def tearDown(self):
+        plt.close('all')
+
+    def test_decimation_steps(self):
+        """
+        Test that the strides leave at most max_arrows arrows along each axis.
+        """
+        self.assertEqual(qr.decimation_steps((30, 30), 40), (1, 1))
+        self.assertEqual(qr.decimation_steps((100, 41), 40), (3, 2))
+        self.assertEqual(qr.decimation_steps((5, 100, 80), 40), (3, 2))
+        self.assertEqual(qr.decimation_steps((100, 80), (10, 40)), (10, 2))
+
+    def test_decimate_field(self):
+        """
+        Test striding and block averaging, including blocks cut off by the edges
+        and NaN values.
+        """
+        x_grid, y_grid, u_grid, v_grid = qr.decimate_field(self.x_grid, self.y_grid, self.u_grid,
+                                                            self.v_grid, 30, 'stride')
+        self.assertEqual(u_grid.shape, (29, 30))
+        np.testing.assert_array_equal(u_grid, self.u_grid[::14, ::17])
+        np.testing.assert_array_equal(x_grid, self.x_grid[::14, ::17])
+
+        u_grid = np.arange(35.0).reshape(5, 7)
+        u_grid[0, 0] = np.nan
+        x_grid, y_grid, u_mean, _ = qr.decimate_field(u_grid, u_grid, u_grid, u_grid, 3, 'mean')
+        self.assertEqual(u_mean.shape, (3, 3))
+        self.assertAlmostEqual(u_mean[0, 0], np.mean([1, 2, 7, 8, 9]))
+        self.assertAlmostEqual(u_mean[2, 2], 34.0)
+
+        with self.assertRaises(ValueError):
+            qr.decimate_field(u_grid, u_grid, u_grid, u_grid, 3, 'median')
+
+    def test_bin_vectors(self):
+        """
+        Test that scattered vectors are averaged in their grid cells.
+        """
+        x = np.array([0.1, 0.2, 1.9, np.nan])
+        y = np.array([0.1, 0.3, 1.9, 1.0])
+        u = np.array([1.0, 3.0, 5.0, 7.0])
+        x_grid, y_grid, u_grid, v_grid = qr.bin_vectors(x, y, u, -u, 2, extent=(0, 2, 0, 2))
+        np.testing.assert_array_equal(x_grid, [[0.5, 1.5], [0.5, 1.5]])
+        np.testing.assert_array_equal(u_grid, [[2.0, np.nan], [np.nan, 5.0]])
+        np.testing.assert_array_equal(v_grid, -u_grid)
+
+    def test_plot_vector_field(self):
+        """
+        Test that the number of arrows is bounded by the size of the axes,
+        and that the rasters and streamlines are drawn.
+        """
+        fig, ax = plt.subplots(figsize=(4, 4), dpi=100)
+        max_arrows = qr.max_arrows_for_axes(ax)
+        quiver = qr.plot_vector_field(ax, self.x_grid, self.y_grid, self.u_grid, self.v_grid)
+        self.assertLessEqual(quiver.N, max_arrows[0] * max_arrows[1])
+
+        fig, ax = plt.subplots()
+        qr.plot_vector_field(ax, self.x_grid, self.y_grid, self.u_grid, self.v_grid, max_arrows=20,
+                             background='vorticity', streamlines=True)
+        self.assertEqual(ax.images[0].get_array().shape, (400, 500))
+        self.assertGreater(len(ax.collections), 1)
+
+        with self.assertRaises(ValueError):
+            qr.plot_vector_field(ax, self.x_grid, self.y_grid, self.u_grid, self.v_grid, background='speed')
+
+    def test_vorticity_background_through_package(self):
+        """
+        Test that the vorticity background is drawn when the module is imported
+        through the particlepals package, with only the repository on sys.path.
+        """
+        spec = importlib.util.find_spec('particlepals')
+        root = os.path.dirname(os.path.dirname(spec.origin))
+        script = ("import matplotlib; matplotlib.use('Agg'); import numpy as np, matplotlib.pyplot as plt; "
+                  "from particlepals.vector_analysis import quiver_rendering as qr; "
+                  "x, y = np.meshgrid(np.arange(50.0), np.arange(40.0)); "
+                  "fig, ax = plt.subplots(); "
+                  "qr.plot_vector_field(ax, x, y, np.sin(y / 5), np.cos(x / 5), background='vorticity'); "
+                  "print(ax.images[0].get_array().shape)")
+        result = subprocess.run([sys.executable, '-c', script], cwd=root, capture_output=True, text=True,
+                                env={**os.environ, 'PYTHONPATH': ''}, check=False)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), '(40, 50)')
+
+if __name__ == '__main__':
+    unittest.main()
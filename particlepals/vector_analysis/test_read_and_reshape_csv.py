@@ -3,10 +3,11 @@ Test the functions in the read_and_reshape_csv module.
 """
 import unittest
 import os
+import shutil
 import warnings
 
 import numpy as np
-import read_and_reshape_csv as rrc
+from particlepals.vector_analysis import read_and_reshape_csv as rrc
 
 class TestReadAndReshapeCSV(unittest.TestCase):
     """
@@ -209,5 +210,71 @@ class TestReadAndReshapeCSV(unittest.TestCase):
         # with self.assertRaises(IndexError):
         #     rrc.reshape_csv_file([1, 2, 3], [4, 5, 6], [0.1, 0.2, 0.3], [1.1, 1.2, 1.3])
 
+    def test_read_csv_folder_as_stack(self):
+        """
+        Test that the function stacks the frames of a folder in frame order.
+        """
+        # Create three frames with a 2x2 grid, written out of order
+        for number in (2, 0, 1):
+            with open(os.path.join(self.test_directory, f'frame_{number}.csv'), 'w') as file:
+                file.write("x,y,u,v\n")
+                for x in (0, 1):
+                    for y in (0, 1):
+                        file.write(f"{x},{y},{number},{-number}\n")
+
+        x_grid, y_grid, u_stack, v_stack, numbers = rrc.read_csv_folder_as_stack(self.test_directory)
+
+        self.assertEqual(numbers, [0, 1, 2])
+        self.assertEqual(x_grid.shape, (2, 2))
+        self.assertEqual(u_stack.shape, (3, 2, 2))
+        np.testing.assert_array_equal(u_stack[:, 0, 0], [0, 1, 2])
+        np.testing.assert_array_equal(v_stack[:, 1, 1], [0, -1, -2])
+
+        # The same stack can be written to a memory-mapped file
+        mmap_path = os.path.join(self.test_directory, 'stack.npy')
+        _, _, u_mapped, v_mapped, _ = rrc.read_csv_folder_as_stack(self.test_directory, mmap_path=mmap_path)
+        np.testing.assert_array_equal(u_mapped, u_stack)
+        del u_mapped, v_mapped
+        self.assertEqual(np.load(mmap_path).shape, (2, 3, 2, 2))
+
+    def test_process_csv_folder(self):
+        """
+        Test that every frame is processed and saved, and that progress is reported per frame.
+        """
+        class Recorder:
+            def start(self, total, stage=''):
+                self.total, self.stage, self.updates = total, stage, 0
+
+            def update(self):
+                self.updates += 1
+
+        folder = os.path.join(self.test_directory, 'frames')
+        os.makedirs(folder)
+        try:
+            for number in range(3):
+                with open(os.path.join(folder, f'frame_{number}.csv'), 'w') as file:
+                    file.write("x,y,u,v\n")
+                    for x in (0, 1):
+                        for y in (0, 1):
+                            file.write(f"{x},{y},{number},{-number}\n")
+
+            recorder = Recorder()
+            u_grid, v_grid, numbers = rrc.process_csv_folder(folder, 'add', (1.0, 2.0), progress=recorder)
+
+            self.assertEqual((recorder.total, recorder.stage, recorder.updates), (3, 'process', 3))
+            self.assertEqual(sorted(numbers), [0, 1, 2])
+            # The grids of the last frame are returned
+            np.testing.assert_array_equal(u_grid, 3.0)
+            np.testing.assert_array_equal(v_grid, 0.0)
+            processed = [name for name in os.listdir(folder) if name.startswith('frames_processed_')]
+            self.assertEqual(len(processed), 1)
+            saved = sorted(os.listdir(os.path.join(folder, processed[0])))
+            self.assertEqual(saved, ['frame_0.csv', 'frame_1.csv', 'frame_2.csv', 'operations_performed.csv'])
+            x, y, u, v = rrc.read_csv_file(os.path.join(folder, processed[0], 'frame_2.csv'))
+            np.testing.assert_array_equal(u, 3.0)
+            np.testing.assert_array_equal(v, 0.0)
+        finally:
+            shutil.rmtree(folder)
+
 if __name__ == '__main__':
     unittest.main()
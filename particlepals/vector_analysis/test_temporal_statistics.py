@@ -0,0 +1,117 @@
+"""
+Test the functions in the temporal_statistics module.
+"""
+import unittest
+import os
+
+import numpy as np
+from particlepals.vector_analysis import read_and_reshape_csv as rrc
+from particlepals.vector_analysis import temporal_statistics as ts
+
+class TestStreamingFieldStatistics(unittest.TestCase):
+    """
+    Class for testing the StreamingFieldStatistics class.
+    """
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.u_stack = rng.normal(1.0, 2.0, size=(20, 3, 4))
+        self.v_stack = 0.5 * self.u_stack + rng.normal(size=(20, 3, 4))
+
+    def test_frame_by_frame(self):
+        """
+        Test that frame-by-frame updates match the statistics
+        computed from the whole stack.
+        """
+        statistics = ts.StreamingFieldStatistics()
+        for u_grid, v_grid in zip(self.u_stack, self.v_stack):
+            statistics.update(u_grid, v_grid)
+
+        np.testing.assert_array_almost_equal(statistics.mean_u, self.u_stack.mean(axis=0))
+        np.testing.assert_array_almost_equal(statistics.mean_v, self.v_stack.mean(axis=0))
+        np.testing.assert_array_almost_equal(statistics.rms_u, self.u_stack.std(axis=0))
+        np.testing.assert_array_almost_equal(statistics.rms_v, self.v_stack.std(axis=0))
+        expected_uv = np.mean((self.u_stack - self.u_stack.mean(axis=0)) * (self.v_stack - self.v_stack.mean(axis=0)), axis=0)
+        np.testing.assert_array_almost_equal(statistics.reynolds_stresses()['uv'], expected_uv)
+        self.assertEqual(statistics.n_frames, 20)
+
+    def test_stack_updates(self):
+        """
+        Test that updating with stacks of frames gives the same
+        statistics as updating frame by frame.
+        """
+        by_frame = ts.StreamingFieldStatistics(ddof=1)
+        for u_grid, v_grid in zip(self.u_stack, self.v_stack):
+            by_frame.update(u_grid, v_grid)
+        by_stack = ts.StreamingFieldStatistics(ddof=1)
+        by_stack.update(self.u_stack[:7], self.v_stack[:7])
+        by_stack.update(self.u_stack[7:], self.v_stack[7:])
+
+        np.testing.assert_array_almost_equal(by_stack.mean_u, by_frame.mean_u)
+        np.testing.assert_array_almost_equal(by_stack.variance_v, by_frame.variance_v)
+        np.testing.assert_array_almost_equal(by_stack.covariance_uv, by_frame.covariance_uv)
+        np.testing.assert_array_almost_equal(by_stack.variance_u, self.u_stack.var(axis=0, ddof=1))
+
+    def test_nan_values_are_skipped(self):
+        """
+        Test that NaN values only reduce the sample count of their grid point.
+        """
+        u_stack = self.u_stack.copy()
+        u_stack[::2, 0, 0] = np.nan
+        statistics = ts.StreamingFieldStatistics()
+        statistics.update(u_stack, self.v_stack)
+
+        self.assertEqual(statistics.count[0, 0], 10)
+        self.assertEqual(statistics.count[1, 1], 20)
+        self.assertAlmostEqual(statistics.mean_u[0, 0], np.mean(self.u_stack[1::2, 0, 0]))
+        self.assertAlmostEqual(statistics.mean_v[0, 0], np.mean(self.v_stack[1::2, 0, 0]))
+
+    def test_shape_mismatch(self):
+        """
+        Test that the class raises error if a frame does not
+        match the previous frames.
+        """
+        statistics = ts.StreamingFieldStatistics()
+        statistics.update(self.u_stack[0], self.v_stack[0])
+        with self.assertRaises(ValueError):
+            statistics.update(np.zeros((2, 2)), np.zeros((2, 2)))
+
+
+class TestComputeTemporalStatistics(unittest.TestCase):
+    """
+    Class for testing the compute_temporal_statistics function.
+    """
+
+    test_directory = 'test_statistics_directory'
+
+    def setUp(self):
+        # Create a temporary directory with a few frames
+        if not os.path.exists(self.test_directory):
+            os.makedirs(self.test_directory)
+
+        x_grid, y_grid = np.meshgrid([0., 1., 2.], [0., 1.])
+        self.u_frames = [x_grid + number for number in range(4)]
+        self.v_frames = [y_grid * number for number in range(4)]
+        for number, (u_grid, v_grid) in enumerate(zip(self.u_frames, self.v_frames)):
+            file_path = os.path.join(self.test_directory, f'frame_{number}.csv')
+            rrc.convert_grid_to_csv(x_grid, y_grid, u_grid, v_grid, file_path)
+
+    def tearDown(self):
+        # Remove the temporary directory and its files
+        for file_name in os.listdir(self.test_directory):
+            os.remove(os.path.join(self.test_directory, file_name))
+        os.rmdir(self.test_directory)
+
+    def test_folder_statistics(self):
+        """
+        Test that the statistics of a folder match those of its frames.
+        """
+        x_grid, y_grid, statistics = ts.compute_temporal_statistics(self.test_directory)
+
+        self.assertEqual(x_grid.shape, (2, 3))
+        self.assertEqual(statistics.n_frames, 4)
+        np.testing.assert_array_almost_equal(statistics.mean_u, np.mean(self.u_frames, axis=0))
+        np.testing.assert_array_almost_equal(statistics.rms_v, np.std(self.v_frames, axis=0))
+
+if __name__ == '__main__':
+    unittest.main()
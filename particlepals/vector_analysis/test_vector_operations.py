@@ -4,7 +4,7 @@ Test the function operate_on_grid() in vector_operations.py.
 import unittest
 from unittest.mock import patch
 import numpy as np
-import vector_operations as vo
+from particlepals.vector_analysis import vector_operations as vo
 
 class TestOperateOnGridFunction(unittest.TestCase):
     """
@@ -115,6 +115,57 @@ class TestOperateOnGridFunction(unittest.TestCase):
             self.assertIsInstance(result, np.ndarray)
 
 
+    def test_stack_with_per_frame_vector(self):
+        """
+        Test that the function applies one value per frame
+        to a stack of grids.
+        """
+        grid = np.ones((3, 2, 2))
+        vector = np.array([1., 2., 3.])
+        result = vo.operate_on_grid(grid, vector, 'multiply')
+        expected_result = np.stack([np.full((2, 2), value) for value in vector])
+        np.testing.assert_array_equal(result, expected_result)
+
+    def test_stack_with_frame_vector(self):
+        """
+        Test that the function applies the same 2D vector
+        to every frame of a stack of grids.
+        """
+        grid = np.zeros((3, 2, 2))
+        vector = np.array([[1, 2], [3, 4]])
+        result = vo.operate_on_grid(grid, vector, 'add')
+        np.testing.assert_array_equal(result, np.broadcast_to(vector, grid.shape))
+
+
+    def test_in_place_operation(self):
+        """
+        Test that the function writes the result into
+        the grid when it is passed as out.
+        """
+        grid = np.ones((2, 2))
+        result = vo.operate_on_grid(grid, 2, 'multiply', out=grid)
+        self.assertIs(result, grid)
+        np.testing.assert_array_equal(grid, np.full((2, 2), 2.))
+
+    def test_divide_by_zero_scalar_in_place(self):
+        """
+        Test that division by a zero scalar gives NaN values
+        when the result is written into out.
+        """
+        grid = np.ones((2, 2))
+        out = np.empty_like(grid)
+        vo.operate_on_grid(grid, 0, 'divide', out=out)
+        np.testing.assert_array_equal(out, np.full_like(grid, np.nan))
+
+    def test_scalar_nan_value(self):
+        """
+        Test that the function raises error if
+        the scalar vector is NaN.
+        """
+        with self.assertRaises(ValueError):
+            vo.operate_on_grid(np.zeros((2, 2)), np.nan, 'add')
+
+
 class TestCalculateMagnitudeAndAngle(unittest.TestCase):
     """
     Class for testing the functions in vector_operations.py.
@@ -131,6 +182,55 @@ class TestCalculateMagnitudeAndAngle(unittest.TestCase):
         np.testing.assert_array_almost_equal(magnitude, np.sqrt(u_grid**2 + v_grid**2))
         np.testing.assert_array_almost_equal(angle, np.arctan2(v_grid, u_grid))
 
+    def test_output_arrays(self):
+        """
+        Test that the function writes the magnitude and
+        angle into the arrays passed as out.
+        """
+        u_grid = np.array([[1., 2.], [3., 4.]])
+        v_grid = np.array([[5., 6.], [7., 8.]])
+        out = (np.empty((2, 2)), np.empty((2, 2)))
+        magnitude, angle = vo.calculate_magnitude_and_angle(u_grid, v_grid, out=out)
+        self.assertIs(magnitude, out[0])
+        self.assertIs(angle, out[1])
+        np.testing.assert_array_almost_equal(magnitude, np.sqrt(u_grid**2 + v_grid**2))
+        np.testing.assert_array_almost_equal(angle, np.arctan2(v_grid, u_grid))
+
+    def test_output_arrays_in_place(self):
+        """
+        Test that the input grids can hold the results, in either order.
+        """
+        for swap in (False, True):
+            u_grid = np.array([[3., -1.], [0., 4.]])
+            v_grid = np.array([[4., 2.], [5., -3.]])
+            expected = (np.hypot(u_grid, v_grid), np.arctan2(v_grid, u_grid))
+            out = (v_grid, u_grid) if swap else (u_grid, v_grid)
+            magnitude, angle = vo.calculate_magnitude_and_angle(u_grid, v_grid, out=out)
+            self.assertIs(magnitude, out[0])
+            np.testing.assert_array_almost_equal(magnitude, expected[0])
+            np.testing.assert_array_almost_equal(angle, expected[1])
+
+    def test_output_arrays_in_place_by_blocks(self):
+        """
+        Test that inputs spanning several blocks are overwritten correctly,
+        including by a transposed view of an input.
+        """
+        rng = np.random.default_rng(0)
+        for shape in ((400, 300), (3, 200, 150)):
+            u_grid = rng.normal(size=shape)
+            v_grid = rng.normal(size=shape)
+            expected = (np.hypot(u_grid, v_grid), np.arctan2(v_grid, u_grid))
+            magnitude, angle = vo.calculate_magnitude_and_angle(u_grid, v_grid, out=(v_grid, u_grid))
+            np.testing.assert_array_almost_equal(magnitude, expected[0])
+            np.testing.assert_array_almost_equal(angle, expected[1])
+
+        u_grid = rng.normal(size=(300, 300))
+        v_grid = rng.normal(size=(300, 300))
+        expected = (np.hypot(u_grid, v_grid), np.arctan2(v_grid, u_grid))
+        magnitude, angle = vo.calculate_magnitude_and_angle(u_grid, v_grid, out=(v_grid.T, np.empty((300, 300))))
+        np.testing.assert_array_almost_equal(magnitude, expected[0])
+        np.testing.assert_array_almost_equal(angle, expected[1])
+
     def test_input_with_nan_values(self):
         """
         Test that the function raises error if
@@ -291,6 +391,17 @@ class TestFillInNaNValuesUsingFilter(unittest.TestCase):
         self.assertEqual(unsuccessful_count, 0)
         self.assertEqual(total_points, 9)
 
+    def test_fill_in_place(self):
+        """
+        Test that the function fills the grid in place
+        when it is passed as out.
+        """
+        grid = np.array([[1, 2, 3], [4, np.nan, 6], [7, 8, 9]])
+        result, replaced_count, _, _ = vo.fill_in_nan_values_using_filter(grid, method='mean', out=grid)
+        self.assertIs(result, grid)
+        self.assertEqual(grid[1, 1], 5.)
+        self.assertEqual(replaced_count, 1)
+
     def test_invalid_method(self):
         """
         Test that the function raises error if
@@ -311,6 +422,62 @@ class TestFillInNaNValuesUsingFilter(unittest.TestCase):
             vo.fill_in_nan_values_using_filter(grid, method='mean')
         self.assertEqual(str(context.exception), "Input must be a 2D numpy array.")
 
+    def test_iterative_fill_of_large_hole(self):
+        """
+        Test that repeated passes fill a hole larger than the
+        3x3 neighborhood from its edges inward.
+        """
+        grid = np.ones((7, 7))
+        grid[1:6, 1:6] = np.nan
+        result, replaced_count, unsuccessful_count, total_points = vo.fill_in_nan_values_using_filter(
+            grid, method='mean', iterations=None, min_neighbors=3)
+        np.testing.assert_array_almost_equal(result, np.ones((7, 7)))
+
+        # Check the counts
+        self.assertEqual(replaced_count, 25)
+        self.assertEqual(unsuccessful_count, 0)
+        self.assertEqual(total_points, 49)
+
+    def test_single_pass_leaves_large_hole(self):
+        """
+        Test that a single pass only replaces NaN values
+        surrounded by enough valid neighbors.
+        """
+        grid = np.ones((7, 7))
+        grid[1:6, 1:6] = np.nan
+        result, replaced_count, unsuccessful_count, _ = vo.fill_in_nan_values_using_filter(grid, method='median')
+
+        # Only the four corners of the hole have a majority of valid neighbors
+        self.assertEqual(replaced_count, 4)
+        self.assertEqual(unsuccessful_count, 21)
+        self.assertTrue(np.isnan(result[3, 3]))
+
+    def test_invalid_iterations(self):
+        """
+        Test that the function raises error if
+        the number of iterations is smaller than 1.
+        """
+        grid = np.array([[1, 2, np.nan], [4, np.nan, 6], [7, 8, 9]])
+        with self.assertRaises(ValueError):
+            vo.fill_in_nan_values_using_filter(grid, method='mean', iterations=0)
+
+    def test_invalid_min_neighbors(self):
+        """
+        Test that the function raises error if the minimum
+        number of neighbors is not between 1 and 8.
+        """
+        # With no valid neighbor required, NaN values were counted as replaced by NaN
+        grid = np.full((3, 3), np.nan)
+        grid[0, 0] = 1.
+        for min_neighbors in (0, -1, 9):
+            with self.assertRaises(ValueError):
+                vo.fill_in_nan_values_using_filter(grid, method='mean', min_neighbors=min_neighbors)
+        result, replaced_count, unsuccessful_count, _ = vo.fill_in_nan_values_using_filter(
+            grid, method='mean', iterations=None, min_neighbors=1)
+        np.testing.assert_array_equal(result, np.ones((3, 3)))
+        self.assertEqual(replaced_count, 8)
+        self.assertEqual(unsuccessful_count, 0)
+
 class TestCalculateVorticity(unittest.TestCase):
     """
     Class for testing the functions in vector_operations.py.
@@ -332,6 +499,27 @@ class TestCalculateVorticity(unittest.TestCase):
         # Check if the shape of the result is the same as input grids
         self.assertEqual(result.shape, u_grid.shape)
 
+    def test_stack_matches_single_frames(self):
+        """
+        Test that the vorticity of a stack of frames is
+        the vorticity of each frame.
+        """
+        rng = np.random.default_rng(0)
+        u_stack = rng.normal(size=(4, 5, 6))
+        v_stack = rng.normal(size=(4, 5, 6))
+        result = vo.calculate_vorticity(u_stack, v_stack)
+        for frame in range(4):
+            np.testing.assert_array_almost_equal(result[frame], vo.calculate_vorticity(u_stack[frame], v_stack[frame]))
+
+    def test_solid_body_rotation(self):
+        """
+        Test that the vorticity of a solid body rotation
+        is twice its angular velocity, using the grid spacing.
+        """
+        x_grid, y_grid = np.meshgrid(np.linspace(-1, 1, 5), np.linspace(-2, 2, 9))
+        result = vo.calculate_vorticity(-y_grid, x_grid, x_grid, y_grid)
+        np.testing.assert_array_almost_equal(result, np.full(x_grid.shape, 2.))
+
     def test_invalid_input_type(self):
         """
         Test that the function raises error if
@@ -360,4 +548,70 @@ class TestCalculateVorticity(unittest.TestCase):
         v_grid = np.array([[9, 8, 7], [6, 5, 4], [3, 2, 1]])
 
         with self.assertWarns(UserWarning):
-            vo.calculate_vorticity(u_grid, v_grid)
\ No newline at end of file
+            vo.calculate_vorticity(u_grid, v_grid)
+
+
+class TestCalculateFlowQuantities(unittest.TestCase):
+    """
+    Class for testing the functions in vector_operations.py.
+    """
+
+    def setUp(self):
+        self.x_grid, self.y_grid = np.meshgrid(np.linspace(0, 4, 9), np.linspace(0, 3, 7))
+
+    def test_rotation(self):
+        """
+        Test the quantities of a solid body rotation, which is
+        all rotation and no strain.
+        """
+        results = vo.calculate_flow_quantities(-self.y_grid, self.x_grid, self.x_grid, self.y_grid)
+        shape = self.x_grid.shape
+        np.testing.assert_array_almost_equal(results['divergence'], np.zeros(shape))
+        np.testing.assert_array_almost_equal(results['vorticity'], np.full(shape, 2.))
+        for component in results['strain_rate']:
+            np.testing.assert_array_almost_equal(component, np.zeros(shape))
+        np.testing.assert_array_almost_equal(results['q_criterion'], np.ones(shape))
+        np.testing.assert_array_almost_equal(results['lambda2'], -np.ones(shape))
+        np.testing.assert_array_almost_equal(results['swirling_strength'], np.ones(shape))
+
+    def test_expansion(self):
+        """
+        Test the quantities of a uniform expansion, which has
+        divergence but no rotation.
+        """
+        results = vo.calculate_flow_quantities(self.x_grid, self.y_grid, self.x_grid, self.y_grid,
+                                               quantities=('divergence', 'q_criterion', 'swirling_strength'))
+        self.assertEqual(set(results), {'divergence', 'q_criterion', 'swirling_strength'})
+        shape = self.x_grid.shape
+        np.testing.assert_array_almost_equal(results['divergence'], np.full(shape, 2.))
+        np.testing.assert_array_almost_equal(results['q_criterion'], -np.ones(shape))
+        np.testing.assert_array_almost_equal(results['swirling_strength'], np.zeros(shape))
+
+    def test_stack(self):
+        """
+        Test that a stack of frames gives the quantities
+        of each frame.
+        """
+        rng = np.random.default_rng(0)
+        u_stack = rng.normal(size=(3,) + self.x_grid.shape)
+        v_stack = rng.normal(size=(3,) + self.x_grid.shape)
+        results = vo.calculate_flow_quantities(u_stack, v_stack, self.x_grid, self.y_grid)
+        single = vo.calculate_flow_quantities(u_stack[1], v_stack[1], self.x_grid, self.y_grid)
+        for quantity in ('divergence', 'vorticity', 'q_criterion', 'lambda2', 'swirling_strength'):
+            np.testing.assert_array_almost_equal(results[quantity][1], single[quantity])
+
+    def test_invalid_quantity(self):
+        """
+        Test that the function raises error if
+        an unknown quantity is requested.
+        """
+        with self.assertRaises(ValueError):
+            vo.calculate_flow_quantities(self.x_grid, self.y_grid, quantities=('enstrophy',))
+
+    def test_mismatched_position_grid(self):
+        """
+        Test that the function raises error if
+        the position grids do not match the velocity grids.
+        """
+        with self.assertRaises(ValueError):
+            vo.calculate_flow_quantities(self.x_grid, self.y_grid, np.arange(3), self.y_grid)
@@ -1,10 +1,18 @@
 """
 Module containing functions for performing operations on vector fields. 
+Grids can be single frames (ny, nx) or stacks of frames (n_frames, ny, nx),
+so a whole time series can be processed with one vectorized call. The functions
+accept an optional `out` array (which may be the input itself), so large or
+memory-mapped stacks can be processed without allocating temporaries.
 Components:
     * operate_on_grid - performs addition, subtraction, multiplication, or division of a vector on a grid.
     * calculate_magnitude_and_angle - calculates the magnitude and angle of a vector field.
-    * fill_in_nan_values_using_filter - replaces NaN values in a grid with the mean or median of the values around them.
+    * fill_in_nan_values_using_filter - replaces NaN values in a grid with the mean or median of the values around them,
+      optionally over several passes to fill large holes from the edges inward.
     * calculate_vorticity - calculates the vorticity of a 2D vector field.
+    * calculate_velocity_gradients - calculates the velocity gradient tensor with physical grid spacing.
+    * calculate_flow_quantities - calculates divergence, strain rate, Q-criterion, lambda2 and
+      swirling strength from one shared set of velocity gradients.
 Examples:
     # Perform addition of a vector on a grid
     result = vo.operate_on_grid(grid, vector, 'add')
@@ -12,14 +20,24 @@ Examples:
     magnitude_grid, angle_grid = vo.calculate_magnitude_and_angle(u_grid, v_grid)
     # Fill in NaN values using filter
     result, replaced_count, unsuccessful_count, total_points = vo.fill_in_nan_values_using_filter(grid, 'mean')
+    # Fill large holes by repeating the filter until nothing more can be replaced
+    result, replaced_count, unsuccessful_count, total_points = vo.fill_in_nan_values_using_filter(
+        grid, 'mean', iterations=None, min_neighbors=3)
     # Calculate the vorticity of a 2D vector field
     vorticity = vo.calculate_vorticity(u_grid, v_grid)
+    # Calculate several derived quantities from the same velocity gradients
+    results = vo.calculate_flow_quantities(u_grid, v_grid, x_grid, y_grid, ('divergence', 'q_criterion'))
 """
 import warnings
 import numpy as np
 import pdb
 
-def operate_on_grid(grid, vector, operation):
+from . import field_kernels as fk
+
+# Number of elements per block when results overwrite their inputs
+_BLOCK_SIZE = 1 << 16
+
+def operate_on_grid(grid, vector, operation, out=None):
     """
     Perform addition, subtraction, multiplication, or division 
     of a vector on a grid. The vector can be a scalar or 
@@ -27,14 +45,21 @@ def operate_on_grid(grid, vector, operation):
     the same value is added to each element in the grid. If a
     2D numpy array, the vector is added element-wise to the grid.
 
+    The grid can also be a stack of frames with shape (n_frames, ny, nx).
+    In that case the vector can be a scalar, a (ny, nx) array applied to
+    every frame, a (n_frames,) array holding one value per frame, or an
+    array with the same shape as the stack.
+
     Parameters:
-        grid (numpy.ndarray): 2D numpy array.
-        vector (scalar or numpy.ndarray): Scalar or 2D numpy array with the same shape as grid.
+        grid (numpy.ndarray): 2D numpy array or 3D stack of 2D grids.
+        vector (scalar or numpy.ndarray): Scalar or numpy array broadcastable to grid as described above.
         operation (str): The mathematical operation to be performed. 
             Options: 'add', 'subtract', 'multiply', 'divide'.
+        out (numpy.ndarray, optional): Array with the same shape as grid in which
+            the result is stored. Pass the grid itself to operate in place.
 
     Returns:
-        result (numpy.ndarray): 2D numpy array with the same shape as grid.
+        result (numpy.ndarray): numpy array with the same shape as grid (out, if given).
 
     Raises:
         ValueError: If the shape of the vector is not the same as the shape of the grid.
@@ -52,11 +77,15 @@ def operate_on_grid(grid, vector, operation):
         raise TypeError("Vector must be a scalar or a numpy.ndarray of valid type.")
 
     if np.isscalar(vector):
-        vector = np.full_like(grid, vector)  # Broadcast scalar to grid shape
+        # Scalars are broadcast by numpy without building a full grid
+        if np.isnan(vector):
+            raise ValueError("Vector contains NaN values.")
 
-    # Perform additional checks for vector as 2D numpy array
-    if isinstance(vector, np.ndarray):
-        if vector.shape != grid.shape:
+    # Perform additional checks for vector as numpy array
+    elif isinstance(vector, np.ndarray):
+        if grid.ndim == 3 and vector.ndim == 1 and vector.shape[0] == grid.shape[0]:
+            vector = vector[:, np.newaxis, np.newaxis]  # One value per frame
+        elif vector.shape != grid.shape and vector.shape != grid.shape[-2:]:
             raise ValueError("Vector shape must be the same as grid shape.")
         if np.isnan(vector).any():
             raise ValueError("Vector contains NaN values.")
@@ -66,15 +95,15 @@ def operate_on_grid(grid, vector, operation):
     # Perform element-wise operations based on the specified operation
     with np.errstate(divide='warn', invalid='warn'):
         if operation == 'add':
-            result = grid + vector
+            result = np.add(grid, vector, out=out)
         elif operation == 'subtract':
-            result = grid - vector
+            result = np.subtract(grid, vector, out=out)
         elif operation == 'multiply':
-            result = grid * vector
+            result = np.multiply(grid, vector, out=out)
         elif operation == 'divide':
             with np.errstate(divide='ignore'):
-                result = grid / vector
-            result[np.isinf(result)] = np.nan
+                result = np.divide(grid, vector, out=out)
+            np.copyto(result, np.nan, where=np.isinf(result))
 
     # Issue warning if NaN values are present in the result
     # if np.any(np.isnan(result)):
@@ -82,17 +111,22 @@ def operate_on_grid(grid, vector, operation):
 
     return result
 
-def calculate_magnitude_and_angle(u_grid, v_grid):
+def calculate_magnitude_and_angle(u_grid, v_grid, out=None):
     """
     Calculate the magnitude and angle of a vector field.
+    The grids can be single frames or (n_frames, ny, nx) stacks.
 
     Input:
-        u_grid (numpy.ndarray): 2D numpy array containing the x-component of the vector field.
-        v_grid (numpy.ndarray): 2D numpy array containing the y-component of the vector field.
+        u_grid (numpy.ndarray): 2D or 3D numpy array containing the x-component of the vector field.
+        v_grid (numpy.ndarray): 2D or 3D numpy array containing the y-component of the vector field.
+        out (tuple, optional): Pair of arrays (magnitude_grid, angle_grid) in which the results are
+            stored, which may be the input grids themselves. No other arrays the size of the
+            grids are allocated; results that overwrite the inputs are computed in blocks
+            along the first axis.
 
     Output:
-        magnitude_grid (numpy.ndarray): 2D numpy array containing the magnitude of the vector field.
-        angle_grid (numpy.ndarray): 2D numpy array containing the angle of the vector field.
+        magnitude_grid (numpy.ndarray): numpy array containing the magnitude of the vector field.
+        angle_grid (numpy.ndarray): numpy array containing the angle of the vector field.
     Usage:
         magnitude_grid, angle_grid = calculate_magnitude_and_angle(u_grid, v_grid)
     """
@@ -101,11 +135,40 @@ def calculate_magnitude_and_angle(u_grid, v_grid):
         if np.isnan(u_grid).any() or np.isnan(v_grid).any():
             raise ValueError("Input grids contain NaN values.")
 
-        # Calculate magnitude
-        magnitude_grid = np.sqrt(u_grid**2 + v_grid**2)
-
-        # Calculate angle
-        angle_grid = np.arctan2(v_grid, u_grid)
+        if out is None:
+            magnitude_grid = np.empty(np.broadcast_shapes(u_grid.shape, v_grid.shape))
+            angle_grid = np.empty_like(magnitude_grid)
+        else:
+            magnitude_grid, angle_grid = out
+
+        if any(np.shares_memory(result, grid) for result in (magnitude_grid, angle_grid)
+               for grid in (u_grid, v_grid)):
+            # The results overwrite the inputs (e.g. out=(u_grid, v_grid)), so they are
+            # computed block by block along the first axis (rows of a frame, frames of a
+            # stack): both results of a block are computed before either is written,
+            # and the temporaries stay the size of one block
+            u_full = np.broadcast_to(u_grid, magnitude_grid.shape)
+            v_full = np.broadcast_to(v_grid, magnitude_grid.shape)
+            if not all(_same_layout(result, grid) for result in (magnitude_grid, angle_grid)
+                       for grid in (u_grid, v_grid) if np.shares_memory(result, grid)):
+                # A block of the results could overlap later blocks of the inputs
+                u_full, v_full = u_full.copy(), v_full.copy()
+            step = max(1, _BLOCK_SIZE // max(1, magnitude_grid[0].size))
+            for start in range(0, magnitude_grid.shape[0], step):
+                block = slice(start, start + step)
+                magnitude = np.sqrt(np.square(u_full[block]) + np.square(v_full[block]))
+                angle = np.arctan2(v_full[block], u_full[block])
+                magnitude_grid[block] = magnitude
+                angle_grid[block] = angle
+        else:
+            # Calculate magnitude, using angle_grid as scratch space for v**2
+            np.square(u_grid, out=magnitude_grid)
+            np.square(v_grid, out=angle_grid)
+            magnitude_grid += angle_grid
+            np.sqrt(magnitude_grid, out=magnitude_grid)
+
+            # Calculate angle
+            np.arctan2(v_grid, u_grid, out=angle_grid)
 
         # Check for NaN values in the results
         if np.isnan(magnitude_grid).any() or np.isnan(angle_grid).any():
@@ -117,7 +180,31 @@ def calculate_magnitude_and_angle(u_grid, v_grid):
         # Handle any other exceptions
         raise e
 
-def fill_in_nan_values_using_filter(grid, method):
+def _same_layout(result, grid):
+    """
+    Returns True if result and grid are the same view of their memory, so that
+    each element of result overwrites the corresponding element of grid.
+    """
+    return (result.shape == grid.shape and result.strides == grid.strides
+            and result.__array_interface__['data'][0] == grid.__array_interface__['data'][0])
+
+def _sum_of_neighbors(values):
+    """
+    Sum each element's 3x3 neighborhood, excluding the element itself.
+    Elements outside the grid contribute zero, so this is a convolution
+    with a ring kernel and zero padding, done with eight shifted slices.
+    """
+    rows, cols = values.shape
+    padded = np.pad(values, 1)
+    total = np.zeros_like(values)
+    for di in range(3):
+        for dj in range(3):
+            if di == 1 and dj == 1:
+                continue
+            total += padded[di:di + rows, dj:dj + cols]
+    return total
+
+def fill_in_nan_values_using_filter(grid, method, iterations=1, min_neighbors=None, out=None):
     """
     Locate NaN values in a grid and replace them with either the
     mean or median of the values immediately next to them.
@@ -125,6 +212,15 @@ def fill_in_nan_values_using_filter(grid, method):
     Parameters:
         grid (numpy.ndarray): 2D numpy array.
         method (str): The method to be applied. Options: 'mean' or 'median'.
+        iterations (int or None): Number of filling passes. Each pass may use the
+            values filled by the previous one, so holes shrink from their edges
+            inward. None repeats until no further NaN value can be replaced.
+        min_neighbors (int or None): Minimum number of valid neighbors needed to
+            replace a NaN value. By default more than half of the neighbors
+            inside the grid must be valid. Large holes usually need a lower
+            value such as 3 to be filled iteratively. Must be between 1 and 8.
+        out (numpy.ndarray, optional): Array with the same shape as grid in which the
+            result is stored. Pass the grid itself to fill it in place.
 
     Returns:
         result (numpy.ndarray): 2D numpy array with the same shape as grid.
@@ -133,23 +229,27 @@ def fill_in_nan_values_using_filter(grid, method):
         total_points (int): Total number of non-NaN points in the grid.
 
     Notes:
-        The function iterates over each NaN value in the grid and replaces it with the
-        mean or median of the non-NaN values in its 3x3 neighborhood, excluding itself.
-        Values that have already been replaced by the mean or median filter are ignored
-        in future replacements to prevent reusing them. If more than 3 out of the 9 values
-        used to compute the mean or median are NaN values, the NaN value is not replaced.
+        Every NaN value in a pass is replaced at once with the mean or median of
+        the non-NaN values in its 3x3 neighborhood, excluding itself. The mean
+        uses sum and count kernels over the neighborhood; the median uses a
+        sliding window view restricted to the NaN values being replaced. Values
+        replaced during a pass are ignored until the next pass to prevent reusing
+        them. If more than half of the values around a NaN value are NaN values,
+        the NaN value is not replaced. With the numba backend (see field_kernels),
+        float64 grids are filled by a compiled pass over the NaN values only, with
+        the same results.
 
     Example:
         >>> grid = np.array([[1, 2, np.nan], [4, np.nan, 6], [7, 8, 9]])
         >>> result, replaced_count, unsuccessful_count, total_points = fill_in_nan_values_using_filter(grid, method='mean')
         >>> print(result)
-        [[1. 2. NaN]
-         [4. 5. 6.]
-         [7. 8. 9.]]
+        [[1.         2.         4.        ]
+         [4.         5.28571429 6.        ]
+         [7.         8.         9.        ]]
         >>> print(replaced_count)
-        1
+        2
         >>> print(unsuccessful_count)
-        1
+        0
         >>> print(total_points)
         9
     """
@@ -161,64 +261,235 @@ def fill_in_nan_values_using_filter(grid, method):
     if method not in {'mean', 'median'}:
         raise ValueError("Invalid method. Choose from 'mean' or 'median'.")
 
-    result = grid.copy()
+    # Check for a valid number of iterations
+    if iterations is not None and iterations < 1:
+        raise ValueError("Number of iterations must be at least 1.")
 
-    # Find the indices of NaN values in the grid
-    nan_indices = np.isnan(grid)
+    # Check for a valid number of neighbors; with none required, a NaN value with
+    # only NaN neighbors would be "replaced" by NaN
+    if min_neighbors is not None and not 1 <= min_neighbors <= 8:
+        raise ValueError("Minimum number of neighbors must be between 1 and 8.")
 
-    # Set a flag for each replaced NaN value to avoid reusing them
-    replaced_flags = np.zeros_like(grid, dtype=bool)
+    if out is None:
+        result = grid.copy()
+    else:
+        if out.shape != grid.shape:
+            raise ValueError("Output array must have the same shape as the grid.")
+        if out is not grid:
+            np.copyto(out, grid)
+        result = out
 
     # Initialize counters
     replaced_count = 0
-    unsuccessful_count = 0
     total_points = grid.size # np.sum(~nan_indices)
 
-    # Iterate over each NaN value and replace it
-    for i, j in zip(*np.where(nan_indices)):
-        if not replaced_flags[i, j]:
-            neighbors = []
-
-            # Iterate over the 3x3 neighborhood around the NaN value
-            nan_count = 0
-            for x in range(max(0, i - 1), min(grid.shape[0], i + 2)):
-                for y in range(max(0, j - 1), min(grid.shape[1], j + 2)):
-                    if not (x == i and y == j):
-                        if np.isnan(grid[x, y]):
-                            nan_count += 1
-                        elif not replaced_flags[x, y]:
-                            neighbors.append(grid[x, y])
-
-            # Replace NaN only if fewer than 4 NaN values in the neighborhood
-            # pdb.set_trace()
-            if len(neighbors) > (len(neighbors) + nan_count) // 2:
-                # Replace NaN with mean or median of neighbors
-                if method == 'mean':
-                    result[i, j] = np.mean(neighbors)
-                elif method == 'median':
-                    result[i, j] = np.median(neighbors)
-
-                # Set the flag for the replaced NaN value
-                replaced_flags[i, j] = True
-                replaced_count += 1
-            else:
-                unsuccessful_count += 1
+    # Number of neighbors that fall inside the grid (3 at corners, 5 at edges, 8 inside)
+    available = _sum_of_neighbors(np.ones(grid.shape, dtype=np.uint8))
+    if min_neighbors is None:
+        required = available // 2 + 1
+    else:
+        required = min_neighbors
+
+    nan_indices = np.isnan(result)
+    # The compiled pass only visits the NaN points (see field_kernels)
+    compiled = fk.use_numba() and result.dtype == np.float64
+    if compiled:
+        required_grid = np.broadcast_to(np.asarray(required, dtype=np.intp), grid.shape)
+    passes = 0
+    while nan_indices.any() and (iterations is None or passes < iterations):
+        passes += 1
+
+        if compiled:
+            rows, cols, values = fk.fill_pass(result, nan_indices, required_grid, method == 'median')
+            if rows.size == 0:
+                break
+            result[rows, cols] = values
+            nan_indices[rows, cols] = False
+            replaced_count += rows.size
+            continue
+
+        # Count the valid neighbors of every point
+        valid = ~nan_indices
+        valid_count = _sum_of_neighbors(valid.astype(np.uint8))
+
+        # Replace NaN only if enough of its neighbors are valid
+        replace = nan_indices & (valid_count >= required)
+        rows, cols = np.nonzero(replace)
+        if rows.size == 0:
+            break
+
+        if method == 'mean':
+            neighbor_sum = _sum_of_neighbors(np.where(valid, result, 0.0))
+            values = neighbor_sum[rows, cols] / valid_count[rows, cols]
+        elif method == 'median':
+            padded = np.pad(result.astype(float), 1, constant_values=np.nan)
+            windows = np.lib.stride_tricks.sliding_window_view(padded, (3, 3))
+            # The centre of each window is NaN, so nanmedian only sees the neighbors
+            values = np.nanmedian(windows[rows, cols].reshape(rows.size, 9), axis=1)
+
+        result[rows, cols] = values
+        nan_indices[rows, cols] = False
+        replaced_count += rows.size
+
+    unsuccessful_count = int(np.count_nonzero(nan_indices))
 
     return result, replaced_count, unsuccessful_count, total_points
 
-def calculate_vorticity(u_grid, v_grid):
+def _check_velocity_grids(u_grid, v_grid):
+    """
+    Validate a pair of velocity grids and warn if they contain NaN values.
+    """
+    # Check if inputs are numpy arrays
+    if not isinstance(u_grid, np.ndarray) or not isinstance(v_grid, np.ndarray) or u_grid.ndim not in (2, 3) or v_grid.ndim not in (2, 3):
+        raise TypeError("Input must be 2D or 3D numpy arrays.")
+
+    # Check if inputs have the same shape
+    if u_grid.shape != v_grid.shape:
+        raise ValueError("Input arrays must have the same shape.")
+
+    # Check for NaN values in inputs
+    if np.isnan(u_grid).any() or np.isnan(v_grid).any():
+        nan_percentage = np.sum(np.isnan(u_grid) | np.isnan(v_grid)) / u_grid.size * 100
+        warning_msg = f"UserWarning: Input arrays contain {nan_percentage:.2f}% NaN values. Results may be affected."
+        warnings.warn(warning_msg)
+
+def _grid_coordinates(grid, axis, size):
+    """
+    Return the 1D coordinates along a spatial axis of a position grid, as produced
+    by reshape_csv_file (x varies along the columns, y along the rows).
+    None gives unit spacing.
+    """
+    if grid is None:
+        return 1.0
+    grid = np.asarray(grid, dtype=float)
+    if grid.ndim == 1:
+        coordinates = grid
+    elif axis == -1:
+        coordinates = grid[0, :]
+    else:
+        coordinates = grid[:, 0]
+    if coordinates.size != size:
+        raise ValueError("Position grids must match the shape of the velocity grids.")
+    return coordinates
+
+def calculate_velocity_gradients(u_grid, v_grid, x_grid=None, y_grid=None):
+    """
+    Calculate the four components of the velocity gradient tensor of a 2D vector field
+    using central differences. The grids can also be (n_frames, ny, nx) stacks, in which
+    case the derivatives are only taken along the two spatial axes.
+
+    Parameters:
+        u_grid (numpy.ndarray): 2D or 3D numpy array representing the x-component of the vector field.
+        v_grid (numpy.ndarray): 2D or 3D numpy array representing the y-component of the vector field.
+        x_grid (numpy.ndarray, optional): 2D grid of x positions from reshape_csv_file, or the 1D x coordinates.
+        y_grid (numpy.ndarray, optional): 2D grid of y positions from reshape_csv_file, or the 1D y coordinates.
+            Without position grids the spacing is one grid unit.
+
+    Returns:
+        du_dx, du_dy, dv_dx, dv_dy (numpy.ndarray): Partial derivatives with the same shape as the inputs.
+
+    Example:
+        >>> x_grid, y_grid, u_grid, v_grid = reshape_csv_file(x_positions, y_positions, u_velocities, v_velocities)
+        >>> du_dx, du_dy, dv_dx, dv_dy = calculate_velocity_gradients(u_grid, v_grid, x_grid, y_grid)
+    """
+    _check_velocity_grids(u_grid, v_grid)
+
+    x = _grid_coordinates(x_grid, -1, u_grid.shape[-1])
+    y = _grid_coordinates(y_grid, -2, u_grid.shape[-2])
+
+    du_dy, du_dx = np.gradient(u_grid, y, x, axis=(-2, -1))
+    dv_dy, dv_dx = np.gradient(v_grid, y, x, axis=(-2, -1))
+
+    return du_dx, du_dy, dv_dx, dv_dy
+
+def calculate_flow_quantities(u_grid, v_grid, x_grid=None, y_grid=None, quantities=None):
+    """
+    Calculate derived quantities of a 2D vector field in one pass. The velocity
+    gradients are computed once and shared by every requested quantity.
+
+    Parameters:
+        u_grid (numpy.ndarray): 2D or 3D numpy array representing the x-component of the vector field.
+        v_grid (numpy.ndarray): 2D or 3D numpy array representing the y-component of the vector field.
+        x_grid (numpy.ndarray, optional): Grid of x positions used for the spacing (see calculate_velocity_gradients).
+        y_grid (numpy.ndarray, optional): Grid of y positions used for the spacing (see calculate_velocity_gradients).
+        quantities (iterable of str, optional): Quantities to calculate. Options: 'divergence',
+            'vorticity', 'strain_rate', 'q_criterion', 'lambda2', 'swirling_strength'.
+            By default all of them are calculated.
+
+    Returns:
+        dict: Maps each requested quantity to a numpy array with the same shape as the inputs.
+            'strain_rate' maps to the tuple (s_xx, s_xy, s_yy) of strain-rate tensor components.
+
+    Raises:
+        ValueError: If an unknown quantity is requested.
+
+    Notes:
+        With the velocity gradient tensor A = [[du_dx, du_dy], [dv_dx, dv_dy]], its symmetric
+        part S (strain rate) and antisymmetric part W (rotation rate):
+        * divergence = du_dx + dv_dy
+        * vorticity = dv_dx - du_dy
+        * q_criterion = (|W|^2 - |S|^2) / 2, positive where rotation dominates strain
+        * lambda2 is the middle eigenvalue of S^2 + W^2, treating the planar field as a 3D field
+          without out-of-plane gradients; negative inside vortices
+        * swirling_strength is the imaginary part of the complex eigenvalues of A, zero where
+          the eigenvalues are real
+
+    Example:
+        >>> results = calculate_flow_quantities(u_grid, v_grid, x_grid, y_grid, ('vorticity', 'q_criterion'))
+        >>> vorticity = results['vorticity']
+    """
+    valid_quantities = ('divergence', 'vorticity', 'strain_rate', 'q_criterion', 'lambda2', 'swirling_strength')
+    if quantities is None:
+        quantities = valid_quantities
+    invalid = set(quantities) - set(valid_quantities)
+    if invalid:
+        raise ValueError(f"Invalid quantities {sorted(invalid)}. Choose from {', '.join(valid_quantities)}.")
+
+    du_dx, du_dy, dv_dx, dv_dy = calculate_velocity_gradients(u_grid, v_grid, x_grid, y_grid)
+
+    results = {}
+    if 'divergence' in quantities:
+        results['divergence'] = du_dx + dv_dy
+    if 'vorticity' in quantities:
+        results['vorticity'] = dv_dx - du_dy
+    if 'strain_rate' in quantities:
+        results['strain_rate'] = (du_dx, 0.5 * (du_dy + dv_dx), dv_dy)
+    if 'q_criterion' in quantities:
+        results['q_criterion'] = -0.5 * (du_dx**2 + dv_dy**2) - du_dy * dv_dx
+    if 'lambda2' in quantities:
+        # S^2 + W^2 is the symmetric part of A^2; compute its in-plane eigenvalues
+        m_xx = du_dx**2 + du_dy * dv_dx
+        m_yy = dv_dy**2 + du_dy * dv_dx
+        m_xy = 0.5 * (du_dx + dv_dy) * (du_dy + dv_dx)
+        center = 0.5 * (m_xx + m_yy)
+        radius = np.hypot(0.5 * (m_xx - m_yy), m_xy)
+        # The out-of-plane eigenvalue is zero, so the middle one is the in-plane pair clipped at zero
+        results['lambda2'] = np.minimum(np.maximum(center - radius, 0.0), center + radius)
+    if 'swirling_strength' in quantities:
+        half_trace = 0.5 * (du_dx + dv_dy)
+        determinant = du_dx * dv_dy - du_dy * dv_dx
+        results['swirling_strength'] = np.sqrt(np.maximum(determinant - half_trace**2, 0.0))
+
+    return results
+
+def calculate_vorticity(u_grid, v_grid, x_grid=None, y_grid=None, out=None):
     """
     Calculate the vorticity of a 2D vector field.
+    The grids can also be (n_frames, ny, nx) stacks, in which case the
+    derivatives are only taken along the two spatial axes.
 
     Parameters:
-        u_grid (numpy.ndarray): 2D numpy array representing the x-component of the vector field.
-        v_grid (numpy.ndarray): 2D numpy array representing the y-component of the vector field.
+        u_grid (numpy.ndarray): 2D or 3D numpy array representing the x-component of the vector field.
+        v_grid (numpy.ndarray): 2D or 3D numpy array representing the y-component of the vector field.
+        x_grid (numpy.ndarray, optional): Grid of x positions used for the spacing (see calculate_velocity_gradients).
+        y_grid (numpy.ndarray, optional): Grid of y positions used for the spacing (see calculate_velocity_gradients).
+        out (numpy.ndarray, optional): Array with the same shape as the inputs in which the result is stored.
 
     Returns:
-        numpy.ndarray: 2D numpy array containing the vorticity of the vector field.
+        numpy.ndarray: numpy array with the same shape as the inputs containing the vorticity of the vector field.
 
     Raises:
-        TypeError: If either u_grid or v_grid is not a 2D numpy array.
+        TypeError: If either u_grid or v_grid is not a 2D or 3D numpy array.
         ValueError: If u_grid and v_grid do not have the same shape.
 
     Warns:
@@ -226,34 +497,24 @@ def calculate_vorticity(u_grid, v_grid):
                      of NaN values is displayed.
 
     Notes:
-        The vorticity is calculated as the difference between the y-component partial derivative of u_grid
-        and the x-component partial derivative of v_grid.
+        The vorticity is calculated as the difference between the x-component partial derivative of v_grid
+        and the y-component partial derivative of u_grid.
 
     Example:
         >>> u_grid = np.array([[1, 2, 3], [4, 5, 6], [7, 8, 9]])
         >>> v_grid = np.array([[9, 8, 7], [6, 5, 4], [3, 2, 1]])
         >>> vorticity = calculate_vorticity(u_grid, v_grid)
     """
-    # Check if inputs are numpy arrays
-    if not isinstance(u_grid, np.ndarray) or not isinstance(v_grid, np.ndarray) or u_grid.ndim != 2 or v_grid.ndim != 2:
-        raise TypeError("Input must be 2D numpy arrays.")
-
-    # Check if inputs have the same shape
-    if u_grid.shape != v_grid.shape:
-        raise ValueError("Input arrays must have the same shape.")
+    _check_velocity_grids(u_grid, v_grid)
 
-    # Check for NaN values in inputs
-    if np.isnan(u_grid).any() or np.isnan(v_grid).any():
-        nan_percentage = np.sum(np.isnan(u_grid) | np.isnan(v_grid)) / u_grid.size * 100
-        warning_msg = f"UserWarning: Input arrays contain {nan_percentage:.2f}% NaN values. Results may be affected."
-        warnings.warn(warning_msg)
+    x = _grid_coordinates(x_grid, -1, u_grid.shape[-1])
+    y = _grid_coordinates(y_grid, -2, u_grid.shape[-2])
 
     # Calculate the partial derivatives using central differences
-    du_dx = np.gradient(u_grid, axis=1)
-    dv_dy = np.gradient(v_grid, axis=0)
+    du_dy = np.gradient(u_grid, y, axis=-2)
+    dv_dx = np.gradient(v_grid, x, axis=-1)
 
-    # Calculate the vorticity
-    vorticity = dv_dy - du_dx
+    # Calculate the vorticity, reusing the derivative array unless out is given
+    vorticity = np.subtract(dv_dx, du_dy, out=dv_dx if out is None else out)
 
     return vorticity
-